@@ -5,4 +5,76 @@ const api = axios.create({
   withCredentials: true
 });
 
+// The last body of each GET that came with an ETag. Repeating the GET sends
+// the ETag back as If-None-Match, and a 304 is answered from here, so data
+// that has not changed is not downloaded again.
+const MAX_VALIDATED = 50;
+const validated = new Map();
+
+api.interceptors.request.use((config) => {
+  if ((config.method || "get") === "get") {
+    const cached = validated.get(api.getUri(config));
+    if (cached) {
+      config.headers["If-None-Match"] = cached.etag;
+    }
+    config.validateStatus = (status) => (status >= 200 && status < 300) || status === 304;
+  }
+  return config;
+});
+
+api.interceptors.response.use((response) => {
+  if (response.config.method !== "get") {
+    return response;
+  }
+  const key = api.getUri(response.config);
+  const cached = validated.get(key);
+  if (response.status === 304 && cached) {
+    return { ...response, status: 200, data: cached.data };
+  }
+  if (response.headers.etag) {
+    validated.delete(key);
+    validated.set(key, { etag: response.headers.etag, data: response.data });
+    if (validated.size > MAX_VALIDATED) {
+      validated.delete(validated.keys().next().value);
+    }
+  }
+  return response;
+});
+
+export const getBusinessRules = async () => (await api.get("/config/business-rules")).data;
+
+export const updateBusinessRules = async (rules) => (await api.put("/config/business-rules", rules)).data;
+
+// Money-moving requests carry one Idempotency-Key across retries, so a retry
+// after a timeout or dropped connection cannot charge or credit twice
+export const postIdempotent = async (url, body, retries = 2) => {
+  const headers = { "Idempotency-Key": crypto.randomUUID() };
+  for (let attempt = 0; ; attempt++) {
+    try {
+      return await api.post(url, body, { headers });
+    } catch (error) {
+      const retryable = !error.response || error.response.status >= 500;
+      if (!retryable || attempt >= retries) {
+        throw error;
+      }
+    }
+  }
+};
+
+// Recipients are looked up a page at a time; the server only returns id, name and profileImage
+export const searchUsers = async (q, { limit = 10, cursor } = {}) => {
+  const response = await api.get("/users/search", { params: { q, limit, cursor } });
+  return response.data;
+};
+
+// Balance and transaction changes pushed by the server (GET /events); the browser
+// reconnects by itself. Returns a function that closes the stream.
+export const subscribeEvents = (handlers) => {
+  const source = new EventSource(`${api.defaults.baseURL}/events`, { withCredentials: true });
+  Object.entries(handlers).forEach(([event, handler]) => {
+    source.addEventListener(event, (e) => handler(e.data ? JSON.parse(e.data) : undefined));
+  });
+  return () => source.close();
+};
+
 export default api;
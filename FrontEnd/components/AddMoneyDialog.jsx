@@ -1,6 +1,6 @@
 import React, { useState } from "react";
 import { IconPlus, IconChevronRight, IconCheck } from "@tabler/icons-react";
-import api from "../api/api";
+import { postIdempotent } from "../api/api";
 import PinDialog from "./PinDialog";
 
 export default function AddMoneyDialog({ isOpen, onClose, refreshWallet }) {
@@ -23,7 +23,7 @@ export default function AddMoneyDialog({ isOpen, onClose, refreshWallet }) {
     setError("");
     setIsLoading(true);
     try {
-        await api.post("/wallet/add-money", { 
+        await postIdempotent("/wallet/add-money", { 
                 amount: Number(amount),
                 pin: pin 
             });
@@ -55,7 +55,7 @@ export default function ProfileDialog({ isOpen, onClose, user, onUpdateUser }) {
       onUpdateUser({ ...user, profileImage: response.data.profileImage });
     } catch (error) {
       console.error("Failed to upload image", error);
-      alert("Failed to upload image");
+      alert(error.response?.data?.detail || "Failed to upload image");
     } finally {
       setIsUploading(false);
     }
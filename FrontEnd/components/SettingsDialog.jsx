@@ -1,7 +1,7 @@
 import React, { useState, useEffect } from "react";
 import { IconCopy, IconBuildingBank, IconTrash, IconChevronRight, IconCheck, IconCurrencyRupee, IconSun, IconMoon } from "@tabler/icons-react";
 import { cn } from "@/lib/utils";
-import api from "../api/api";
+import { getBusinessRules, updateBusinessRules } from "../api/api";
 import { useTheme } from "./ThemeProvider";
 import ConfirmationDialog from "./ConfirmationDialog";
 
@@ -21,9 +21,9 @@ export default function SettingsDialog({ isOpen, onClose, user, wallet, onDelete
 
   const fetchBusinessRules = async () => {
     try {
-      const response = await api.get("/config/business-rules");
-      setTransactionLimit(response.data.maxTransferLimit);
-      setNewLimit(response.data.maxTransferLimit);
+      const rules = await getBusinessRules();
+      setTransactionLimit(rules.maxTransferLimit);
+      setNewLimit(rules.maxTransferLimit);
     } catch (error) {
       console.error("Failed to fetch business rules", error);
     }
@@ -31,7 +31,7 @@ export default function SettingsDialog({ isOpen, onClose, user, wallet, onDelete
 
   const handleUpdateLimit = async () => {
     try {
-      await api.put("/config/business-rules", {
+      await updateBusinessRules({
         maxTransferLimit: parseFloat(newLimit)
       });
       setTransactionLimit(parseFloat(newLimit));
@@ -1,4 +1,4 @@
-import React, { useMemo } from "react";
+import React, { useEffect, useMemo, useState } from "react";
 import { 
   AreaChart, 
   Area, 
@@ -11,11 +11,27 @@ import {
   Bar,
   Legend
 } from "recharts";
+import api from "../api/api";
+
+// YYYY-MM-DD in UTC, matching the day buckets returned by the API (createdAt's date part)
+const toDateKey = (d) => d.toISOString().slice(0, 10);
 
 export default function SpendingAnalytics({ transactions = [] }) {
+  const [analytics, setAnalytics] = useState(null);
+
+  // Totals are rolled up on the server; `transactions` only signals that
+  // something changed and the charts should be refreshed
+  useEffect(() => {
+    const today = new Date();
+    const firstMonth = new Date(Date.UTC(today.getUTCFullYear(), today.getUTCMonth() - 5, 1));
+    api.get("/transactions/analytics", { params: { start_date: toDateKey(firstMonth) } })
+      .then((res) => setAnalytics(res.data))
+      .catch((err) => console.error("Failed to load analytics", err));
+  }, [transactions]);
   
   const { monthlyData, dailyData } = useMemo(() => {
-    if (!transactions || transactions.length === 0) {
+    const hasData = analytics && Object.keys(analytics.totals.counts).length > 0;
+    if (!hasData) {
       const mockMonthly = [
         { name: 'Jan', spending: 4000, income: 2400 },
         { name: 'Feb', spending: 3000, income: 1398 },
@@ -35,65 +51,40 @@ export default function SpendingAnalytics({ transactions = [] }) {
     }
 
     const today = new Date();
-    
-    // Helper to check if two dates are same day
-    const isSameDay = (d1, d2) => {
-        return d1.getDate() === d2.getDate() &&
-               d1.getMonth() === d2.getMonth() &&
-               d1.getFullYear() === d2.getFullYear();
-    };
-
-    // Helper to check if two dates are same month
-    const isSameMonth = (d1, d2) => {
-        return d1.getMonth() === d2.getMonth() &&
-               d1.getFullYear() === d2.getFullYear();
-    };
+    const daily = Object.fromEntries(analytics.daily.map(row => [row.period, row]));
+    const monthly = Object.fromEntries(analytics.monthly.map(row => [row.period, row]));
 
     // 1. Last 7 Days Data
     const last7Days = [];
     for (let i = 6; i >= 0; i--) {
         const d = new Date(today);
-        d.setDate(today.getDate() - i);
+        d.setUTCDate(today.getUTCDate() - i);
         last7Days.push(d);
     }
 
     const processedDailyData = last7Days.map(day => {
-        const dayTotal = transactions
-            .filter(tx => tx.created_at && isSameDay(new Date(tx.created_at), day))
-            .reduce((sum, tx) => sum + Number(tx.amount || 0), 0);
-            
+        const row = daily[toDateKey(day)];
         return {
-            day: day.toLocaleString('default', { weekday: 'short' }),
-            fullDate: day.toISOString().split('T')[0], // for uniqueness if needed
-            amount: dayTotal
+            day: day.toLocaleString('default', { weekday: 'short', timeZone: 'UTC' }),
+            fullDate: toDateKey(day),
+            amount: row ? row.debit + row.credit : 0
         };
     });
 
     // 2. Last 6 Months Data
     const last6Months = [];
     for (let i = 5; i >= 0; i--) {
-        const d = new Date(today.getFullYear(), today.getMonth() - i, 1);
+        const d = new Date(Date.UTC(today.getUTCFullYear(), today.getUTCMonth() - i, 1));
         last6Months.push(d);
     }
 
     const processedMonthlyData = last6Months.map(month => {
-        const monthTx = transactions.filter(tx => 
-            tx.created_at && isSameMonth(new Date(tx.created_at), month)
-        );
-
-        const spending = monthTx
-            .filter(tx => tx.type === 'debit' || tx.type === 'Paid') // Handle both potential values to be safe
-            .reduce((sum, tx) => sum + Number(tx.amount || 0), 0);
-            
-        const income = monthTx
-            .filter(tx => tx.type === 'credit' || tx.type === 'Received')
-            .reduce((sum, tx) => sum + Number(tx.amount || 0), 0);
-
+        const row = monthly[toDateKey(month).slice(0, 7)];
         return {
-            name: month.toLocaleString('default', { month: 'short' }),
-            year: month.getFullYear(),
-            spending,
-            income
+            name: month.toLocaleString('default', { month: 'short', timeZone: 'UTC' }),
+            year: month.getUTCFullYear(),
+            spending: row ? row.debit : 0,
+            income: row ? row.credit : 0
         };
     });
 
@@ -101,7 +92,7 @@ export default function SpendingAnalytics({ transactions = [] }) {
       monthlyData: processedMonthlyData, 
       dailyData: processedDailyData 
     };
-  }, [transactions]);
+  }, [analytics]);
 
   return (
     <div className="grid grid-cols-1 lg:grid-cols-2 gap-6 mb-6">
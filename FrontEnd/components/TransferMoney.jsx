@@ -1,10 +1,11 @@
 import { useEffect, useState } from "react";
-import api from "../api/api";
+import { getBusinessRules, postIdempotent, searchUsers } from "../api/api";
 import PinDialog from "./PinDialog";
 import { IconSend, IconCurrencyRupee, IconLoader } from "@tabler/icons-react";
 
 export default function TransferMoney({ refreshWallet }) {
   const [users, setUsers] = useState([]);
+  const [query, setQuery] = useState("");
   const [toUserId, setToUserId] = useState("");
   const [amount, setAmount] = useState("");
   const [isLoading, setIsLoading] = useState(false);
@@ -13,10 +14,16 @@ export default function TransferMoney({ refreshWallet }) {
   const [transactionLimit, setTransactionLimit] = useState(null);
 
   useEffect(() => {
-    api.get("/users").then(res => setUsers(res.data));
-    api.get("/config/business-rules").then(res => setTransactionLimit(res.data.maxTransferLimit));
+    getBusinessRules().then(rules => setTransactionLimit(rules.maxTransferLimit));
   }, []);
 
+  useEffect(() => {
+    const timer = setTimeout(() => {
+      searchUsers(query, { limit: 20 }).then(({ data }) => setUsers(data)).catch(console.error);
+    }, 200);
+    return () => clearTimeout(timer);
+  }, [query]);
+
   const initiateTransfer = () => {
     setError("");
     if (!toUserId || toUserId === "Select User") {
@@ -38,7 +45,7 @@ export default function TransferMoney({ refreshWallet }) {
     setError("");
     setIsLoading(true);
     try {
-      await api.post("/wallet/transfer", {
+      await postIdempotent("/wallet/transfer", {
         toUserId,
         amount: Number(amount),
         pin: pin
@@ -71,6 +78,13 @@ export default function TransferMoney({ refreshWallet }) {
 
         <div className="space-y-2">
             <label className="text-sm font-medium text-neutral-600 dark:text-neutral-400">Recipient</label>
+            <input
+                type="text"
+                className="w-full p-3 rounded-lg border border-neutral-300 dark:border-neutral-600 bg-white dark:bg-neutral-900 text-neutral-800 dark:text-neutral-200 focus:ring-2 focus:ring-blue-500 outline-none transition-all"
+                placeholder="Search by name or email..."
+                value={query}
+                onChange={e => setQuery(e.target.value)}
+            />
             <select 
                 className="w-full p-3 rounded-lg border border-neutral-300 dark:border-neutral-600 bg-white dark:bg-neutral-900 text-neutral-800 dark:text-neutral-200 focus:ring-2 focus:ring-blue-500 outline-none transition-all"
                 value={toUserId}
@@ -40,7 +40,9 @@ export default function BalanceHistoryPage({ onLogout }) {
   const [transactionToDelete, setTransactionToDelete] = useState(null);
   const [users, setUsers] = useState([]);
   const [transactions, setTransactions] = useState([]);
+  const [nextCursor, setNextCursor] = useState(null);
   const [loading, setLoading] = useState(true);
+  const [loadingMore, setLoadingMore] = useState(false);
   
   const [searchQuery, setSearchQuery] = useState("");
   const [showSent, setShowSent] = useState(true);
@@ -55,10 +57,15 @@ export default function BalanceHistoryPage({ onLogout }) {
   const [isSettingsOpen, setIsSettingsOpen] = useState(false);
   const [isProfileOpen, setIsProfileOpen] = useState(false);
 
-  const fetchTransactions = async (overrides = {}) => {
+  const fetchTransactions = async (overrides = {}, cursor = null) => {
     try {
-      setLoading(true);
-      const params = {};
+      if (cursor) {
+        setLoadingMore(true);
+      } else {
+        setLoading(true);
+      }
+      const params = { limit: 50 };
+      if (cursor) params.cursor = cursor;
       
       const sFilter = overrides.status !== undefined ? overrides.status : statusFilter;
       const min = overrides.minAmount !== undefined ? overrides.minAmount : minAmount;
@@ -86,11 +93,13 @@ export default function BalanceHistoryPage({ onLogout }) {
         data = [];
       }
 
-      setTransactions(data);
+      setTransactions(prev => (cursor ? [...prev, ...data] : data));
+      setNextCursor(showSent || showReceived ? res.data.nextCursor : null);
     } catch (err) {
       console.error("Failed to fetch transactions", err);
     } finally {
       setLoading(false);
+      setLoadingMore(false);
     }
   };
 
@@ -487,6 +496,16 @@ export default function BalanceHistoryPage({ onLogout }) {
                                 No transactions found matching your search.
                             </div>
                         )}
+                        {!loading && nextCursor && (
+                            <Button
+                                variant="outline"
+                                onClick={() => fetchTransactions({}, nextCursor)}
+                                disabled={loadingMore}
+                                className="self-center"
+                            >
+                                {loadingMore ? "Loading..." : "Load more"}
+                            </Button>
+                        )}
                     </div>
                 </div>
             </div>
@@ -13,13 +13,20 @@ import {
 } from "@tabler/icons-react";
 import { motion } from "motion/react";
 import { cn } from "@/lib/utils";
-import api from "../api/api";
+import api, { subscribeEvents } from "../api/api";
 import AddMoneyDialog from "../components/AddMoneyDialog";
 import PinDialog from "../components/PinDialog";
 import SettingsDialog from "../components/SettingsDialog";
 import ProfileDialog from "../components/ProfileDialog";
 import SpendingAnalytics from "../components/SpendingAnalytics";
 
+// Newest first, at most the ten /transactions/recent returns
+const mergeRecent = (list, tx) => {
+  const rest = list.filter((t) => t.id !== tx.id);
+  const merged = tx.isDeleted ? rest : [...rest, tx];
+  return merged.sort((a, b) => (a.createdAt < b.createdAt ? 1 : a.createdAt > b.createdAt ? -1 : 0)).slice(0, 10);
+};
+
 export default function Dashboard({ onLogout }) {
   const navigate = useNavigate();
   const [open, setOpen] = useState(false);
@@ -37,6 +44,7 @@ export default function Dashboard({ onLogout }) {
   const [pinMode, setPinMode] = useState("enter");
   const [pinError, setPinError] = useState("");
   const [sessionPin, setSessionPin] = useState(null);
+  const [isLive, setIsLive] = useState(false);
 
   useEffect(() => {
     async function loadUser() {
@@ -99,6 +107,23 @@ export default function Dashboard({ onLogout }) {
       }
   };
 
+  useEffect(() => {
+    if (!sessionPin) return;
+    return subscribeEvents({
+      // Reload once per (re)connect to pick up anything missed while away
+      open: () => {
+        setIsLive(true);
+        refreshWallet();
+      },
+      error: () => setIsLive(false),
+      balance: ({ balance }) => setWallet((w) => (w ? { ...w, balance } : w)),
+      transaction: (tx) => setTransactions((list) => mergeRecent(list, tx)),
+    });
+  }, [sessionPin]);
+
+  // With the event stream open, changes arrive by themselves
+  const afterAction = isLive ? async () => {} : refreshWallet;
+
   const handleDeleteUser = async () => {
       if (confirm("Are you sure you want to delete your account? This action cannot be undone.")) {
           try {
@@ -163,7 +188,7 @@ export default function Dashboard({ onLogout }) {
       <AddMoneyDialog 
         isOpen={isAddMoneyOpen}
         onClose={() => setIsAddMoneyOpen(false)}
-        refreshWallet={refreshWallet}
+        refreshWallet={afterAction}
       />
       <ProfileDialog 
         isOpen={isProfileOpen}
@@ -12,7 +12,7 @@ import {
 import { motion } from "motion/react";
 import { cn } from "@/lib/utils";
 import { Sidebar, SidebarBody, SidebarLink } from "../components/ui/sidebar";
-import api from "../api/api";
+import api, { getBusinessRules, postIdempotent, searchUsers } from "../api/api";
 import PinDialog from "../components/PinDialog";
 import SettingsDialog from "../components/SettingsDialog";
 import ProfileDialog from "../components/ProfileDialog";
@@ -24,7 +24,8 @@ export default function TransferMoneyPage({ onLogout }) {
   
   const [currentUser, setCurrentUser] = useState(null);
   const [searchQuery, setSearchQuery] = useState("");
-  const [users, setUsers] = useState([]);
+  const [suggestions, setSuggestions] = useState([]);
+  const [knownUsers, setKnownUsers] = useState({});
   const [recentTransactions, setRecentTransactions] = useState([]);
   const [transactionLimit, setTransactionLimit] = useState(null);
   const [feePercentage, setFeePercentage] = useState(0);
@@ -48,20 +49,24 @@ export default function TransferMoneyPage({ onLogout }) {
   useEffect(() => {
     api.get("/users/me").then((res) => setCurrentUser(res.data)).catch(console.error);
 
-    api.get("/users").then((res) => setUsers(res.data)).catch(console.error);
-    
     api.get("/transactions/recent").then((res) => setRecentTransactions(res.data)).catch(console.error);
 
-    api.get("/config/business-rules").then((res) => {
-      setTransactionLimit(res.data.maxTransferLimit);
-      setFeePercentage(res.data.feePercentage || 0);
+    getBusinessRules().then((rules) => {
+      setTransactionLimit(rules.maxTransferLimit);
+      setFeePercentage(rules.feePercentage || 0);
     }).catch(console.error);
   }, []);
 
-  const filteredUsers = users.filter(user => 
-    user.name.toLowerCase().includes(searchQuery.toLowerCase()) ||
-    user.email.toLowerCase().includes(searchQuery.toLowerCase())
-  );
+  useEffect(() => {
+    // Wait for a pause in typing before asking the server
+    const timer = setTimeout(() => {
+      searchUsers(searchQuery, { limit: 10 }).then(({ data }) => {
+        setSuggestions(data);
+        setKnownUsers((known) => ({ ...known, ...Object.fromEntries(data.map((u) => [u.id, u])) }));
+      }).catch(console.error);
+    }, 200);
+    return () => clearTimeout(timer);
+  }, [searchQuery]);
 
   const handleUserSelect = (user) => {
     setSelectedUser(user);
@@ -72,7 +77,7 @@ export default function TransferMoneyPage({ onLogout }) {
     setError("");
     setIsLoading(true);
     try {
-      await api.post("/wallet/transfer", {
+      await postIdempotent("/wallet/transfer", {
         toUserId: selectedUser.id,
         amount: Number(amount),
         pin: pin
@@ -181,10 +186,10 @@ export default function TransferMoneyPage({ onLogout }) {
     let amountSign = isDebit ? "-" : "+";
 
     if (isDebit && tx.toUserId) {
-        const user = users.find(u => u.id === tx.toUserId);
+        const user = knownUsers[tx.toUserId];
         name = user ? `To: ${user.name}` : "To: Unknown User";
     } else if (!isDebit && tx.fromUserId) {
-        const user = users.find(u => u.id === tx.fromUserId);
+        const user = knownUsers[tx.fromUserId];
         name = user ? `From: ${user.name}` : "From: Unknown User";
     } else if (!isDebit) {
         name = "Wallet Top-up";
@@ -284,7 +289,6 @@ export default function TransferMoneyPage({ onLogout }) {
                                 </div>
                                 <div className="text-center">
                                     <h2 className="text-2xl font-bold text-neutral-800 dark:text-neutral-200">{selectedUser.name}</h2>
-                                    <p className="text-neutral-500">{selectedUser.email}</p>
                                 </div>
 
                                 <div className="w-full max-w-sm mt-4">
@@ -363,7 +367,7 @@ export default function TransferMoneyPage({ onLogout }) {
                         <div className="mb-10">
                             <h2 className="text-lg font-semibold text-neutral-800 dark:text-neutral-200 mb-4">Suggested People</h2>
                             <div className="grid grid-cols-3 sm:grid-cols-4 md:grid-cols-5 gap-6">
-                                {filteredUsers.slice(0, 10).map((user) => (
+                                {suggestions.map((user) => (
                                 <button 
                                     key={user.id} 
                                     className="flex flex-col items-center gap-3 min-w-[60px] group"
@@ -0,0 +1,111 @@
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from metrics import registry
+
+# Requests that move money; each one commits to the journal
+WRITE_PATHS = frozenset(("/wallet/add-money", "/wallet/transfer", "/wallet/transfer/batch"))
+
+# The businessRules these limits read; only admins may change them
+RULE_KEYS = frozenset(("writeRateLimit", "writeBurstLimit", "maxInFlightWrites"))
+
+writes_rejected = registry.counter(
+    "wallet_writes_rejected_total", "Write requests turned away before running, by reason.", ("reason",))
+writes_in_flight = registry.gauge("wallet_writes_in_flight", "Write requests currently admitted.")
+
+
+class TokenBuckets:
+    """One token bucket per key, refilled at ``rate`` tokens a second up to ``burst``.
+
+    Buckets are created full on first use and the least recently used are
+    dropped beyond ``maxsize``; a dropped key starts full again, which only
+    ever lets a quiet client through. The rate and burst are passed on each
+    call, so a change to them applies to every bucket at once.
+    """
+
+    def __init__(self, maxsize, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.clock = clock
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key, rate, burst):
+        """0 if a token was taken, else the seconds until the next one."""
+        now = self.clock()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            tokens = burst if bucket is None else min(burst, bucket[0] + (now - bucket[1]) * rate)
+            taken = tokens >= 1
+            self._buckets[key] = (tokens - 1 if taken else tokens, now)
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.maxsize:
+                self._buckets.popitem(last=False)
+        return 0 if taken else (1 - tokens) / rate
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+class WriteAdmission:
+    """Decides whether a write request runs now or is turned away at once.
+
+    Limits come from the businessRules on every call, so changing them
+    through /config/business-rules takes effect on the next request:
+
+    * ``writeRateLimit`` writes a second per user, with bursts of up to
+      ``writeBurstLimit`` (default: one second's worth); over it, 429;
+    * ``maxInFlightWrites`` writes running at once in this process; over
+      it, 503.
+
+    A missing or zero limit is not enforced. Rejected requests carry the
+    seconds to wait before retrying.
+    """
+
+    def __init__(self, maxsize):
+        self.buckets = TokenBuckets(maxsize)
+        self.in_flight = 0
+        self._lock = threading.Lock()
+
+    def admit(self, user_id, rules):
+        """None if admitted, which the caller must pair with ``release()``;
+        otherwise ``(status, retry_after, detail)``.
+        """
+        cap = rules.get("maxInFlightWrites") or 0
+        with self._lock:
+            if cap and self.in_flight >= cap:
+                writes_rejected.inc(reason="overloaded")
+                return 503, 1, "Server is busy, try again shortly"
+            rate = rules.get("writeRateLimit") or 0
+            if rate and user_id is not None:
+                burst = rules.get("writeBurstLimit") or max(1, rate)
+                wait = self.buckets.take(user_id, rate, burst)
+                if wait:
+                    writes_rejected.inc(reason="rate_limited")
+                    return 429, max(1, math.ceil(wait)), "Too many requests, slow down"
+            self.in_flight += 1
+        writes_in_flight.inc()
+        return None
+
+    def release(self):
+        with self._lock:
+            self.in_flight -= 1
+        writes_in_flight.dec()
+
+    def stats(self):
+        return {
+            "inFlight": self.in_flight,
+            "users": len(self.buckets),
+            "rejected": {
+                reason: writes_rejected.value(reason=reason) for reason in ("rate_limited", "overloaded")
+            },
+        }
+
+
+write_admission = WriteAdmission(maxsize=int(os.environ.get("WALLET_RATE_LIMIT_USERS", "100000")))
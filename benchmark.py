@@ -0,0 +1,338 @@
+"""Load benchmark for the API hot paths on a seeded synthetic dataset.
+
+    python benchmark.py [--users 100000] [--transactions 10000000]
+                        [--requests 2000] [--concurrency 16] [--seed 1]
+                        [--backend json|columnar|sqlite] [--out benchmark.json]
+                        [--compare previous.json] [--memory]
+                        [--snapshot json|binary]
+
+The dataset uses the same schema as db.json and is fully determined by the
+seed and sizes, so it is generated once into --data-dir and reused. Every
+run works on a fresh copy of it. Each endpoint is driven through TestClient
+from --concurrency threads and gets p50/p95/p99 latency, throughput and
+the process's peak RSS so far. Results are written as JSON; --compare
+prints the change against an earlier result file. With --snapshot binary
+the copy is converted to a binary snapshot before the load is timed;
+setup then also reports how long the background warm-up took.
+
+With --memory nothing is served; instead the resident size of the loaded
+store is measured and reported per million transactions.
+"""
+import argparse
+import gc
+import json
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from pathlib import Path
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+import db
+
+PIN = "1234"
+PASSWORD = "password123"
+EPOCH = datetime(2026, 1, 1)
+
+# Synthetic wallets start rich enough that benchmark transfers never bounce
+START_BALANCE = 1_000_000
+RULES = {"feePercentage": 2, "maxTransferLimit": 500.0}
+
+ENDPOINTS = ("login", "transfer", "transactions", "recent")
+
+
+def user_id(i):
+    return f"u_{i:08x}"
+
+
+def wallet_id(i):
+    return f"w_{i:08x}"
+
+
+def email(i):
+    return f"user{i}@bench.example.com"
+
+
+def generate_dataset(path, users, transactions, seed):
+    """Writes a db.json-shaped file, streaming so 10M transactions fit."""
+    rng = random.Random(seed)
+    span = 365 * 24 * 3600
+    with open(path, "w", encoding="utf-8") as f:
+        f.write('{"users":[')
+        for i in range(users):
+            if i:
+                f.write(",")
+            f.write(json.dumps({
+                "id": user_id(i), "name": f"User {i}", "email": email(i),
+                "password": PASSWORD, "walletId": wallet_id(i), "pin": PIN,
+            }, separators=(",", ":")))
+        f.write('],"wallets":[')
+        for i in range(users):
+            if i:
+                f.write(",")
+            f.write(json.dumps({
+                "id": wallet_id(i), "userId": user_id(i), "balance": START_BALANCE, "currency": "INR",
+            }, separators=(",", ":")))
+        f.write('],"transactions":[')
+        for i in range(transactions):
+            if i:
+                f.write(",")
+            tx_type = "debit" if rng.random() < 0.5 else "credit"
+            amount = rng.randint(1, 500)
+            tx = {
+                "id": f"tx_{i:08x}",
+                "walletId": wallet_id(rng.randrange(users)),
+                "type": tx_type,
+                "amount": amount,
+                "fee": amount * RULES["feePercentage"] / 100 if tx_type == "debit" else 0,
+                "status": "success" if rng.random() < 0.95 else "failed",
+                "isDeleted": False,
+                "createdAt": (EPOCH + timedelta(seconds=rng.randrange(span))).isoformat() + "Z",
+            }
+            f.write(json.dumps(tx, separators=(",", ":")))
+        f.write('],"businessRules":')
+        f.write(json.dumps(RULES))
+        f.write("}")
+
+
+def ensure_dataset(data_dir, users, transactions, seed):
+    data_dir = Path(data_dir)
+    data_dir.mkdir(parents=True, exist_ok=True)
+    dataset = data_dir / f"bench-{seed}-{users}-{transactions}.json"
+    if not dataset.exists():
+        partial = dataset.with_suffix(".partial")
+        generate_dataset(partial, users, transactions, seed)
+        partial.replace(dataset)
+    return dataset
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def percentile(ordered, pct):
+    if not ordered:
+        return None
+    rank = max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered)) - 1))
+    return ordered[rank]
+
+
+def build_request(name, i, users, seed):
+    rng = random.Random(f"{seed}:{name}:{i}")
+    sender = rng.randrange(users)
+    headers = {"Authorization": f"Bearer mock-token-{user_id(sender)}"}
+    if name == "login":
+        return "POST", "/auth/login", {"json": {"email": email(sender), "password": PASSWORD}}
+    if name == "transfer":
+        receiver = (sender + rng.randrange(1, users)) % users
+        payload = {"toUserId": user_id(receiver), "amount": rng.randint(1, 100), "pin": PIN}
+        return "POST", "/wallet/transfer", {"json": payload, "headers": headers}
+    if name == "transactions":
+        return "GET", "/transactions", {"params": {"limit": 50}, "headers": headers}
+    if name == "recent":
+        return "GET", "/transactions/recent", {"headers": headers}
+    raise ValueError(f"Unknown endpoint: {name}")
+
+
+def measure(client, name, requests, concurrency, users, seed):
+    def one(i):
+        method, url, kwargs = build_request(name, i, users, seed)
+        started = time.perf_counter()
+        response = client.request(method, url, **kwargs)
+        return time.perf_counter() - started, response.status_code
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(one, range(requests)))
+    elapsed = time.perf_counter() - started
+
+    latencies = sorted(seconds * 1000 for seconds, _ in results)
+    return {
+        "requests": requests,
+        "errors": sum(1 for _, status in results if status >= 400),
+        "p50Ms": round(percentile(latencies, 50), 3),
+        "p95Ms": round(percentile(latencies, 95), 3),
+        "p99Ms": round(percentile(latencies, 99), 3),
+        "meanMs": round(sum(latencies) / len(latencies), 3),
+        "throughput": round(requests / elapsed, 1),
+        "peakRssMb": peak_rss_mb(),
+    }
+
+
+def run(users=100_000, transactions=10_000_000, requests=2000, concurrency=16, seed=1,
+        backend="json", endpoints=ENDPOINTS, data_dir=".bench", snapshot="json"):
+    from fastapi.testclient import TestClient
+    from dependencies import sessions
+    from main import app
+
+    if users < 2:
+        raise ValueError("Need at least two users to transfer between")
+
+    started = time.perf_counter()
+    dataset = ensure_dataset(data_dir, users, transactions, seed)
+    generate_seconds = time.perf_counter() - started
+
+    saved = db.DB_PATH, db.SQLITE_PATH, db.STORAGE_BACKEND, db.SNAPSHOT_FORMAT
+    with tempfile.TemporaryDirectory(dir=data_dir) as work_dir:
+        try:
+            db.reset_store()
+            db.DB_PATH = Path(work_dir) / "db.json"
+            db.SQLITE_PATH = Path(work_dir) / "wallet.db"
+            db.STORAGE_BACKEND = backend
+            db.SNAPSHOT_FORMAT = snapshot
+            shutil.copyfile(dataset, db.DB_PATH)
+            sessions.clear()
+            if snapshot == "binary" and backend != "sqlite":
+                db.open_store().close()
+
+            started = time.perf_counter()
+            if backend == "sqlite":
+                from migrate import migrate
+                migrate(db.DB_PATH, db.SQLITE_PATH)
+            store = db.get_store()
+            load_seconds = time.perf_counter() - started
+            while store.warming():
+                time.sleep(0.01)
+            warm_seconds = time.perf_counter() - started
+            load_rss = peak_rss_mb()
+
+            results = {}
+            with TestClient(app) as client:
+                for name in endpoints:
+                    results[name] = measure(client, name, requests, concurrency, users, seed)
+            storage_stats = store.stats()
+        finally:
+            db.reset_store()
+            db.DB_PATH, db.SQLITE_PATH, db.STORAGE_BACKEND, db.SNAPSHOT_FORMAT = saved
+
+    return {
+        "meta": {
+            "users": users,
+            "transactions": transactions,
+            "requests": requests,
+            "concurrency": concurrency,
+            "seed": seed,
+            "backend": backend,
+            "snapshot": snapshot,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "startedAt": datetime.utcnow().isoformat() + "Z",
+        },
+        "setup": {
+            "generateSeconds": round(generate_seconds, 3),
+            "loadSeconds": round(load_seconds, 3),
+            "warmSeconds": round(warm_seconds, 3),
+            "peakRssMb": load_rss,
+        },
+        "endpoints": results,
+        "storage": storage_stats,
+    }
+
+
+def store_bytes(dataset, backend):
+    """Memory held by a store loaded from ``dataset``, once loading garbage is freed.
+
+    Counted with tracemalloc, which sees Python objects and NumPy buffers
+    alike and is not skewed by memory the allocator keeps but does not use.
+    """
+    from db import JsonStore
+    with tempfile.TemporaryDirectory(dir=dataset.parent) as work_dir:
+        path = Path(work_dir) / "db.json"
+        shutil.copyfile(dataset, path)
+        gc.collect()
+        tracemalloc.start()
+        try:
+            if backend == "columnar":
+                from columnar_store import ColumnarStore
+                store = ColumnarStore(path)
+            elif backend == "json":
+                store = JsonStore(path)
+            else:
+                raise ValueError("Memory is measured for the in-memory backends (json, columnar) only")
+            gc.collect()
+            size = tracemalloc.get_traced_memory()[0]
+        finally:
+            tracemalloc.stop()
+        store.close()
+    return size
+
+
+def measure_memory(users=1000, transactions=1_000_000, seed=1, backend="json", data_dir=".bench"):
+    """Resident bytes per million transactions, net of users and wallets."""
+    base = store_bytes(ensure_dataset(data_dir, users, 0, seed), backend)
+    full = store_bytes(ensure_dataset(data_dir, users, transactions, seed), backend)
+    per_million = (full - base) / transactions * 1_000_000
+    return {
+        "backend": backend,
+        "users": users,
+        "transactions": transactions,
+        "storeMb": round(full / 2**20, 1),
+        "bytesPerTransaction": round((full - base) / transactions, 1),
+        "mbPerMillionTransactions": round(per_million / 2**20, 1),
+    }
+
+
+def compare(current, previous):
+    """One line per endpoint and metric with the relative change."""
+    lines = []
+    for name, metrics in current["endpoints"].items():
+        before = previous.get("endpoints", {}).get(name)
+        if not before:
+            continue
+        for key in ("p50Ms", "p95Ms", "p99Ms", "throughput", "peakRssMb"):
+            old, new = before.get(key), metrics.get(key)
+            if not old or new is None:
+                continue
+            lines.append(f"{name:<14}{key:<12}{old:>12} -> {new:<12}{(new - old) / old * 100:+.1f}%")
+    return lines
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the API on a synthetic dataset")
+    parser.add_argument("--users", type=int, default=100_000)
+    parser.add_argument("--transactions", type=int, default=10_000_000)
+    parser.add_argument("--requests", type=int, default=2000, help="requests per endpoint")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--backend", choices=("json", "columnar", "sqlite"), default="json")
+    parser.add_argument("--endpoints", nargs="+", choices=ENDPOINTS, default=list(ENDPOINTS))
+    parser.add_argument("--data-dir", default=".bench", help="where generated datasets are kept")
+    parser.add_argument("--out", default="benchmark.json")
+    parser.add_argument("--compare", help="earlier result file to compare against")
+    parser.add_argument("--memory", action="store_true", help="only measure the loaded store's memory")
+    parser.add_argument("--snapshot", choices=("json", "binary"), default="json", help="snapshot format to load from")
+    args = parser.parse_args()
+
+    if args.memory:
+        result = measure_memory(args.users, args.transactions, args.seed, args.backend, args.data_dir)
+        with open(args.out, "w") as f:
+            json.dump({"memory": result}, f, indent=2)
+        print(f"{result['backend']}: {result['bytesPerTransaction']} bytes per transaction, "
+              f"{result['mbPerMillionTransactions']} MB per million")
+        sys.exit(0)
+
+    result = run(args.users, args.transactions, args.requests, args.concurrency, args.seed,
+                 args.backend, args.endpoints, args.data_dir, args.snapshot)
+    with open(args.out, "w") as f:
+        json.dump(result, f, indent=2)
+
+    for name, metrics in result["endpoints"].items():
+        print(f"{name:<14}p50 {metrics['p50Ms']}ms  p95 {metrics['p95Ms']}ms  p99 {metrics['p99Ms']}ms  "
+              f"{metrics['throughput']} req/s  errors {metrics['errors']}  peak RSS {metrics['peakRssMb']} MB")
+    if args.compare:
+        with open(args.compare) as f:
+            print("\n".join(compare(result, json.load(f))))
+    print(f"Results written to {args.out}")
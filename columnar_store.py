@@ -0,0 +1,472 @@
+"""JSON store variant that keeps transactions in NumPy columns.
+
+Selected with WALLET_STORAGE=columnar; needs numpy. Users, wallets, the
+journal and the snapshot format are exactly those of ``db.JsonStore``;
+only the resident form of transactions differs:
+
+* amount and fee are float64, createdAt is int64 microseconds since the
+  epoch, status and type are small integer codes, the wallet and the
+  counterparty (toUserId / fromUserId) are int32 codes, and a uint8 holds
+  per-row flags such as isDeleted;
+* each wallet has an int32 array of its row numbers in (createdAt, id)
+  order, so a wallet's history is a contiguous slice of offsets;
+* anything else on a record (``reason``, unknown keys, a createdAt that
+  does not round-trip) is kept in a per-row dict, usually absent.
+
+The amount and date filters and the status and type filters of
+``query_transactions`` are NumPy masks over the wallet's slice; dicts are
+built only for the rows that are returned.
+"""
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+from db import JsonStore
+from indexes import RECENT_SIZE, Rollup, sum_ledger, tx_key
+
+# Row flags
+DELETED = 1
+AMOUNT_INT = 2
+FEE_INT = 4
+NO_FEE = 8
+FRACTION = 16   # createdAt is written with microseconds
+TO_USER = 32    # counterparty column holds toUserId
+FROM_USER = 64  # counterparty column holds fromUserId
+
+# Record keys that live in columns rather than in the per-row extras
+COLUMN_KEYS = frozenset(("id", "walletId", "type", "amount", "fee", "status", "isDeleted", "createdAt"))
+
+EPOCH = datetime(1970, 1, 1)
+MICROSECOND = timedelta(microseconds=1)
+
+
+def to_micros(text):
+    """Microseconds since the epoch for an ISO-8601 date or timestamp (UTC)."""
+    if text.endswith("Z"):
+        text = text[:-1]
+    moment = datetime.fromisoformat(text)
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(timezone.utc).replace(tzinfo=None)
+    return (moment - EPOCH) // MICROSECOND
+
+
+def format_micros(micros, fraction):
+    moment = EPOCH + timedelta(microseconds=int(micros))
+    return moment.isoformat(timespec="microseconds" if fraction else "seconds") + "Z"
+
+
+class _Codes:
+    """Interns strings as small integers."""
+
+    __slots__ = ("values", "index")
+
+    def __init__(self):
+        self.values = []
+        self.index = {}
+
+    def code(self, value):
+        code = self.index.get(value)
+        if code is None:
+            code = self.index[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+
+class _Columns:
+    FIELDS = (
+        ("wallet", np.int32),
+        ("created", np.int64),
+        ("amount", np.float64),
+        ("fee", np.float64),
+        ("status", np.uint16),
+        ("type", np.uint16),
+        ("counterparty", np.int32),
+        ("flags", np.uint8),
+    )
+
+    def __init__(self, capacity=1024):
+        self.size = 0
+        for name, dtype in self.FIELDS:
+            setattr(self, name, np.zeros(capacity, dtype))
+        self.ids = []
+        self.extras = []
+
+    def append(self):
+        if self.size == len(self.created):
+            for name, dtype in self.FIELDS:
+                grown = np.zeros(self.size * 2, dtype)
+                grown[:self.size] = getattr(self, name)[:self.size]
+                setattr(self, name, grown)
+        row = self.size
+        self.size += 1
+        self.ids.append(None)
+        self.extras.append(None)
+        return row
+
+    def nbytes(self):
+        return sum(getattr(self, name).nbytes for name, _ in self.FIELDS)
+
+    def copy(self):
+        copy = _Columns(0)
+        copy.size = self.size
+        for name, _ in self.FIELDS:
+            setattr(copy, name, getattr(self, name)[:self.size].copy())
+        copy.ids = list(self.ids)
+        copy.extras = list(self.extras)
+        return copy
+
+
+class _WalletRows:
+    """One wallet's row numbers, sorted by (createdAt, id)."""
+
+    __slots__ = ("rows", "n")
+
+    def __init__(self):
+        self.rows = np.zeros(8, np.int32)
+        self.n = 0
+
+    def view(self):
+        return self.rows[:self.n]
+
+    def insert(self, row, columns):
+        created, ids = columns.created, columns.ids
+        key = (created[row], ids[row])
+        n = self.n
+        if n == len(self.rows):
+            grown = np.zeros(n * 2, np.int32)
+            grown[:n] = self.rows
+            self.rows = grown
+        rows = self.rows
+        if n == 0 or key >= (created[rows[n - 1]], ids[rows[n - 1]]):
+            rows[n] = row
+        else:
+            pos = int(np.searchsorted(created[rows[:n]], key[0], "left"))
+            while pos < n and (created[rows[pos]], ids[rows[pos]]) < key:
+                pos += 1
+            rows[pos + 1:n + 1] = rows[pos:n]
+            rows[pos] = row
+        self.n = n + 1
+
+    def remove(self, row, columns):
+        rows = self.rows
+        pos = int(np.searchsorted(columns.created[rows[:self.n]], columns.created[row], "left"))
+        while pos < self.n and rows[pos] != row:
+            pos += 1
+        if pos < self.n:
+            rows[pos:self.n - 1] = rows[pos + 1:self.n]
+            self.n -= 1
+
+
+class ColumnarStore(JsonStore):
+    def load(self):
+        self.columns = _Columns()
+        self.tx_rows = {}
+        self.wallet_rows = {}
+        self.wallet_codes = _Codes()
+        self.user_codes = _Codes()
+        self.status_codes = _Codes()
+        self.type_codes = _Codes()
+        super().load()
+
+    def stats(self):
+        return {
+            **super().stats(),
+            "backend": "columnar",
+            "transactions": len(self.tx_rows),
+            "columnBytes": self.columns.nbytes(),
+        }
+
+    def to_dict(self):
+        with self.lock:
+            data = super().to_dict()
+            data["transactions"] = [self._row_dict(row) for row in self.tx_rows.values()]
+            return data
+
+    # --- Rows ---
+
+    def _write_row(self, row, tx):
+        columns = self.columns
+        extras = {key: value for key, value in tx.items() if key not in COLUMN_KEYS}
+        flags = DELETED if tx.get("isDeleted") else 0
+
+        amount = tx["amount"]
+        if type(amount) is int:
+            flags |= AMOUNT_INT
+        fee = tx.get("fee")
+        if fee is None:
+            flags |= NO_FEE
+            fee = 0
+        elif type(fee) is int:
+            flags |= FEE_INT
+
+        created_at = tx["createdAt"]
+        try:
+            created = to_micros(created_at)
+        except ValueError:
+            created = 0
+        fraction = "." in created_at
+        if format_micros(created, fraction) != created_at:
+            # Keeps odd timestamps verbatim; they still sort by the parsed value
+            extras["createdAt"] = created_at
+        elif fraction:
+            flags |= FRACTION
+
+        counterparty = -1
+        if isinstance(extras.get("toUserId"), str):
+            counterparty = self.user_codes.code(extras.pop("toUserId"))
+            flags |= TO_USER
+        elif isinstance(extras.get("fromUserId"), str):
+            counterparty = self.user_codes.code(extras.pop("fromUserId"))
+            flags |= FROM_USER
+
+        columns.ids[row] = tx["id"]
+        columns.wallet[row] = self.wallet_codes.code(tx["walletId"])
+        columns.created[row] = created
+        columns.amount[row] = amount
+        columns.fee[row] = fee
+        columns.status[row] = self.status_codes.code(tx["status"])
+        columns.type[row] = self.type_codes.code(tx["type"])
+        columns.counterparty[row] = counterparty
+        columns.flags[row] = flags
+        columns.extras[row] = extras or None
+
+    def _row_dict(self, row, columns=None):
+        columns = columns or self.columns
+        flags = int(columns.flags[row])
+        amount = float(columns.amount[row])
+        tx = {
+            "id": columns.ids[row],
+            "walletId": self.wallet_codes.values[columns.wallet[row]],
+            "type": self.type_codes.values[columns.type[row]],
+            "amount": int(amount) if flags & AMOUNT_INT else amount,
+        }
+        if not flags & NO_FEE:
+            fee = float(columns.fee[row])
+            tx["fee"] = int(fee) if flags & FEE_INT else fee
+        if flags & TO_USER:
+            tx["toUserId"] = self.user_codes.values[columns.counterparty[row]]
+        elif flags & FROM_USER:
+            tx["fromUserId"] = self.user_codes.values[columns.counterparty[row]]
+        tx["status"] = self.status_codes.values[columns.status[row]]
+        tx["isDeleted"] = bool(flags & DELETED)
+        tx["createdAt"] = format_micros(columns.created[row], flags & FRACTION)
+        extras = columns.extras[row]
+        if extras:
+            tx.update(extras)
+        return tx
+
+    def _rows_of(self, wallet_id):
+        rows = self.wallet_rows.get(wallet_id)
+        if rows is None:
+            rows = self.wallet_rows[wallet_id] = _WalletRows()
+        return rows
+
+    def _snapshot_transactions(self):
+        # Rows are rewritten in place, so the snapshot is read from a copy of the columns
+        rows = list(self.tx_rows.values())
+        columns = self.columns.copy()
+        return (self._row_dict(row, columns) for row in rows)
+
+    # --- Reads ---
+
+    def get_transaction(self, tx_id):
+        with self.lock:
+            row = self.tx_rows.get(tx_id)
+            if row is None and self._pending:
+                self._page_in_all()
+                row = self.tx_rows.get(tx_id)
+            return None if row is None else self._row_dict(row)
+
+    def _has_transaction(self, tx_id):
+        return tx_id in self.tx_rows
+
+    def _stored_transaction(self, tx_id):
+        row = self.tx_rows.get(tx_id)
+        return None if row is None else self._row_dict(row)
+
+    def get_wallet_transactions(self, wallet_id):
+        self._page_in(wallet_id)
+        with self.lock:
+            rows = self.wallet_rows.get(wallet_id)
+            return [] if rows is None else [self._row_dict(row) for row in rows.view()]
+
+    def recent_transactions(self, wallet_id):
+        self._page_in(wallet_id)
+        with self.lock:
+            rows = self.wallet_rows.get(wallet_id)
+            if rows is None:
+                return []
+            recent = []
+            flags = self.columns.flags
+            for row in rows.view()[::-1]:
+                if not flags[row] & DELETED:
+                    recent.append(self._row_dict(row))
+                    if len(recent) == RECENT_SIZE:
+                        break
+            return recent
+
+    def transaction_analytics(self, wallet_id, start_date=None, end_date=None):
+        self._page_in(wallet_id)
+        with self.lock:
+            rollup = self.rollups.get(wallet_id)
+            if rollup is None:
+                rows = self.wallet_rows.get(wallet_id)
+                if rows is None:
+                    return Rollup(()).query()
+                rollup = self.rollups[wallet_id] = Rollup(self._row_dict(row) for row in rows.view())
+            return rollup.query(start_date, end_date)
+
+    def ledger_totals(self, wallet_id, after=None):
+        self._page_in(wallet_id)
+        with self.lock:
+            wallet_rows = self.wallet_rows.get(wallet_id)
+            if wallet_rows is None:
+                return sum_ledger(())
+            columns = self.columns
+            rows = wallet_rows.view()
+            lo = 0
+            if after is not None:
+                if not len(rows) or tx_key(self._row_dict(rows[-1])) <= tuple(after):
+                    # Nothing new, the usual case for a checkpointed wallet
+                    return {**sum_ledger(()), "before": len(rows)}
+                lo = self._key_position(rows, columns.created[rows], after, after_key=True)
+            window = rows[lo:]
+            codes = [code for code, value in enumerate(self.status_codes.values) if value.lower() == "success"]
+            success = np.isin(columns.status[window], codes)
+            types = columns.type[window]
+            amount = columns.amount[window]
+            return {
+                "count": len(window),
+                "before": lo,
+                "credit": float(amount[success & (types == self.type_codes.index.get("credit", -1))].sum()),
+                "debit": float(amount[success & (types == self.type_codes.index.get("debit", -1))].sum()),
+                "fee": float(columns.fee[window][success].sum()),
+                "last": list(tx_key(self._row_dict(window[-1]))) if len(window) else None,
+            }
+
+    def query_transactions(self, wallet_id, status=None, tx_type=None, min_amount=None, max_amount=None,
+                           start_date=None, end_date=None, before=None, after=None, limit=50,
+                           oldest_first=False):
+        self._page_in(wallet_id)
+        with self.lock:
+            wallet_rows = self.wallet_rows.get(wallet_id)
+            if wallet_rows is None:
+                return []
+            columns = self.columns
+            rows = wallet_rows.view()
+            created = columns.created[rows]
+
+            lo, hi = 0, len(rows)
+            if before is not None:
+                hi = self._key_position(rows, created, before, after_key=False)
+            if after is not None:
+                lo = self._key_position(rows, created, after, after_key=True)
+            try:
+                # Same results as comparing the createdAt strings: a bare
+                # end date sorts before every timestamp on that day
+                if start_date:
+                    lo = max(lo, int(np.searchsorted(created, to_micros(start_date), "left")))
+                if end_date:
+                    side = "left" if len(end_date) <= 10 else "right"
+                    hi = min(hi, int(np.searchsorted(created, to_micros(end_date), side)))
+                text_window = None
+            except ValueError:
+                text_window = (start_date, end_date)
+            if lo >= hi:
+                return []
+
+            window = rows[lo:hi]
+            mask = (columns.flags[window] & DELETED) == 0
+            if status:
+                status = status.lower()
+                codes = [code for code, value in enumerate(self.status_codes.values) if value.lower() == status]
+                mask &= np.isin(columns.status[window], codes)
+            if tx_type:
+                code = self.type_codes.index.get(tx_type)
+                if code is None:
+                    return []
+                mask &= columns.type[window] == code
+            if min_amount is not None:
+                mask &= columns.amount[window] >= min_amount
+            if max_amount is not None:
+                mask &= columns.amount[window] <= max_amount
+            if text_window is not None:
+                mask &= self._text_mask(window, *text_window)
+
+            selected = window[mask]
+            page = selected[:limit] if oldest_first else selected[::-1][:limit]
+            return [self._row_dict(row) for row in page]
+
+    def _key_position(self, rows, created, key, after_key):
+        """Offset of the first row after (or, for ``before``, at) a cursor key."""
+        created_at, tx_id = key
+        try:
+            micros = to_micros(created_at)
+        except ValueError:
+            micros = 0
+        ids = self.columns.ids
+        pos = int(np.searchsorted(created, micros, "left"))
+        while pos < len(rows) and created[pos] == micros:
+            row_id = ids[rows[pos]]
+            if row_id > tx_id or (row_id == tx_id and not after_key):
+                break
+            pos += 1
+        return pos
+
+    def _text_mask(self, window, start_date, end_date):
+        # Bounds that are not ISO dates fall back to comparing strings
+        texts = [self._row_dict(row)["createdAt"] for row in window]
+        return np.fromiter(
+            ((not start_date or t >= start_date) and (not end_date or t <= end_date) for t in texts),
+            bool, len(texts),
+        )
+
+    # --- Indexes ---
+
+    def _put_wallet(self, wallet):
+        self.wallets[wallet["id"]] = wallet
+        self.wallets_by_user[wallet["userId"]] = wallet
+
+    def _put_transaction(self, tx):
+        columns = self.columns
+        row = self.tx_rows.get(tx["id"])
+        if row is None:
+            row = columns.append()
+            self.tx_rows[tx["id"]] = row
+        else:
+            previous = self._row_dict(row)
+            self.wallet_rows[previous["walletId"]].remove(row, columns)
+            rollup = self.rollups.get(previous["walletId"])
+            if rollup is not None:
+                rollup.remove(previous)
+        self._write_row(row, tx)
+        self._rows_of(tx["walletId"]).insert(row, columns)
+        rollup = self.rollups.get(tx["walletId"])
+        if rollup is not None:
+            rollup.add(tx)
+
+    def _delete_transaction(self, tx_id):
+        row = self.tx_rows.pop(tx_id, None)
+        if row is None:
+            return None
+        # The row itself is left behind; it is dropped at the next restart
+        tx = self._row_dict(row)
+        self.wallet_rows[tx["walletId"]].remove(row, self.columns)
+        rollup = self.rollups.get(tx["walletId"])
+        if rollup is not None:
+            rollup.remove(tx)
+        return tx
+
+    def _delete_wallet(self, wallet_id):
+        self._pending.pop(wallet_id, None)
+        wallet = self.wallets.pop(wallet_id, None)
+        if wallet is None:
+            return None
+        if self.wallets_by_user.get(wallet["userId"]) is wallet:
+            del self.wallets_by_user[wallet["userId"]]
+        self.rollups.pop(wallet_id, None)
+        rows = self.wallet_rows.pop(wallet_id, None)
+        if rows is not None:
+            for row in rows.view():
+                self.tx_rows.pop(self.columns.ids[row], None)
+        return wallet
@@ -1,12 +1,1016 @@
 import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
 from pathlib import Path
 
+from indexes import PrefixIndex, RecentBuffer, Rollup, TimeIndex, sum_ledger, tx_key
+from metrics import storage_bytes, storage_seconds
+from shared import MULTIPROCESS, SharedState
+from snapshot import Snapshot, SnapshotWriter
+from storage import Storage
+from writer import GroupCommitWriter
+
 DB_PATH = Path("db.json")
 
-def read_db():
-    with open(DB_PATH, "r") as f:
-        return json.load(f)
+# "json" keeps everything in memory backed by DB_PATH, "columnar" does too but
+# holds transactions in NumPy columns; "sqlite" uses SQLITE_PATH
+STORAGE_BACKEND = os.environ.get("WALLET_STORAGE", "json")
+SQLITE_PATH = Path(os.environ.get("WALLET_SQLITE_PATH", "wallet.db"))
+
+# Fold the journal into a fresh snapshot once it holds this many commits
+COMPACT_EVERY = int(os.environ.get("WALLET_COMPACT_EVERY", "1000"))
+
+# Journal group commit: how long the writer waits for more commits to share
+# an fsync with, and the most commits it flushes at once
+FLUSH_WINDOW_MS = float(os.environ.get("WALLET_FLUSH_WINDOW_MS", "1"))
+FLUSH_MAX_BATCH = int(os.environ.get("WALLET_FLUSH_MAX_BATCH", "256"))
+
+# "binary" keeps the snapshot in db.snap (see snapshot.py), which opens
+# without parsing any transactions; "json" keeps it in db.json
+SNAPSHOT_FORMAT = os.environ.get("WALLET_SNAPSHOT_FORMAT", "json")
+
+# How often an idle worker of a multi-process store checks for other workers' commits
+FOLLOW_INTERVAL_MS = float(os.environ.get("WALLET_FOLLOW_INTERVAL_MS", "50"))
+
+logger = logging.getLogger("wallet.db")
+
+def _observe_io(op, started, size):
+    storage_seconds.observe(time.perf_counter() - started, op=op)
+    storage_bytes.inc(size, op=op)
+
+def read_db(path=None):
+    started = time.perf_counter()
+    with open(path or DB_PATH, "rb") as f:
+        raw = f.read()
+    data = json.loads(raw)
+    _observe_io("read_db", started, len(raw))
+    return data
+
+
+def _copy(record):
+    return None if record is None else dict(record)
+
+
+def _fsync_dir(path):
+    try:
+        fd = os.open(path.parent, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+class JsonStore(Storage):
+    """Resident copy of the database with hash indexes over every collection.
+
+    Users and wallets are handed out as copies and the ``put_*`` methods
+    store copies, so a record only changes when it is put, and every put
+    notes what it replaced. If the transaction raises, including when its
+    journal flush fails, those records are put back before the error
+    reaches the caller. The store only guards its own indexes; callers
+    that read-modify-write a wallet hold that wallet's lock from
+    ``locks.wallet_locks`` around the transaction.
+
+    Durability comes from an append-only journal next to the snapshot
+    (``db.journal`` for ``db.json``). Each committed transaction is one
+    compact JSON line of idempotent operations, fsynced before the commit
+    returns. Commits go through a ``writer.GroupCommitWriter`` so that
+    concurrent ones share a write and an fsync. Compaction waits for a moment
+    with no transaction open, takes the records then, and rewrites the
+    snapshot from them in the background while a new journal starts;
+    startup replays the snapshot and then the journal tail.
+
+    With ``shared`` several worker processes open the same files. Each
+    commit holds the shared lock, starts from the latest journal, and is
+    tagged with the generation it moves the store to. The other workers
+    follow the journal from where they stopped once they see the generation
+    move. Compaction then runs in the foreground under the lock and keeps
+    the rotated journal as ``db.journal.prev`` for workers still reading it.
+    ``listeners`` are called with the transactions followed in from others.
+
+    A binary snapshot (``db.snap``) loads users and wallets at once and
+    leaves each wallet's transactions in the mapped file until something
+    touches that wallet; a background warm-up pages in the rest.
+    """
+
+    def __init__(self, path, shared=None):
+        super().__init__(shared)
+        self.path = Path(path)
+        self.journal_path = self.path.with_suffix(".journal")
+        self.rotated_path = self.path.with_suffix(".journal.old")
+        self.previous_path = self.path.with_suffix(".journal.prev")
+        self.snapshot_path = self.path.with_suffix(".snap")
+        self.listeners = []
+        self._journal_lock = threading.Lock()
+        self._follow_lock = threading.RLock()
+        self._local = threading.local()
+        self._journal = None
+        self._journal_commits = 0
+        self._journal_epoch = 0
+        self._journal_offset = 0
+        self._journal_inode = None
+        self._seen_generation = 0
+        self._compaction = None
+        self._snapshot = None
+        self._pending = {}
+        self._warm_up = None
+        self._closed = threading.Event()
+        self._quiet = threading.Condition()
+        self._compacting = threading.Lock()
+        self._open_transactions = 0
+        self._pausing = 0
+        self.load()
+        self._writer = GroupCommitWriter(
+            self._flush_journal, window=FLUSH_WINDOW_MS / 1000, max_batch=FLUSH_MAX_BATCH
+        )
+        self._follower = None
+        if shared is not None:
+            self._follower = threading.Thread(target=self._follow_loop, name="db-follower", daemon=True)
+            self._follower.start()
+
+    def load(self):
+        with self.shared.lock if self.shared is not None else nullcontext():
+            self._load()
+
+    def _load(self):
+        snapshot = None
+        if self.snapshot_path.exists():
+            snapshot = Snapshot(self.snapshot_path)
+            data = {
+                "users": snapshot.read(snapshot.index["users"]),
+                "wallets": snapshot.read(snapshot.index["wallets"]),
+                "businessRules": snapshot.read(snapshot.index["rules"]),
+            }
+        else:
+            data = read_db(self.path)
+        with self.lock:
+            self.rules = data.get("businessRules", {})
+            self.users = {}
+            self.users_by_email = {}
+            self.user_terms = PrefixIndex()
+            self.wallets = {}
+            self.wallets_by_user = {}
+            self.transactions = {}
+            self.wallet_transactions = {}
+            self.recent = {}
+            self.rollups = {}
+
+            for user in data.get("users", []):
+                self._put_user(user)
+            for wallet in data.get("wallets", []):
+                self._put_wallet(wallet)
+            for tx in data.get("transactions", []):
+                self._put_transaction(tx)
+            self._snapshot = snapshot
+            self._pending = dict(snapshot.index["segments"]) if snapshot is not None else {}
+
+            # A compaction that died before finishing leaves its journal behind
+            rotated = self._replay(self.rotated_path)
+            self._journal_commits = self._replay(self.journal_path)
+            self._journal = open(self.journal_path, "a", encoding="utf-8")
+            if self.shared is not None:
+                self._seen_generation, self._journal_epoch = self.shared.read()
+                stat = os.fstat(self._journal.fileno())
+                self._journal_offset, self._journal_inode = stat.st_size, stat.st_ino
+                self.versions.floor = self._seen_generation
+
+        if self._pending and (self._warm_up is None or not self._warm_up.is_alive()):
+            self._warm_up = threading.Thread(target=self._warm, name="db-warm-up", daemon=True)
+            self._warm_up.start()
+
+        # Also rewrites a snapshot left in the other format
+        if rotated or (snapshot is not None) != (SNAPSHOT_FORMAT == "binary"):
+            self.compact(force=True)
+
+    def close(self):
+        self._closed.set()
+        if self._follower is not None:
+            self._follower.join()
+        if self._warm_up is not None:
+            self._warm_up.join()
+        compaction = self._compaction
+        if compaction is not None:
+            compaction.join()
+        self._writer.close()
+        with self._journal_lock:
+            if self._journal is not None:
+                self._journal.close()
+                self._journal = None
+        if self.shared is not None:
+            self.shared.close()
+
+    def to_dict(self):
+        with self.lock:
+            self._page_in_all()
+            return {
+                "users": list(self.users.values()),
+                "wallets": list(self.wallets.values()),
+                "transactions": list(self.transactions.values()),
+                "businessRules": self.rules,
+            }
+
+    def stats(self):
+        return {
+            "backend": "json",
+            "journalCommits": self._journal_commits,
+            "writer": self._writer.stats(),
+            **({"generation": self._seen_generation} if self.shared is not None else {}),
+            "warmingWallets": len(self._pending),
+        }
+
+    def warming(self):
+        return len(self._pending)
+
+    def _warm(self):
+        for wallet_id in list(self._pending):
+            if self._closed.is_set():
+                return
+            self._page_in(wallet_id)
+
+    def _page_in(self, wallet_id):
+        """Loads a wallet's transactions from the snapshot if they are still there."""
+        if wallet_id not in self._pending:
+            return
+        with self.lock:
+            offset = self._pending.pop(wallet_id, None)
+            if offset is None:
+                return
+            for tx in self._snapshot.read(offset):
+                self._put_transaction(tx)
+            if not self._pending:
+                self._snapshot = None
+
+    def _page_in_all(self):
+        for wallet_id in list(self._pending):
+            self._page_in(wallet_id)
+
+    # --- Reads ---
+
+    def get_user(self, user_id):
+        return _copy(self.users.get(user_id))
+
+    def get_user_by_email(self, email):
+        return _copy(self.users_by_email.get(email.lower().strip()))
+
+    def list_users(self):
+        return [dict(user) for user in list(self.users.values())]
+
+    def _prefix_scan(self, prefix, after):
+        for term, user_id in self.user_terms.scan(prefix, after):
+            user = self.users.get(user_id)
+            if user is not None:
+                yield term, dict(user)
+
+    def get_wallet(self, wallet_id):
+        return _copy(self.wallets.get(wallet_id))
+
+    def get_wallet_for_user(self, user_id):
+        return _copy(self.wallets_by_user.get(user_id))
+
+    def list_wallets(self):
+        with self.lock:
+            return [dict(wallet) for wallet in self.wallets.values()]
+
+    def get_transaction(self, tx_id):
+        tx = self.transactions.get(tx_id)
+        if tx is None and self._pending:
+            # Could be in any wallet not loaded yet
+            self._page_in_all()
+            tx = self.transactions.get(tx_id)
+        return tx
+
+    def get_wallet_transactions(self, wallet_id):
+        self._page_in(wallet_id)
+        with self.lock:
+            return list(self.wallet_transactions.get(wallet_id, ()))
+
+    def recent_transactions(self, wallet_id):
+        self._page_in(wallet_id)
+        with self.lock:
+            recent = self.recent.get(wallet_id)
+            if recent is None:
+                index = self.wallet_transactions.get(wallet_id)
+                if index is None:
+                    return []
+                # Built on first use so startup does not pay for idle wallets
+                recent = self.recent[wallet_id] = RecentBuffer(index)
+            return list(recent)
+
+    def ledger_totals(self, wallet_id, after=None):
+        self._page_in(wallet_id)
+        with self.lock:
+            index = self.wallet_transactions.get(wallet_id)
+            if index is None:
+                return sum_ledger(())
+            lo, hi = index.bounds(after=after)
+            newer = index.items[lo:hi]
+        return sum_ledger(newer, before=lo)
+
+    def transaction_analytics(self, wallet_id, start_date=None, end_date=None):
+        self._page_in(wallet_id)
+        with self.lock:
+            rollup = self.rollups.get(wallet_id)
+            if rollup is None:
+                index = self.wallet_transactions.get(wallet_id)
+                if index is None:
+                    return Rollup(()).query()
+                rollup = self.rollups[wallet_id] = Rollup(index)
+            return rollup.query(start_date, end_date)
+
+    def query_transactions(self, wallet_id, status=None, tx_type=None, min_amount=None, max_amount=None,
+                           start_date=None, end_date=None, before=None, after=None, limit=50,
+                           oldest_first=False):
+        # The date window and the cursor key narrow the wallet's time index by
+        # bisection; the remaining filters run in one pass that stops at limit
+        status = status.lower() if status else None
+        page = []
+        self._page_in(wallet_id)
+        with self.lock:
+            index = self.wallet_transactions.get(wallet_id)
+            if index is None:
+                return page
+            lo, hi = index.bounds(start_date, end_date, before, after)
+            items = index.items
+            for i in (range(lo, hi) if oldest_first else range(hi - 1, lo - 1, -1)):
+                tx = items[i]
+                if tx.get("isDeleted"):
+                    continue
+                if status and tx["status"].lower() != status:
+                    continue
+                if tx_type and tx["type"] != tx_type:
+                    continue
+                if min_amount is not None and tx["amount"] < min_amount:
+                    continue
+                if max_amount is not None and tx["amount"] > max_amount:
+                    continue
+                page.append(tx)
+                if len(page) >= limit:
+                    break
+        return page
+
+    # --- Writes ---
+
+    @contextmanager
+    def transaction(self):
+        depth = getattr(self._local, "depth", 0)
+        if depth:
+            self._local.depth = depth + 1
+            try:
+                yield self
+            finally:
+                self._local.depth = depth
+            return
+        self._local.ops = []
+        self._local.undo = []
+        self._local.depth = 1
+        try:
+            with self._open(), self._writing():
+                try:
+                    yield self
+                    self._commit(self._local.ops)
+                except BaseException:
+                    self._roll_back(self._local.undo)
+                    raise
+        finally:
+            self._local.depth = 0
+            self._local.ops = self._local.undo = None
+        if self._compaction_due():
+            self.compact()
+
+    def _compaction_due(self):
+        # Checked before pausing writers, so commits made while a snapshot is
+        # still being written do not each wait for the others to drain
+        if self._journal_commits < COMPACT_EVERY:
+            return False
+        return self._compaction is None or not self._compaction.is_alive()
+
+    @contextmanager
+    def _open(self):
+        with self._quiet:
+            while self._pausing:
+                self._quiet.wait()
+            self._open_transactions += 1
+        try:
+            yield
+        finally:
+            with self._quiet:
+                self._open_transactions -= 1
+                self._quiet.notify_all()
+
+    @contextmanager
+    def _paused(self):
+        """Holds back new transactions until the block ends, once the open ones have finished."""
+        with self._quiet:
+            self._pausing += 1
+            try:
+                while self._open_transactions:
+                    self._quiet.wait()
+                yield
+            finally:
+                self._pausing -= 1
+                self._quiet.notify_all()
+
+    def _roll_back(self, undo):
+        """Puts back the records a failed transaction replaced, newest change first."""
+        with self.lock:
+            for kind, key, previous in reversed(undo):
+                if kind == "rules":
+                    self.rules = previous
+                elif previous is None:
+                    {"users": self._delete_user, "wallets": self._delete_wallet,
+                     "transactions": self._delete_transaction}[kind](key)
+                else:
+                    {"users": self._put_user, "wallets": self._put_wallet,
+                     "transactions": self._put_transaction}[kind](previous)
+
+    @contextmanager
+    def _writing(self):
+        if self.shared is None:
+            with self._collect_changes():
+                yield
+            return
+        # Writers take turns across all workers, each starting from the latest state
+        with self.shared.lock:
+            self._catch_up_locked()
+            with self._collect_changes():
+                yield
+
+    def put_user(self, user):
+        user = dict(user)
+        with self.transaction():
+            with self.lock:
+                self._local.undo.append(("users", user["id"], self.users.get(user["id"])))
+                self._put_user(user)
+                self._record(["put", "users", user])
+            self._changed("user", user["id"])
+
+    def put_wallet(self, wallet):
+        wallet = dict(wallet)
+        with self.transaction():
+            with self.lock:
+                self._local.undo.append(("wallets", wallet["id"], self.wallets.get(wallet["id"])))
+                self._put_wallet(wallet)
+                self._record(["put", "wallets", wallet])
+            self._changed("wallet", wallet["id"])
+
+    def append_transaction(self, tx):
+        # Wallets still in the binary snapshot are not searched; they are paged in soon
+        self._page_in(tx["walletId"])
+        if self._has_transaction(tx["id"]):
+            raise ValueError(f"Transaction id {tx['id']} is already taken")
+        self.put_transaction(tx)
+
+    def _has_transaction(self, tx_id):
+        return tx_id in self.transactions
+
+    def _stored_transaction(self, tx_id):
+        """The resident record, without paging in other wallets to look for it."""
+        return self.transactions.get(tx_id)
+
+    def put_transaction(self, tx):
+        """Adds a transaction, or swaps in a new record for an existing id.
+
+        Changes to a stored record go through ``update_transaction`` so the
+        derived buckets can take the old values out first.
+        """
+        tx = dict(tx)
+        self._page_in(tx["walletId"])
+        with self.transaction():
+            with self.lock:
+                self._local.undo.append(("transactions", tx["id"], self._stored_transaction(tx["id"])))
+                self._put_transaction(tx)
+                self._record(["put", "transactions", tx])
+            self._changed("wallet", tx["walletId"])
+
+    def update_transaction(self, tx_id, **fields):
+        with self.transaction():
+            with self.lock:
+                previous = self.get_transaction(tx_id)
+                if previous is None:
+                    return None
+                # A new record, so readers holding the old one never see it change
+                tx = {**previous, **fields}
+                self._local.undo.append(("transactions", tx_id, previous))
+                self._put_transaction(tx)
+                self._record(["put", "transactions", tx])
+            self._changed("wallet", tx["walletId"])
+        return tx
+
+    def delete_wallet(self, wallet_id):
+        self._page_in(wallet_id)
+        with self.transaction():
+            with self.lock:
+                for tx in self.get_wallet_transactions(wallet_id):
+                    self._local.undo.append(("transactions", tx["id"], tx))
+                wallet = self._delete_wallet(wallet_id)
+                if wallet is not None:
+                    self._local.undo.append(("wallets", wallet_id, wallet))
+                    self._record(["del", "wallets", wallet_id])
+            self._changed("wallet", wallet_id)
+        return wallet
+
+    def delete_user(self, user_id):
+        with self.transaction():
+            with self.lock:
+                user = self._delete_user(user_id)
+                if user is not None:
+                    self._local.undo.append(("users", user_id, user))
+                    self._record(["del", "users", user_id])
+            self._changed("user", user_id)
+        return user
+
+    def set_rules(self, rules):
+        with self.transaction():
+            with self.lock:
+                self._local.undo.append(("rules", "", self.rules))
+                self.rules = rules
+                self._record(["rules", rules])
+            self._changed("rules", "")
+
+    # --- Journal ---
+
+    def _record(self, op):
+        self._local.ops.append(op)
+
+    def _commit(self, ops):
+        if not ops:
+            return
+        if self.shared is None:
+            self._writer.submit(json.dumps(ops, separators=(",", ":")))
+            return
+        with self.shared.lock:
+            self._catch_up_locked()
+            generation = self.shared.generation + 1
+            self._writer.submit(json.dumps([["gen", generation], *ops], separators=(",", ":")))
+            with self._follow_lock:
+                self._seen_generation = self.shared.advance()
+                self._journal_offset = os.fstat(self._journal.fileno()).st_size
+
+    def _flush_journal(self, lines):
+        started = time.perf_counter()
+        payload = "".join(line + "\n" for line in lines)
+        with self._journal_lock:
+            start = self._journal.tell()
+            try:
+                self._journal.write(payload)
+                self._journal.flush()
+                os.fsync(self._journal.fileno())
+            except BaseException:
+                # These commits are rolled back, so they must not be replayed either
+                self._journal.seek(start)
+                self._journal.truncate()
+                raise
+            self._journal_commits += len(lines)
+        # json.dumps escapes non-ASCII, so characters are bytes here
+        _observe_io("journal_flush", started, len(payload))
+
+    def _replay(self, path):
+        if not path.exists():
+            return 0
+        commits = 0
+        good_bytes = 0
+        with open(path, "r+b") as f:
+            for line in f:
+                try:
+                    if not line.endswith(b"\n"):
+                        raise ValueError("unterminated journal record")
+                    ops = json.loads(line)
+                except ValueError:
+                    # Torn final append from a crash; nothing after it was
+                    # acknowledged, so cut it off before appending again
+                    f.truncate(good_bytes)
+                    break
+                for op in ops:
+                    self._apply(op)
+                commits += 1
+                good_bytes += len(line)
+        return commits
+
+    def _stamp(self):
+        return self._seen_generation if self.shared is not None else None
+
+    def refresh(self):
+        if self.shared is not None and self.shared.generation != self._seen_generation:
+            self._catch_up()
+
+    def _follow_loop(self):
+        # Keeps an idle worker current, so its event streams hear about
+        # other workers' transfers without waiting for a request of its own
+        while not self._closed.wait(FOLLOW_INTERVAL_MS / 1000):
+            try:
+                self.refresh()
+            except Exception:
+                logger.exception("Could not follow the journal")
+
+    def _catch_up(self):
+        """Applies the commits other workers have made since this one last looked."""
+        with self._follow_lock:
+            generation, epoch = self.shared.read()
+            if generation == self._seen_generation:
+                return
+            if epoch == self._journal_epoch:
+                try:
+                    f = open(self.journal_path, "rb")
+                except FileNotFoundError:
+                    f = None
+                if f is not None:
+                    with f:
+                        # Still our journal if no rotation began before the open
+                        if self.shared.read()[1] == epoch and os.fstat(f.fileno()).st_ino == self._journal_inode:
+                            self._follow(f, until=generation)
+                            self._seen_generation = generation
+                            return
+        # Rotated in the meantime; the shared lock holds the files still
+        with self.shared.lock:
+            self._catch_up_locked()
+
+    def _catch_up_locked(self):
+        """``_catch_up`` for a holder of the shared lock.
+
+        Also cuts off a torn record left by a worker that died mid-write,
+        before anything is appended after it.
+        """
+        with self._follow_lock:
+            generation, epoch = self.shared.read()
+            if epoch != self._journal_epoch:
+                try:
+                    retired = os.stat(self.previous_path).st_ino == self._journal_inode
+                except FileNotFoundError:
+                    retired = False
+                if epoch != self._journal_epoch + 1 or not retired or self.rotated_path.exists():
+                    # More than one rotation behind, or a compaction died half way
+                    self._reload()
+                    return
+                with open(self.previous_path, "rb") as f:
+                    self._follow(f)
+                with self._journal_lock:
+                    self._journal.close()
+                    self._journal = open(self.journal_path, "a", encoding="utf-8")
+                    self._journal_inode = os.fstat(self._journal.fileno()).st_ino
+                self._journal_epoch = epoch
+                self._journal_offset = 0
+                self._journal_commits = 0
+            with open(self.journal_path, "r+b") as f:
+                self._follow(f, truncate=True)
+            self._seen_generation = generation
+
+    def _follow(self, f, until=None, truncate=False):
+        """Applies the complete journal records in ``f`` from ``_journal_offset`` on.
+
+        Records tagged with a generation after ``until`` may not be
+        committed yet and are left for later.
+        """
+        f.seek(self._journal_offset)
+        transactions = []
+        with self.lock:
+            for line in f:
+                try:
+                    if not line.endswith(b"\n"):
+                        raise ValueError("unterminated journal record")
+                    ops = json.loads(line)
+                except ValueError:
+                    # Still being written, unless the writer is gone
+                    if truncate:
+                        f.truncate(self._journal_offset)
+                    break
+                stamp = ops[0][1] if ops and ops[0][0] == "gen" else self.shared.generation
+                if until is not None and stamp > until:
+                    break
+                keys = set()
+                for op in ops:
+                    keys.update(self._op_keys(op))
+                    self._apply(op)
+                    if op[0] == "put" and op[1] == "transactions":
+                        transactions.append(op[2])
+                for kind, key in keys:
+                    self.versions.bump(kind, key, stamp)
+                self._journal_offset += len(line)
+                self._journal_commits += 1
+        if transactions:
+            for listener in self.listeners:
+                listener(transactions)
+
+    def _reload(self):
+        """Loads the files afresh, for a worker too far behind to follow the journal."""
+        with self._journal_lock:
+            self._journal.close()
+        self.load()
+
+    def _op_keys(self, op):
+        """The version keys a journal operation changes; call before applying it."""
+        if op[0] == "rules":
+            return [("rules", "")]
+        if op[0] not in ("put", "del"):
+            return []
+        if op[1] == "users":
+            return [("user", op[2]["id"] if op[0] == "put" else op[2])]
+        if op[1] == "wallets":
+            return [("wallet", op[2]["id"] if op[0] == "put" else op[2])]
+        if op[0] == "put":
+            return [("wallet", op[2]["walletId"])]
+        if len(op) > 3:
+            return [("wallet", op[3])]
+        previous = self.get_transaction(op[2])
+        return [("wallet", previous["walletId"])] if previous is not None else []
+
+    def _apply(self, op):
+        if op[1:2] == ["transactions"]:
+            if op[0] == "put":
+                self._page_in(op[2]["walletId"])
+            elif len(op) > 3:
+                self._page_in(op[3])
+            else:
+                self._page_in_all()
+        if op[0] == "rules":
+            self.rules = op[1]
+        elif op[0] == "put":
+            {"users": self._put_user, "wallets": self._put_wallet, "transactions": self._put_transaction}[op[1]](op[2])
+        elif op[0] == "del":
+            {"users": self._delete_user, "wallets": self._delete_wallet, "transactions": self._delete_transaction}[op[1]](op[2])
+
+    def compact(self, force=False):
+        if self.shared is not None:
+            self._compact_shared(force)
+            return
+        if getattr(self._local, "depth", 0):
+            raise RuntimeError("compact() cannot run inside a transaction")
+        if not force and not self._compaction_due():
+            return
+        # One thread pauses writers at a time; the rest leave it to that one
+        if not self._compacting.acquire(blocking=force):
+            return
+        try:
+            self._rotate_and_snapshot(force)
+        finally:
+            self._compacting.release()
+
+    def _rotate_and_snapshot(self, force):
+        # Taken between transactions, so the snapshot holds only committed writes
+        with self._paused(), self.lock:
+            if self._compaction is not None and self._compaction.is_alive():
+                return
+            if not force and self._journal_commits < COMPACT_EVERY:
+                return
+
+            # Everything committed from here on goes to a fresh journal, so the
+            # snapshot below only has to reflect the state at this point
+            if not self.rotated_path.exists():
+                with self._journal_lock:
+                    self._journal.close()
+                    os.replace(self.journal_path, self.rotated_path)
+                    self._journal = open(self.journal_path, "a", encoding="utf-8")
+                    self._journal_commits = 0
+
+            contents = self._snapshot_contents()
+
+            self._compaction = threading.Thread(
+                target=self._write_snapshot, args=contents, name="db-compaction", daemon=True
+            )
+            self._compaction.start()
+
+    def _compact_shared(self, force):
+        # In the foreground and under the shared lock, so no worker commits
+        # to or starts following a journal while it is being retired
+        with self.shared.lock:
+            self._catch_up_locked()
+            with self._follow_lock, self.lock:
+                if not force and self._journal_commits < COMPACT_EVERY:
+                    return
+                if not self.rotated_path.exists():
+                    with self._journal_lock:
+                        self._journal.close()
+                        # The epoch moves before the rename, so a worker that
+                        # opens the new journal always sees the new epoch
+                        self._seen_generation = self.shared.advance(rotate=True)
+                        os.replace(self.journal_path, self.rotated_path)
+                        self._journal = open(self.journal_path, "a", encoding="utf-8")
+                        self._journal_inode = os.fstat(self._journal.fileno()).st_ino
+                    self._journal_epoch += 1
+                    self._journal_offset = 0
+                    self._journal_commits = 0
+                contents = self._snapshot_contents()
+            self._write_snapshot(*contents)
+
+    def _snapshot_contents(self):
+        """Arguments for ``_write_snapshot``, taken under ``self.lock``.
+
+        Wallets whose transactions are still only in the binary snapshot
+        are copied over from it as they are.
+        """
+        if SNAPSHOT_FORMAT != "binary":
+            self._page_in_all()
+        collections = {
+            "users": list(self.users.values()),
+            "wallets": list(self.wallets.values()),
+            "transactions": self._snapshot_transactions(),
+        }
+        carried = [(wallet_id, self._snapshot, offset) for wallet_id, offset in self._pending.items()]
+        return collections, self.rules, carried
+
+    def _snapshot_transactions(self):
+        return list(self.transactions.values())
+
+    def _write_snapshot(self, collections, rules, carried=()):
+        started = time.perf_counter()
+        if SNAPSHOT_FORMAT == "binary":
+            size = self._write_binary_snapshot(collections, rules, carried)
+        else:
+            size = self._write_json_snapshot(collections, rules)
+        if self.shared is not None and self.rotated_path.exists():
+            # Kept until the next rotation for workers still part way through it
+            os.replace(self.rotated_path, self.previous_path)
+        else:
+            self.rotated_path.unlink(missing_ok=True)
+        _observe_io("snapshot", started, size)
+
+    def _write_binary_snapshot(self, collections, rules, carried):
+        segments = {}
+        for tx in collections["transactions"]:
+            segments.setdefault(tx["walletId"], []).append(tx)
+        tmp_path = self.snapshot_path.with_suffix(".snap.tmp")
+        with open(tmp_path, "wb") as f:
+            writer = SnapshotWriter(f)
+            index = {
+                "users": writer.add(self._dump_records(collections["users"])),
+                "wallets": writer.add(self._dump_records(collections["wallets"])),
+                "rules": writer.add(json.dumps(rules, separators=(",", ":")).encode()),
+                "segments": {},
+            }
+            for wallet_id, transactions in segments.items():
+                transactions.sort(key=tx_key)
+                index["segments"][wallet_id] = writer.add(self._dump_records(transactions))
+            for wallet_id, source, offset in carried:
+                index["segments"][wallet_id] = writer.copy(source.raw(offset))
+            writer.finish(index)
+            f.flush()
+            os.fsync(f.fileno())
+            size = f.tell()
+        os.replace(tmp_path, self.snapshot_path)
+        _fsync_dir(self.snapshot_path)
+        return size
+
+    def _dump_records(self, records):
+        return ("[" + ",".join(self._dump_record(record) for record in records) + "]").encode()
+
+    def _write_json_snapshot(self, collections, rules):
+        tmp_path = self.path.with_suffix(".json.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write("{")
+            for name, records in collections.items():
+                f.write(f'"{name}":[')
+                for i, record in enumerate(records):
+                    if i:
+                        f.write(",")
+                    f.write(self._dump_record(record))
+                f.write("],")
+            f.write('"businessRules":')
+            f.write(json.dumps(rules, separators=(",", ":")))
+            f.write("}")
+            f.flush()
+            os.fsync(f.fileno())
+            size = f.tell()
+
+        os.replace(tmp_path, self.path)
+        _fsync_dir(self.path)
+        # A binary snapshot would be loaded in preference to this one
+        self.snapshot_path.unlink(missing_ok=True)
+        return size
+
+    def _dump_record(self, record):
+        return json.dumps(record, separators=(",", ":"))
+
+    # --- Indexes ---
+
+    def _put_user(self, user):
+        previous = self.users.get(user["id"])
+        if previous is not None and self.users_by_email.get(previous["email"].lower()) is previous:
+            del self.users_by_email[previous["email"].lower()]
+        self.users[user["id"]] = user
+        self.users_by_email[user["email"].lower()] = user
+        self.user_terms.add(user)
+
+    def _put_wallet(self, wallet):
+        self.wallets[wallet["id"]] = wallet
+        self.wallets_by_user[wallet["userId"]] = wallet
+        self.wallet_transactions.setdefault(wallet["id"], TimeIndex())
+
+    def _put_transaction(self, tx):
+        previous = self.transactions.get(tx["id"])
+        self.transactions[tx["id"]] = tx
+        if previous is None:
+            self.wallet_transactions.setdefault(tx["walletId"], TimeIndex()).insert(tx)
+            recent = self.recent.get(tx["walletId"])
+            if recent is not None:
+                recent.offer(tx)
+            rollup = self.rollups.get(tx["walletId"])
+            if rollup is not None:
+                rollup.add(tx)
+        elif previous is not tx:
+            if previous["walletId"] == tx["walletId"]:
+                self.wallet_transactions[tx["walletId"]].replace(previous, tx)
+            else:
+                self.wallet_transactions[previous["walletId"]].remove(previous)
+                self.wallet_transactions.setdefault(tx["walletId"], TimeIndex()).insert(tx)
+                self._refresh_recent(previous["walletId"])
+            self._refresh_recent(tx["walletId"])
+            rollup = self.rollups.get(previous["walletId"])
+            if rollup is not None:
+                rollup.remove(previous)
+            rollup = self.rollups.get(tx["walletId"])
+            if rollup is not None:
+                rollup.add(tx)
+
+    def _refresh_recent(self, wallet_id):
+        recent = self.recent.get(wallet_id)
+        if recent is not None:
+            recent.refill(self.wallet_transactions[wallet_id])
+
+    def _delete_transaction(self, tx_id):
+        tx = self.transactions.pop(tx_id, None)
+        if tx is not None:
+            self.wallet_transactions[tx["walletId"]].remove(tx)
+            recent = self.recent.get(tx["walletId"])
+            if recent is not None and tx in recent:
+                recent.refill(self.wallet_transactions[tx["walletId"]])
+            rollup = self.rollups.get(tx["walletId"])
+            if rollup is not None:
+                rollup.remove(tx)
+        return tx
+
+    def _delete_wallet(self, wallet_id):
+        self._pending.pop(wallet_id, None)
+        wallet = self.wallets.pop(wallet_id, None)
+        if wallet is None:
+            return None
+        if self.wallets_by_user.get(wallet["userId"]) is wallet:
+            del self.wallets_by_user[wallet["userId"]]
+        self.recent.pop(wallet_id, None)
+        self.rollups.pop(wallet_id, None)
+        for tx in self.wallet_transactions.pop(wallet_id, ()):
+            self.transactions.pop(tx["id"], None)
+        return wallet
+
+    def _delete_user(self, user_id):
+        user = self.users.pop(user_id, None)
+        if user is not None and self.users_by_email.get(user["email"].lower()) is user:
+            del self.users_by_email[user["email"].lower()]
+        self.user_terms.remove(user_id)
+        return user
+
+
+_store = None
+_store_lock = threading.Lock()
+
+def open_store(backend=None, multiprocess=None):
+    backend = backend or STORAGE_BACKEND
+    multiprocess = MULTIPROCESS if multiprocess is None else multiprocess
+    if backend == "sqlite":
+        if multiprocess:
+            raise ValueError("WALLET_MULTIPROCESS works with the json and columnar backends")
+        from sqlite_store import SQLiteStore
+        return SQLiteStore(SQLITE_PATH)
+    if backend == "json":
+        store_class = JsonStore
+    elif backend == "columnar":
+        try:
+            from columnar_store import ColumnarStore
+        except ImportError as exc:
+            raise RuntimeError("WALLET_STORAGE=columnar needs numpy: pip install numpy") from exc
+        store_class = ColumnarStore
+    else:
+        raise ValueError(f"Unknown storage backend: {backend}")
+    if not multiprocess:
+        return store_class(DB_PATH)
+    store = store_class(DB_PATH, SharedState(DB_PATH.with_suffix("")))
+    from events import publish_transactions
+    store.listeners.append(lambda transactions: publish_transactions(store, transactions))
+    return store
+
+def get_store():
+    global _store
+    store = _store
+    if store is None:
+        with _store_lock:
+            if _store is None:
+                _store = open_store()
+            store = _store
+    store.refresh()
+    return store
+
+def loaded_store():
+    """The open store as it is, without opening or refreshing it; None until one is opened."""
+    return _store
 
-def write_db(data):
-    with open(DB_PATH, "w") as f:
-        json.dump(data, f, indent=2)
+def reset_store():
+    global _store
+    with _store_lock:
+        if _store is not None:
+            _store.close()
+        _store = None
@@ -1,16 +1,45 @@
+import hmac
+import os
 from typing import Optional
-from fastapi import Depends, HTTPException, status, Request
+from fastapi import Depends, Header, HTTPException, status, Request
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from typing import Optional
-from db import read_db
+from cache import TTLCache
+from db import get_store
 
 security = HTTPBearer(auto_error=False)
 
+TOKEN_PREFIX = "mock-token-"
+
+# Shared secret for /admin routes, sent as X-Admin-Token; unset turns them off
+ADMIN_TOKEN = os.environ.get("WALLET_ADMIN_TOKEN")
+
+# Token -> (user version, user record), so authenticated requests skip
+# storage to find the caller until the user changes
+sessions = TTLCache(
+    maxsize=int(os.environ.get("WALLET_SESSION_CACHE_SIZE", "10000")),
+    ttl=float(os.environ.get("WALLET_SESSION_TTL", "300")),
+)
+
+def session_token(user_id: str) -> str:
+    return f"{TOKEN_PREFIX}{user_id}"
+
+def invalidate_session(user_id: str):
+    sessions.pop(session_token(user_id))
+
+def request_user_id(request: Request) -> Optional[str]:
+    """The user a request's token names, without looking the user up; None without a token."""
+    token = request.cookies.get("token")
+    if not token:
+        scheme, _, credentials = request.headers.get("authorization", "").partition(" ")
+        if scheme.lower() == "bearer":
+            token = credentials.strip()
+    if token and token.startswith(TOKEN_PREFIX):
+        return token.replace(TOKEN_PREFIX, "")
+    return None
+
 def get_current_user(request: Request, bearer: Optional[HTTPAuthorizationCredentials] = Depends(security)):
-    print(f"DEBUG: Cookies received: {request.cookies}")
-    
     token = request.cookies.get("token")
-    
+
     if not token and bearer:
         token = bearer.credentials
 
@@ -19,22 +48,35 @@ def get_current_user(request: Request, bearer: Optional[HTTPAuthorizationCredent
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Not authenticated",
         )
-    
-    if not token.startswith("mock-token-"):
+
+    if not token.startswith(TOKEN_PREFIX):
          raise HTTPException(
              status_code=status.HTTP_401_UNAUTHORIZED,
              detail="Invalid authentication credentials",
          )
-         
-    user_id = token.replace("mock-token-", "")
-    
-    db = read_db()
-    user = next((u for u in db["users"] if u["id"] == user_id), None)
-    
+
+    user_id = token.replace(TOKEN_PREFIX, "")
+    store = get_store()
+    version = store.versions.get("user", user_id)
+
+    cached = sessions.get(token)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+
+    user = store.get_user(user_id)
+
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="User not found",
         )
-        
+
+    sessions.set(token, (version, user))
     return user
+
+def require_admin(x_admin_token: Optional[str] = Header(None, alias="X-Admin-Token")):
+    if not ADMIN_TOKEN or not x_admin_token or not hmac.compare_digest(x_admin_token.encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Admin access required",
+        )
@@ -0,0 +1,144 @@
+import asyncio
+import json
+import os
+import threading
+from collections import deque
+
+from indexes import RECENT_SIZE
+from metrics import registry
+
+events_published = registry.counter(
+    "wallet_events_published_total", "Events delivered to subscriber queues, by event type.", ("event",))
+subscribers_dropped = registry.counter(
+    "wallet_event_subscribers_dropped_total", "Subscribers disconnected because their queue was full.")
+subscribers_open = registry.gauge("wallet_event_subscribers", "Open event streams.")
+
+
+class Subscription:
+    """One open event stream: a bounded queue filled by publishers.
+
+    Publishers run on worker threads and never wait; the stream's reader
+    runs on the event loop and is woken through ``loop.call_soon_threadsafe``.
+    """
+
+    __slots__ = ("user_id", "maxsize", "queue", "dropped", "_lock", "_loop", "_ready")
+
+    def __init__(self, user_id, maxsize, loop):
+        self.user_id = user_id
+        self.maxsize = maxsize
+        self.queue = deque()
+        self.dropped = False
+        self._lock = threading.Lock()
+        self._loop = loop
+        self._ready = asyncio.Event()
+
+    def offer(self, message):
+        """Queues ``message``; False once the queue has overflowed."""
+        with self._lock:
+            if len(self.queue) >= self.maxsize:
+                self.dropped = True
+            else:
+                self.queue.append(message)
+        self._wake()
+        return not self.dropped
+
+    def _wake(self):
+        try:
+            self._loop.call_soon_threadsafe(self._ready.set)
+        except RuntimeError:
+            # The loop has shut down; the stream is gone with it
+            pass
+
+    async def get(self, timeout):
+        """Everything queued so far, waiting up to ``timeout`` seconds for something."""
+        self._ready.clear()
+        messages = self._drain()
+        if not messages and not self.dropped:
+            try:
+                await asyncio.wait_for(self._ready.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            messages = self._drain()
+        return messages
+
+    def _drain(self):
+        with self._lock:
+            messages = list(self.queue)
+            self.queue.clear()
+            return messages
+
+
+class EventBus:
+    """In-process publish/subscribe of per-user events.
+
+    Each subscriber gets a queue of at most ``max_queue`` messages. A
+    subscriber that falls that far behind is unsubscribed and its stream
+    ends, rather than letting its backlog grow; clients reconnect and
+    reload their state.
+    """
+
+    def __init__(self, max_queue):
+        self.max_queue = max_queue
+        self._subscribers = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, user_id):
+        subscription = Subscription(user_id, self.max_queue, asyncio.get_running_loop())
+        with self._lock:
+            self._subscribers.setdefault(user_id, set()).add(subscription)
+        subscribers_open.inc()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.user_id)
+            if subscribers is None or subscription not in subscribers:
+                return False
+            subscribers.discard(subscription)
+            if not subscribers:
+                del self._subscribers[subscription.user_id]
+        subscribers_open.dec()
+        return True
+
+    def publish(self, user_id, event, data):
+        with self._lock:
+            subscribers = list(self._subscribers.get(user_id, ()))
+        if not subscribers:
+            return
+        # Encoded once, from a copy, so later changes to the record cannot leak in
+        message = f"event: {event}\ndata: {json.dumps(dict(data), separators=(',', ':'))}\n\n"
+        for subscription in subscribers:
+            if subscription.offer(message):
+                events_published.inc(event=event)
+            elif self.unsubscribe(subscription):
+                subscribers_dropped.inc()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "users": len(self._subscribers),
+                "subscribers": sum(len(s) for s in self._subscribers.values()),
+                "maxQueue": self.max_queue,
+            }
+
+
+event_bus = EventBus(max_queue=int(os.environ.get("WALLET_EVENT_QUEUE_SIZE", "100")))
+
+
+def publish_transactions(store, transactions):
+    """Sends each affected wallet's owner the new or changed transactions, then the balance.
+
+    Call after the commit, so subscribers never hear about a change that
+    could still be rolled back. A batch only sends its newest RECENT_SIZE
+    transactions per wallet, which is all a client's recent list can show.
+    """
+    by_wallet = {}
+    for tx in transactions:
+        by_wallet.setdefault(tx["walletId"], []).append(tx)
+    for wallet_id, changed in by_wallet.items():
+        wallet = store.get_wallet(wallet_id)
+        if wallet is None:
+            continue
+        for tx in changed[-RECENT_SIZE:]:
+            event_bus.publish(wallet["userId"], "transaction", tx)
+        event_bus.publish(wallet["userId"], "balance", {"walletId": wallet["id"], "balance": wallet["balance"]})
@@ -0,0 +1,113 @@
+import hashlib
+import json
+import os
+import threading
+
+from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+from cache import TTLCache
+
+MAX_KEY_LENGTH = 255
+
+
+class _InFlight:
+    __slots__ = ("fingerprint", "done", "result")
+
+    def __init__(self, fingerprint):
+        self.fingerprint = fingerprint
+        self.done = threading.Event()
+        self.result = None
+
+
+class IdempotencyCache:
+    """Remembers the outcome of requests sent with an Idempotency-Key.
+
+    The first request with a key runs; its status and body, errors included,
+    are kept in a bounded TTL cache and replayed for later requests with the
+    same key. A duplicate that arrives while the first is still running
+    waits for it rather than running again. Reusing a key for a different
+    request body is rejected.
+    """
+
+    def __init__(self, maxsize, ttl):
+        self.results = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.replays = 0
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    def run(self, key, fingerprint, handler):
+        """Returns ``(status_code, body, replayed)`` for ``key``."""
+        while True:
+            with self._lock:
+                cached = self.results.get(key)
+                if cached is None:
+                    pending = self._in_flight.get(key)
+                    owner = pending is None
+                    if owner:
+                        pending = self._in_flight[key] = _InFlight(fingerprint)
+            if cached is not None:
+                return self._replay(cached, fingerprint)
+            if owner:
+                break
+            if pending.fingerprint != fingerprint:
+                raise _mismatch()
+            pending.done.wait()
+            if pending.result is not None:
+                return self._replay(pending.result, fingerprint)
+            # The first attempt failed without an answer; this one runs instead
+
+        try:
+            try:
+                status_code, body = 200, jsonable_encoder(handler())
+            except HTTPException as exc:
+                status_code, body = exc.status_code, {"detail": exc.detail}
+            pending.result = (fingerprint, status_code, body)
+            self.results.set(key, pending.result)
+            return status_code, body, False
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+            pending.done.set()
+
+    def _replay(self, cached, fingerprint):
+        cached_fingerprint, status_code, body = cached
+        if cached_fingerprint != fingerprint:
+            raise _mismatch()
+        with self._lock:
+            self.replays += 1
+        return status_code, body, True
+
+    def clear(self):
+        self.results.clear()
+
+    def stats(self):
+        return {**self.results.stats(), "replays": self.replays, "inFlight": len(self._in_flight)}
+
+
+def _mismatch():
+    return HTTPException(422, "Idempotency-Key was already used for a different request")
+
+
+idempotency_cache = IdempotencyCache(
+    maxsize=int(os.environ.get("WALLET_IDEMPOTENCY_CACHE_SIZE", "10000")),
+    ttl=float(os.environ.get("WALLET_IDEMPOTENCY_TTL", "86400")),
+)
+
+
+def idempotent(key, user_id, action, payload, handler):
+    """Runs ``handler`` at most once per (user, action, Idempotency-Key).
+
+    The PIN is left out of the request fingerprint; it is checked before
+    this is called and has no bearing on what the request does.
+    """
+    if key is None:
+        return handler()
+    if not key or len(key) > MAX_KEY_LENGTH:
+        raise HTTPException(400, f"Idempotency-Key must be 1 to {MAX_KEY_LENGTH} characters")
+
+    fingerprint = hashlib.sha256(json.dumps(payload.model_dump(exclude={"pin"}), sort_keys=True).encode()).hexdigest()
+    status_code, body, replayed = idempotency_cache.run((user_id, action, key), fingerprint, handler)
+    headers = {"Idempotent-Replayed": "true"} if replayed else {}
+    return JSONResponse(body, status_code=status_code, headers=headers)
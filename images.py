@@ -0,0 +1,161 @@
+import hashlib
+import os
+import re
+import tempfile
+import threading
+from pathlib import Path
+
+from fastapi import HTTPException
+from fastapi.staticfiles import StaticFiles
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse, JSONResponse
+from starlette.staticfiles import NotModifiedResponse
+
+UPLOAD_ROOT = Path("uploads")
+PROFILE_DIR = UPLOAD_ROOT / "profiles"
+MAX_IMAGE_BYTES = int(os.environ.get("WALLET_MAX_IMAGE_BYTES", str(5 * 1024 * 1024)))
+CHUNK_SIZE = 64 * 1024
+
+# Multipart framing around the file; anything declared beyond this is refused unread
+FORM_OVERHEAD = 16 * 1024
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+_CONTENT_NAME = re.compile(r"^([0-9a-f]{64})(\.[a-z0-9]{1,8})?$")
+
+# Held while a file is published and referenced, and while an unreferenced
+# one is removed, so a removal never races an upload of the same content.
+lock = threading.Lock()
+
+
+def extension(filename):
+    ext = os.path.splitext(filename or "")[1].lower()
+    return ext if re.fullmatch(r"\.[a-z0-9]{1,8}", ext) else ""
+
+
+def declared_too_large(content_length):
+    return bool(content_length and content_length.isdigit() and int(content_length) > MAX_IMAGE_BYTES + FORM_OVERHEAD)
+
+
+def too_large():
+    return HTTPException(413, f"Image must be at most {MAX_IMAGE_BYTES // 1024} KB")
+
+
+def receive(source):
+    """Copies ``source`` to a temp file chunk by chunk, hashing as it goes.
+
+    Returns ``(temp_path, sha256 hex)``. Stops and raises 413 as soon as
+    more than MAX_IMAGE_BYTES have been read.
+    """
+    PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+    digest = hashlib.sha256()
+    size = 0
+    fd, temp_path = tempfile.mkstemp(dir=PROFILE_DIR, suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as out:
+            while chunk := source.read(CHUNK_SIZE):
+                size += len(chunk)
+                if size > MAX_IMAGE_BYTES:
+                    raise too_large()
+                digest.update(chunk)
+                out.write(chunk)
+        if not size:
+            raise HTTPException(400, "Image is empty")
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+    return temp_path, digest.hexdigest()
+
+
+def publish(temp_path, digest, ext):
+    """Moves a received file to its content-addressed name; call under ``lock``.
+
+    If the same content is already stored the new copy is dropped.
+    """
+    path = PROFILE_DIR / f"{digest}{ext}"
+    if path.exists():
+        os.unlink(temp_path)
+    else:
+        os.replace(temp_path, path)
+    return path.as_posix()
+
+
+def release(store, path):
+    """Deletes an image file that no user refers to any more."""
+    if not path:
+        return
+    with lock:
+        if any(user.get("profileImage") == path for user in store.list_users()):
+            return
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+class UploadFiles(StaticFiles):
+    """StaticFiles that marks content-addressed files as immutable.
+
+    A file named after the sha256 of its content gets that hash as a strong
+    ETag and may be cached for a year; older uploads keep the default headers.
+    """
+
+    def file_response(self, full_path, stat_result, scope, status_code=200):
+        match = _CONTENT_NAME.match(os.path.basename(full_path))
+        if match is None:
+            return super().file_response(full_path, stat_result, scope, status_code)
+        response = FileResponse(full_path, status_code=status_code, stat_result=stat_result)
+        response.headers["etag"] = f'"{match.group(1)}"'
+        response.headers["cache-control"] = IMMUTABLE
+        if self.is_not_modified(response.headers, Headers(scope=scope)):
+            return NotModifiedResponse(response.headers)
+        return response
+
+
+class UploadLimit:
+    """ASGI middleware refusing request bodies to ``path`` that outgrow an upload.
+
+    A declared Content-Length over the limit is refused before anything is
+    read. Otherwise the body is counted as it arrives, so a chunked upload
+    is stopped with 413 at the limit instead of being spooled whole.
+    """
+
+    def __init__(self, app, path):
+        self.app = app
+        self.path = path
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] != self.path:
+            await self.app(scope, receive, send)
+            return
+        if declared_too_large(Headers(scope=scope).get("content-length")):
+            await self._refuse(scope, receive, send)
+            return
+
+        received = 0
+        started = False
+
+        async def counting_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > MAX_IMAGE_BYTES + FORM_OVERHEAD:
+                    raise too_large()
+            return message
+
+        async def tracking_send(message):
+            nonlocal started
+            started = started or message["type"] == "http.response.start"
+            await send(message)
+
+        try:
+            await self.app(scope, counting_receive, tracking_send)
+        except HTTPException as exc:
+            # Raised from the body read with nothing sent yet; anything else is not ours
+            if exc.status_code != 413 or started:
+                raise
+            await self._refuse(scope, receive, send)
+
+    @staticmethod
+    async def _refuse(scope, receive, send):
+        await JSONResponse({"detail": too_large().detail}, status_code=413)(scope, receive, send)
@@ -0,0 +1,333 @@
+from bisect import bisect_left, bisect_right, insort
+from collections import deque
+from datetime import date, timedelta
+from functools import lru_cache
+
+# How many transactions /transactions/recent returns
+RECENT_SIZE = 10
+
+# Sorts after any transaction id, so (date, _HIGHEST) bounds everything on that date
+_HIGHEST = "\U0010ffff"
+
+
+def tx_key(tx):
+    return (tx["createdAt"], tx["id"])
+
+
+class TimeIndex:
+    """One wallet's transactions kept sorted by (createdAt, id).
+
+    ``keys`` and ``items`` are parallel lists so range lookups are a bisect
+    and new transactions, which almost always carry the newest timestamp,
+    land at the end without shifting anything.
+    """
+
+    __slots__ = ("keys", "items")
+
+    def __init__(self):
+        self.keys = []
+        self.items = []
+
+    def __len__(self):
+        return len(self.items)
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def insert(self, tx):
+        key = tx_key(tx)
+        if not self.keys or self.keys[-1] <= key:
+            self.keys.append(key)
+            self.items.append(tx)
+            return
+        i = bisect_right(self.keys, key)
+        self.keys.insert(i, key)
+        self.items.insert(i, tx)
+
+    def remove(self, tx):
+        i = self._position(tx)
+        if i is None:
+            return False
+        del self.keys[i]
+        del self.items[i]
+        return True
+
+    def replace(self, old, new):
+        if tx_key(old) == tx_key(new):
+            i = self._position(old)
+            if i is not None:
+                self.items[i] = new
+                return
+        self.remove(old)
+        self.insert(new)
+
+    def bounds(self, start_date=None, end_date=None, before=None, after=None):
+        """Index range [lo, hi) of transactions inside the given window.
+
+        ``start_date`` and ``end_date`` compare against createdAt the same way
+        the string filters always have; ``before`` and ``after`` are
+        exclusive (createdAt, id) keys used by cursors.
+        """
+        lo = bisect_left(self.keys, (start_date,)) if start_date else 0
+        hi = bisect_right(self.keys, (end_date, _HIGHEST)) if end_date else len(self.keys)
+        if before is not None:
+            hi = min(hi, bisect_left(self.keys, tuple(before)))
+        if after is not None:
+            lo = max(lo, bisect_right(self.keys, tuple(after)))
+        return lo, max(lo, hi)
+
+    def _position(self, tx):
+        key = tx_key(tx)
+        i = bisect_left(self.keys, key)
+        while i < len(self.keys) and self.keys[i] == key:
+            if self.items[i] is tx:
+                return i
+            i += 1
+        return None
+
+
+class RecentBuffer:
+    """Fixed-size, newest-first window of one wallet's non-deleted transactions.
+
+    New transactions are pushed on the front and the oldest falls off the
+    back. Removing a member leaves a hole that is refilled from the wallet's
+    TimeIndex, which only has to walk back past the buffer's own length.
+    """
+
+    __slots__ = ("items",)
+
+    def __init__(self, index, size=RECENT_SIZE):
+        self.items = deque(maxlen=size)
+        self.refill(index)
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def refill(self, index):
+        self.items.clear()
+        for tx in reversed(index.items):
+            if not tx.get("isDeleted"):
+                self.items.append(tx)
+                if len(self.items) == self.items.maxlen:
+                    break
+
+    def offer(self, tx):
+        if tx.get("isDeleted"):
+            return
+        items = self.items
+        key = tx_key(tx)
+        if not items or key >= tx_key(items[0]):
+            items.appendleft(tx)
+            return
+        if len(items) == items.maxlen:
+            if key <= tx_key(items[-1]):
+                return
+            items.pop()
+        # Out-of-order arrival (journal replay, imported history)
+        pos = next((i for i, t in enumerate(items) if tx_key(t) < key), len(items))
+        items.insert(pos, tx)
+
+    def __contains__(self, tx):
+        return any(t is tx for t in self.items)
+
+
+def search_terms(user):
+    """Lowercased strings a user can be found by: full name, each name word, email."""
+    name = " ".join((user.get("name") or "").lower().split())
+    terms = {name, *name.split(), (user.get("email") or "").lower().strip()}
+    terms.discard("")
+    return terms
+
+
+def canonical_term(terms, prefix):
+    """The smallest of a user's terms that starts with ``prefix``.
+
+    Prefix searches list each user once, under this term, so a user who
+    matches by both name and email is not repeated across pages.
+    """
+    return min((t for t in terms if t.startswith(prefix)), default=None)
+
+
+class PrefixIndex:
+    """Sorted (term, user id) pairs for prefix search over users.
+
+    A search is a bisect to the first term with the prefix followed by a
+    walk that stops at the first term without it, so its cost depends on
+    the page size, not on how many users there are.
+    """
+
+    __slots__ = ("keys", "terms")
+
+    def __init__(self):
+        self.keys = []
+        self.terms = {}
+
+    def add(self, user):
+        self.remove(user["id"])
+        terms = self.terms[user["id"]] = search_terms(user)
+        for term in terms:
+            insort(self.keys, (term, user["id"]))
+
+    def remove(self, user_id):
+        for term in self.terms.pop(user_id, ()):
+            key = (term, user_id)
+            i = bisect_left(self.keys, key)
+            if i < len(self.keys) and self.keys[i] == key:
+                del self.keys[i]
+
+    def scan(self, prefix, after=None, chunk=64):
+        """(term, user id) keys whose term starts with ``prefix``, in order.
+
+        Resumes after the exclusive key ``after``. Works a chunk at a time,
+        re-bisecting from the last key, so concurrent changes never make it
+        skip or repeat a key that was there throughout.
+        """
+        lo = bisect_left(self.keys, (prefix,))
+        if after is not None:
+            lo = max(lo, bisect_right(self.keys, tuple(after)))
+        while True:
+            batch = self.keys[lo:lo + chunk]
+            for key in batch:
+                if not key[0].startswith(prefix):
+                    return
+                yield key
+            if len(batch) < chunk:
+                return
+            lo = bisect_right(self.keys, batch[-1])
+
+
+@lru_cache(maxsize=4096)
+def week_start(day):
+    """Monday of the ISO week containing ``day`` (YYYY-MM-DD)."""
+    d = date.fromisoformat(day)
+    return (d - timedelta(days=d.weekday())).isoformat()
+
+
+PERIODS = ("daily", "weekly", "monthly")
+
+
+def period_keys(created_at):
+    day = created_at[:10]
+    return {"daily": day, "weekly": week_start(day), "monthly": day[:7]}
+
+
+def period_bounds(start_date=None, end_date=None):
+    """Inclusive bucket-key range per period for a YYYY-MM-DD date window."""
+    start_date = start_date[:10] if start_date else None
+    end_date = end_date[:10] if end_date else None
+    return {
+        "daily": (start_date, end_date),
+        "weekly": (start_date and week_start(start_date), end_date),
+        "monthly": (start_date and start_date[:7], end_date and end_date[:7]),
+    }
+
+
+def rollup_contribution(tx):
+    """What one transaction adds to each of its buckets, or None if nothing."""
+    if tx.get("isDeleted"):
+        return None
+    status = tx["status"].lower()
+    success = status == "success"
+    return {
+        "status": status,
+        "debit": tx["amount"] if success and tx["type"] == "debit" else 0,
+        "credit": tx["amount"] if success and tx["type"] == "credit" else 0,
+        "fee": tx.get("fee", 0) if success else 0,
+    }
+
+
+def sum_ledger(transactions, before=0):
+    """Ledger totals of a wallet's transactions, given oldest first.
+
+    Deleted transactions count: deleting one hides it but does not give the
+    money back. See ``Storage.ledger_totals`` for the keys.
+    """
+    count = 0
+    credit = debit = fee = 0
+    tx = None
+    for tx in transactions:
+        count += 1
+        if tx["status"].lower() != "success":
+            continue
+        if tx["type"] == "credit":
+            credit += tx["amount"]
+        elif tx["type"] == "debit":
+            debit += tx["amount"]
+        fee += tx.get("fee", 0)
+    return {
+        "count": count,
+        "before": before,
+        "credit": credit,
+        "debit": debit,
+        "fee": fee,
+        "last": list(tx_key(tx)) if tx is not None else None,
+    }
+
+
+def bucket_row(key, debit, credit, fee, counts):
+    return {
+        "period": key,
+        "debit": round(debit, 2),
+        "credit": round(credit, 2),
+        "fee": round(fee, 2),
+        "counts": {status: n for status, n in counts.items() if n},
+    }
+
+
+def summarize(result):
+    """Adds overall totals, taken from the daily rows, to a per-period result."""
+    totals = {"debit": 0, "credit": 0, "fee": 0, "counts": {}}
+    for row in result["daily"]:
+        for field in ("debit", "credit", "fee"):
+            totals[field] += row[field]
+        for status, n in row["counts"].items():
+            totals["counts"][status] = totals["counts"].get(status, 0) + n
+    result["totals"] = bucket_row(None, **totals)
+    del result["totals"]["period"]
+    return result
+
+
+class Rollup:
+    """Per-wallet daily, weekly and monthly buckets of transaction totals.
+
+    Debit, credit and fee totals count successful transactions only; the
+    status counts cover every non-deleted transaction. Buckets are updated
+    as transactions are added, removed or change status, and each period's
+    keys are kept sorted so a date range is answered by bisecting to the
+    buckets it overlaps.
+    """
+
+    __slots__ = ("buckets", "keys")
+
+    def __init__(self, index):
+        self.buckets = {period: {} for period in PERIODS}
+        self.keys = {period: [] for period in PERIODS}
+        for tx in index:
+            self.add(tx)
+
+    def add(self, tx, sign=1):
+        contribution = rollup_contribution(tx)
+        if contribution is None:
+            return
+        status = contribution["status"]
+        for period, key in period_keys(tx["createdAt"]).items():
+            bucket = self.buckets[period].get(key)
+            if bucket is None:
+                bucket = self.buckets[period][key] = {"debit": 0, "credit": 0, "fee": 0, "counts": {}}
+                insort(self.keys[period], key)
+            bucket["counts"][status] = bucket["counts"].get(status, 0) + sign
+            for field in ("debit", "credit", "fee"):
+                bucket[field] += sign * contribution[field]
+
+    def remove(self, tx):
+        self.add(tx, -1)
+
+    def query(self, start_date=None, end_date=None):
+        result = {}
+        for period, (low, high) in period_bounds(start_date, end_date).items():
+            keys = self.keys[period]
+            lo = bisect_left(keys, low) if low else 0
+            hi = bisect_right(keys, high) if high else len(keys)
+            rows = [bucket_row(key, **self.buckets[period][key]) for key in keys[lo:hi]]
+            result[period] = [row for row in rows if row["counts"]]
+        return summarize(result)
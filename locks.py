@@ -0,0 +1,52 @@
+import threading
+from contextlib import contextmanager
+
+
+class LockManager:
+    """Hands out one lock per key, created on demand and dropped when unused.
+
+    ``hold`` always acquires in sorted key order, so two requests that need
+    the same pair of wallets (a debit on one, a credit on the other) can
+    never wait on each other in opposite directions.
+    """
+
+    def __init__(self):
+        self._guard = threading.Lock()
+        self._locks = {}
+
+    @contextmanager
+    def hold(self, *keys):
+        keys = sorted({k for k in keys if k is not None})
+        acquired = []
+        try:
+            for key in keys:
+                lock = self._checkout(key)
+                try:
+                    lock.acquire()
+                except BaseException:
+                    self._checkin(key)
+                    raise
+                acquired.append(key)
+            yield
+        finally:
+            for key in reversed(acquired):
+                self._locks[key][0].release()
+                self._checkin(key)
+
+    def _checkout(self, key):
+        with self._guard:
+            entry = self._locks.get(key)
+            if entry is None:
+                entry = self._locks[key] = [threading.Lock(), 0]
+            entry[1] += 1
+            return entry[0]
+
+    def _checkin(self, key):
+        with self._guard:
+            entry = self._locks[key]
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[key]
+
+
+wallet_locks = LockManager()
@@ -1,14 +1,25 @@
-from fastapi import FastAPI
-from fastapi.staticfiles import StaticFiles
+import time
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
-from routers import auth, users, wallet, transactions, config
+from starlette.concurrency import run_in_threadpool
+from routers import auth, users, wallet, transactions, config, events, admin
+from admission import WRITE_PATHS, write_admission
+from dependencies import request_user_id, sessions
+from rules import rules_cache
+from idempotency import idempotency_cache
+from events import event_bus
+from db import get_store, loaded_store
+from metrics import http_in_flight, http_latency, http_requests, registry
+import profiler
+import images
 import os
 
 app = FastAPI(title="Mini Wallet API")
 
-os.makedirs("uploads/profiles", exist_ok=True)
+os.makedirs(images.PROFILE_DIR, exist_ok=True)
 
-app.mount("/uploads", StaticFiles(directory="uploads"), name="uploads")
+app.mount("/uploads", images.UploadFiles(directory=images.UPLOAD_ROOT), name="uploads")
 
 app.add_middleware(
     CORSMiddleware,
@@ -16,14 +27,86 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag"],
 )
 
+# Set WALLET_PROFILE_SLOW_MS to dump stack samples of requests slower than that
+slow_request_profiler = profiler.from_env()
+
+# Refuse oversized uploads before the body is read and spooled, with or without a Content-Length
+app.add_middleware(images.UploadLimit, path="/users/me/image")
+
+@app.middleware("http")
+async def admit_writes(request: Request, call_next):
+    # Turned away here on the event loop, so excess writes never queue for a worker thread
+    if request.method != "POST" or request.url.path not in WRITE_PATHS:
+        return await call_next(request)
+    # Only the cached rules are used here; bringing them up to date reads the store, which can block
+    snapshot = rules_cache.peek(loaded_store())
+    if snapshot is None:
+        snapshot = await run_in_threadpool(lambda: rules_cache.get(get_store()))
+    rejection = write_admission.admit(request_user_id(request), snapshot.rules)
+    if rejection is not None:
+        status, retry_after, detail = rejection
+        return JSONResponse({"detail": detail}, status_code=status, headers={"Retry-After": str(retry_after)})
+    try:
+        return await call_next(request)
+    finally:
+        write_admission.release()
+
+@app.middleware("http")
+async def record_metrics(request: Request, call_next):
+    http_in_flight.inc()
+    profile = None
+    if slow_request_profiler is not None:
+        profile = slow_request_profiler.begin(f"{request.method} {request.url.path}")
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        elapsed = time.perf_counter() - started
+        http_in_flight.dec()
+        # Label by route template so ids in paths do not each get a series
+        route = getattr(request.scope.get("route"), "path", "unmatched")
+        http_requests.inc(method=request.method, route=route, status=str(status))
+        http_latency.observe(elapsed, method=request.method, route=route)
+        if profile is not None:
+            slow_request_profiler.end(profile, elapsed)
+
 app.include_router(auth.router)
 app.include_router(users.router)
 app.include_router(wallet.router)
 app.include_router(transactions.router)
 app.include_router(config.router)
+app.include_router(events.router)
+app.include_router(admin.router)
 
 @app.get("/health")
 def health():
     return {"status": "OK"}
+
+@app.get("/health/ready")
+def health_ready():
+    # Opening the store is the slow part of a cold start; then wallets still in
+    # the binary snapshot are paged in behind the scenes
+    warming = get_store().warming()
+    if warming:
+        return JSONResponse({"status": "warming", "walletsPending": warming}, status_code=503)
+    return {"status": "ready"}
+
+@app.get("/health/stats")
+def health_stats():
+    return {
+        "sessions": sessions.stats(),
+        "idempotency": idempotency_cache.stats(),
+        "events": event_bus.stats(),
+        "writes": write_admission.stats(),
+        "storage": get_store().stats(),
+    }
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
@@ -0,0 +1,38 @@
+"""Import a JSON database (snapshot plus journal) into a SQLite database.
+
+    python migrate.py [--from db.json] [--to wallet.db]
+
+The SQLite database is created if needed and its contents are replaced.
+Start the server with WALLET_STORAGE=sqlite to use it.
+"""
+import argparse
+
+from db import DB_PATH, SQLITE_PATH, JsonStore
+from sqlite_store import SQLiteStore
+
+
+def migrate(json_path, sqlite_path):
+    source = JsonStore(json_path)
+    try:
+        data = source.to_dict()
+    finally:
+        source.close()
+
+    target = SQLiteStore(sqlite_path)
+    try:
+        target.import_data(data)
+    finally:
+        target.close()
+
+    return {name: len(data[name]) for name in ("users", "wallets", "transactions")}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import db.json into a SQLite database")
+    parser.add_argument("--from", dest="source", default=str(DB_PATH), help="JSON database to read")
+    parser.add_argument("--to", dest="target", default=str(SQLITE_PATH), help="SQLite database to write")
+    args = parser.parse_args()
+
+    counts = migrate(args.source, args.target)
+    print(f"Imported {counts['users']} users, {counts['wallets']} wallets and "
+          f"{counts['transactions']} transactions into {args.target}")
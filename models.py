@@ -1,5 +1,5 @@
-from pydantic import BaseModel, EmailStr
-from typing import Optional
+from pydantic import BaseModel, EmailStr, Field
+from typing import List, Optional
 
 class RegisterRequest(BaseModel):
     name: str
@@ -22,6 +22,14 @@ class TransferRequest(BaseModel):
     amount: float
     pin: str
 
+class TransferLeg(BaseModel):
+    toUserId: str
+    amount: float = Field(..., gt=0)
+
+class BatchTransferRequest(BaseModel):
+    transfers: List[TransferLeg]
+    pin: str
+
 class UserUpdateRequest(BaseModel):
     name: str
 
@@ -30,4 +38,7 @@ class TransactionStatusUpdate(BaseModel):
     reason: Optional[str] = None
 
 class BusinessRulesUpdate(BaseModel):
-    maxTransferLimit: float
+    maxTransferLimit: Optional[float] = None
+    writeRateLimit: Optional[float] = Field(None, ge=0)
+    writeBurstLimit: Optional[float] = Field(None, ge=0)
+    maxInFlightWrites: Optional[int] = Field(None, ge=0)
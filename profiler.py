@@ -0,0 +1,125 @@
+"""Optional sampling profiler for slow requests.
+
+Enabled by setting WALLET_PROFILE_SLOW_MS. While any request is in flight a
+background thread samples the stacks of every thread that is running
+application code, every WALLET_PROFILE_INTERVAL_MS (default 5). When a
+request takes longer than the threshold, the samples taken during it are
+written to WALLET_PROFILE_DIR (default profiles/) in the folded format
+flamegraph tools read: one ``frame;frame;frame count`` line per stack.
+
+Handlers run on a thread pool, so a sample cannot be tied to a request
+with certainty. Samples go to every request in flight at the time; the
+dump header records how many overlapped, and a profile taken with a
+single client is exact.
+"""
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+
+logger = logging.getLogger("wallet.profiler")
+
+APP_ROOT = str(Path(__file__).resolve().parent)
+
+
+class _Profile:
+    __slots__ = ("label", "samples", "overlap")
+
+    def __init__(self, label):
+        self.label = label
+        self.samples = Counter()
+        self.overlap = 1
+
+
+class SlowRequestProfiler:
+    def __init__(self, threshold, interval=0.005, directory="profiles"):
+        self.threshold = threshold
+        self.interval = interval
+        self.directory = Path(directory)
+        self.dumps = 0
+        self._active = set()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def begin(self, label):
+        profile = _Profile(label)
+        with self._lock:
+            self._active.add(profile)
+            overlap = len(self._active)
+            for other in self._active:
+                other.overlap = max(other.overlap, overlap)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="slow-request-profiler", daemon=True)
+                self._thread.start()
+        self._wake.set()
+        return profile
+
+    def end(self, profile, seconds):
+        """Stops sampling for ``profile``; returns the dump path if it was slow."""
+        with self._lock:
+            self._active.discard(profile)
+            if not self._active:
+                self._wake.clear()
+        if seconds < self.threshold or not profile.samples:
+            return None
+        return self._dump(profile, seconds)
+
+    def _dump(self, profile, seconds):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        with self._lock:
+            samples = profile.samples.most_common()
+            self.dumps += 1
+            seq = self.dumps
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        name = re.sub(r"[^A-Za-z0-9_.-]+", "_", profile.label).strip("_")
+        path = self.directory / f"{stamp}-{seq}-{int(seconds * 1000)}ms-{name}.folded"
+        total = sum(count for _, count in samples)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(f"# {profile.label} took {seconds * 1000:.1f}ms, {total} samples every "
+                    f"{self.interval * 1000:g}ms, {profile.overlap} request(s) in flight\n")
+            for stack, count in samples:
+                f.write(f"{stack} {count}\n")
+        logger.warning("Slow request %s (%.1fms), stack samples in %s", profile.label, seconds * 1000, path)
+        return path
+
+    def _run(self):
+        own = threading.get_ident()
+        while True:
+            self._wake.wait()
+            time.sleep(self.interval)
+            stacks = [self._fold(frame) for ident, frame in sys._current_frames().items() if ident != own]
+            stacks = [stack for stack in stacks if stack]
+            with self._lock:
+                for profile in self._active:
+                    profile.samples.update(stacks)
+
+    @staticmethod
+    def _fold(frame):
+        frames = []
+        in_app = False
+        while frame is not None:
+            code = frame.f_code
+            filename = code.co_filename
+            if filename.startswith(APP_ROOT) and "site-packages" not in filename and filename != __file__:
+                in_app = True
+            frames.append(f"{os.path.basename(filename)}:{code.co_name}")
+            frame = frame.f_back
+        if not in_app:
+            return None
+        return ";".join(reversed(frames))
+
+
+def from_env():
+    threshold = os.environ.get("WALLET_PROFILE_SLOW_MS")
+    if not threshold:
+        return None
+    return SlowRequestProfiler(
+        float(threshold) / 1000,
+        interval=float(os.environ.get("WALLET_PROFILE_INTERVAL_MS", "5")) / 1000,
+        directory=os.environ.get("WALLET_PROFILE_DIR", "profiles"),
+    )
@@ -0,0 +1,222 @@
+"""Check every wallet's balance against its transactions.
+
+    python reconcile.py [--workers 4] [--full] [--checkpoint reconcile.json]
+
+A wallet is consistent when its balance equals its successful credits
+minus its successful debits and their fees. Each run saves, per wallet,
+the totals up to its newest transaction (its watermark), so the next run
+only adds up the transactions after it. A wallet whose history was
+rewritten since by a status change is added up again from the start.
+
+Wallets are split across worker processes forked from the one holding the
+store, so they read its resident copy instead of loading their own. The
+command opens the store itself: stop the server first, or set
+WALLET_MULTIPROCESS=1 for both. POST /admin/reconcile runs the same job
+inside the server. The command exits with status 1 if any wallet is off.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from db import open_store
+from locks import wallet_locks
+from metrics import registry
+from utils import now
+
+CHECKPOINT_PATH = Path(os.environ.get("WALLET_RECONCILE_CHECKPOINT", "reconcile.json"))
+RECONCILE_WORKERS = int(os.environ.get("WALLET_RECONCILE_WORKERS", str(os.cpu_count() or 1)))
+
+# Differences smaller than this are float rounding, not money
+TOLERANCE = 0.005
+
+reconcile_runs = registry.counter("wallet_reconcile_runs_total", "Reconciliation runs finished.")
+reconcile_mismatches = registry.gauge(
+    "wallet_reconcile_mismatched_wallets", "Wallets whose balance disagreed with their transactions in the last run.")
+
+_running = threading.Lock()
+
+# The store forked workers read; set only while a pool is running
+_store = None
+
+
+class AlreadyRunning(RuntimeError):
+    pass
+
+
+def mark_amended(store, wallet_id):
+    """Notes that some of a wallet's past transactions changed.
+
+    Call inside the write's ``transaction()``, holding the wallet's lock.
+    The next run adds that wallet up from the start, not its watermark.
+    """
+    wallet = store.get_wallet(wallet_id)
+    if wallet is not None:
+        wallet["ledgerRevision"] = wallet.get("ledgerRevision", 0) + 1
+        store.put_wallet(wallet)
+
+
+def check_wallet(store, wallet, entry=None):
+    """Checks one wallet, carrying on from its checkpoint ``entry`` if still valid.
+
+    Returns the wallet's new entry, a mismatch (or None) and how many
+    transactions were read.
+    """
+    revision = wallet.get("ledgerRevision", 0)
+    if entry is not None and entry["revision"] != revision:
+        entry = None
+    totals = store.ledger_totals(wallet["id"], entry["after"] if entry else None)
+    if entry is not None and totals["before"] != entry["count"]:
+        # Something was added behind the watermark
+        entry = None
+        totals = store.ledger_totals(wallet["id"])
+
+    base = entry or {"after": None, "count": 0, "credit": 0, "debit": 0, "fee": 0}
+    entry = {
+        "after": totals["last"] or base["after"],
+        "count": base["count"] + totals["count"],
+        "credit": base["credit"] + totals["credit"],
+        "debit": base["debit"] + totals["debit"],
+        "fee": base["fee"] + totals["fee"],
+        "revision": revision,
+    }
+    expected = entry["credit"] - entry["debit"] - entry["fee"]
+    mismatch = None
+    if abs(wallet["balance"] - expected) > TOLERANCE:
+        mismatch = {
+            "walletId": wallet["id"],
+            "userId": wallet.get("userId"),
+            "balance": wallet["balance"],
+            "expected": round(expected, 2),
+            "difference": round(wallet["balance"] - expected, 2),
+            "credit": round(entry["credit"], 2),
+            "debit": round(entry["debit"], 2),
+            "fee": round(entry["fee"], 2),
+            "transactions": entry["count"],
+        }
+    return entry, mismatch, totals["count"]
+
+
+def _check(store, shard):
+    entries, mismatches, read = {}, [], 0
+    for wallet_id, entry in shard:
+        wallet = store.get_wallet(wallet_id)
+        if wallet is None:
+            continue
+        entries[wallet_id], mismatch, n = check_wallet(store, wallet, entry)
+        read += n
+        if mismatch is not None:
+            mismatches.append(mismatch)
+    return entries, mismatches, read
+
+
+def _check_shard(shard):
+    return _check(_store, shard)
+
+
+def _forked_map(store, shards):
+    global _store
+    _store = store
+    try:
+        # Forked after _store is set, so each worker starts with the store already in memory
+        with ProcessPoolExecutor(len(shards), mp_context=multiprocessing.get_context("fork"),
+                                 initializer=store._after_fork) as pool:
+            return list(pool.map(_check_shard, shards))
+    finally:
+        _store = None
+
+
+def load_checkpoint(path):
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)["wallets"]
+    except (OSError, ValueError, KeyError):
+        # None yet, or unreadable: the run starts over and writes a new one
+        return {}
+
+
+def save_checkpoint(path, wallets):
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(json.dumps({"checkedAt": now(), "wallets": wallets}, separators=(",", ":")))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def reconcile(store, workers=None, full=False, checkpoint_path=None):
+    """Checks every wallet in ``store``, saves the new checkpoint and returns the report.
+
+    ``full`` ignores the checkpoint. Raises AlreadyRunning if another run
+    in this process has not finished.
+    """
+    if not _running.acquire(blocking=False):
+        raise AlreadyRunning("A reconciliation is already running")
+    try:
+        started = time.perf_counter()
+        checkpoint_path = Path(checkpoint_path or CHECKPOINT_PATH)
+        checkpoint = {} if full else load_checkpoint(checkpoint_path)
+        wallet_ids = [wallet["id"] for wallet in store.list_wallets()]
+        workers = max(1, min(workers or RECONCILE_WORKERS, len(wallet_ids)))
+        shards = [[(wallet_id, checkpoint.get(wallet_id)) for wallet_id in wallet_ids[i::workers]]
+                  for i in range(workers)]
+        if workers > 1 and "fork" in multiprocessing.get_all_start_methods():
+            results = _forked_map(store, shards)
+        else:
+            workers = 1
+            results = [_check(store, [item for shard in shards for item in shard])]
+
+        entries, suspects, read = {}, [], 0
+        for shard_entries, shard_mismatches, shard_read in results:
+            entries.update(shard_entries)
+            suspects.extend(shard_mismatches)
+            read += shard_read
+
+        mismatches = []
+        for suspect in suspects:
+            # Workers may have caught a transfer half written; look again with the wallet locked
+            wallet_id = suspect["walletId"]
+            with wallet_locks.hold(wallet_id):
+                wallet = store.get_wallet(wallet_id)
+                if wallet is None:
+                    entries.pop(wallet_id, None)
+                    continue
+                entries[wallet_id], mismatch, _ = check_wallet(store, wallet)
+            if mismatch is not None:
+                mismatches.append(mismatch)
+        mismatches.sort(key=lambda m: (-abs(m["difference"]), m["walletId"]))
+
+        save_checkpoint(checkpoint_path, entries)
+        reconcile_runs.inc()
+        reconcile_mismatches.set(len(mismatches))
+        return {
+            "wallets": len(entries),
+            "transactionsRead": read,
+            "full": full or not checkpoint,
+            "workers": workers,
+            "seconds": round(time.perf_counter() - started, 3),
+            "mismatches": mismatches,
+        }
+    finally:
+        _running.release()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check wallet balances against their transactions")
+    parser.add_argument("--workers", type=int, default=RECONCILE_WORKERS, help="Worker processes to split wallets across")
+    parser.add_argument("--full", action="store_true", help="Ignore the checkpoint and add up every transaction")
+    parser.add_argument("--checkpoint", default=str(CHECKPOINT_PATH), help="Where per-wallet watermarks are kept")
+    args = parser.parse_args()
+
+    store = open_store()
+    try:
+        report = reconcile(store, args.workers, args.full, args.checkpoint)
+    finally:
+        store.close()
+    print(json.dumps(report, indent=2))
+    sys.exit(1 if report["mismatches"] else 0)
@@ -0,0 +1,18 @@
+import os
+from fastapi import APIRouter, Depends, HTTPException, Query
+from db import get_store
+from dependencies import require_admin
+import reconcile
+
+router = APIRouter(prefix="/admin", tags=["Admin"], dependencies=[Depends(require_admin)])
+
+@router.post("/reconcile")
+def run_reconciliation(full: bool = False, workers: int = Query(None, ge=1)):
+    # More processes than cores only adds forks
+    if workers is not None:
+        workers = min(workers, os.cpu_count() or 1)
+    try:
+        report = reconcile.reconcile(get_store(), workers=workers, full=full)
+    except reconcile.AlreadyRunning as exc:
+        raise HTTPException(409, str(exc))
+    return {"mismatches": report["mismatches"]}
@@ -1,50 +1,51 @@
-from fastapi import APIRouter, HTTPException, Response, Depends
-from db import read_db, write_db
+from fastapi import APIRouter, BackgroundTasks, HTTPException, Response, Depends
+from db import get_store
 from models import RegisterRequest, LoginRequest, SetPinRequest
 from utils import generate_id
-from dependencies import get_current_user
+from dependencies import get_current_user, invalidate_session, session_token
+from locks import wallet_locks
+import images
 
 router = APIRouter(prefix="/auth", tags=["Auth"])
 
 @router.post("/register")
 def register(payload: RegisterRequest):
-    db = read_db()
-
-    if any(u["email"] == payload.email for u in db["users"]):
-        raise HTTPException(status_code=400, detail="Email already exists")
-
-    user_id = generate_id("u")
-    wallet_id = generate_id("w")
-
-    db["users"].append({
-        "id": user_id,
-        "name": payload.name,
-        "email": payload.email,
-        "password": payload.password,
-        "walletId": wallet_id
-    })
-
-    db["wallets"].append({
-        "id": wallet_id,
-        "userId": user_id,
-        "balance": 0,
-        "currency": "INR"
-    })
-
-    write_db(db)
+    store = get_store()
+
+    # Holding the index lock makes the email check and the insert atomic
+    with store.transaction(), store.lock:
+        if store.get_user_by_email(payload.email):
+            raise HTTPException(status_code=400, detail="Email already exists")
+
+        user_id = generate_id("u")
+        wallet_id = generate_id("w")
+
+        store.put_user({
+            "id": user_id,
+            "name": payload.name,
+            "email": payload.email,
+            "password": payload.password,
+            "walletId": wallet_id
+        })
+
+        store.put_wallet({
+            "id": wallet_id,
+            "userId": user_id,
+            "balance": 0,
+            "currency": "INR"
+        })
+
     return {"message": "User registered", "userId": user_id}
 
 
 @router.post("/login")
 def login(payload: LoginRequest, response: Response):
-    db = read_db()
-    email = payload.email.lower().strip()
-    user = next((u for u in db["users"] if u["email"].lower() == email and u["password"] == payload.password), None)
+    user = get_store().get_user_by_email(payload.email)
 
-    if not user:
+    if not user or user["password"] != payload.password:
         raise HTTPException(status_code=401, detail="Invalid credentials")
 
-    token = f"mock-token-{user['id']}"
+    token = session_token(user["id"])
     response.set_cookie(
         key="token",
         value=token,
@@ -69,34 +70,34 @@ def logout(response: Response):
 
 @router.post("/set-pin")
 def set_pin(payload: SetPinRequest, user: dict = Depends(get_current_user)):
-    db = read_db()
-    
-    db_user = next((u for u in db["users"] if u["id"] == user["id"]), None)
-    
-    if not db_user:
-        raise HTTPException(404, "User not found")
+    store = get_store()
+
+    with store.transaction():
+        db_user = store.get_user(user["id"])
+
+        if not db_user:
+            raise HTTPException(404, "User not found")
 
-    db_user["pin"] = payload.pin
-    write_db(db)
+        db_user["pin"] = payload.pin
+        store.put_user(db_user)
+    invalidate_session(user["id"])
     
     return {"message": "PIN set successfully"}
 
 @router.delete("/delete")
-def delete_user(response: Response, user: dict = Depends(get_current_user)):
-    db = read_db()
-    
-    user_wallet = next((w for w in db["wallets"] if w["userId"] == user["id"]), None)
-    
-    if user_wallet:
-        if "transactions" in db:
-            db["transactions"] = [t for t in db["transactions"] if t.get("walletId") != user_wallet["id"]]
-        
-        db["wallets"] = [w for w in db["wallets"] if w["id"] != user_wallet["id"]]
-    
-    # Remove the user
-    db["users"] = [u for u in db["users"] if u["id"] != user["id"]]
-    
-    write_db(db)
+def delete_user(response: Response, background_tasks: BackgroundTasks, user: dict = Depends(get_current_user)):
+    store = get_store()
+    user_wallet = store.get_wallet_for_user(user["id"])
+
+    with wallet_locks.hold(user_wallet["id"] if user_wallet else None), store.transaction():
+        # Drops the wallet together with its transactions
+        if user_wallet:
+            store.delete_wallet(user_wallet["id"])
+
+        # Remove the user
+        store.delete_user(user["id"])
+    invalidate_session(user["id"])
+    background_tasks.add_task(images.release, store, user.get("profileImage"))
     
     # Clear auth cookie
     response.delete_cookie("token")
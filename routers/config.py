@@ -1,18 +1,32 @@
-from fastapi import APIRouter
-from db import read_db, write_db
+from fastapi import APIRouter, Header, Response
+from admission import RULE_KEYS
+from db import get_store
+from dependencies import require_admin
 from models import BusinessRulesUpdate
+from rules import rules_cache
+from utils import not_modified
 
 router = APIRouter(prefix="/config", tags=["Config"])
 
+def rules_response(snapshot, response: Response):
+    response.headers["ETag"] = snapshot.etag
+    response.headers["Cache-Control"] = "no-cache"
+    return {**snapshot.rules, "version": snapshot.version}
+
 @router.get("/business-rules")
-def get_rules():
-    return read_db()["businessRules"]
+def get_rules(response: Response, if_none_match: str = Header(None, alias="If-None-Match")):
+    snapshot = rules_cache.get(get_store())
+    cached = not_modified(if_none_match, snapshot.etag, response, cache_control="no-cache")
+    if cached is not None:
+        return cached
+    return rules_response(snapshot, response)
 
 @router.put("/business-rules")
-def update_rules(rules: BusinessRulesUpdate):
-    db = read_db()
-    current_rules = db.get("businessRules", {})
-    current_rules["maxTransferLimit"] = rules.maxTransferLimit
-    db["businessRules"] = current_rules
-    write_db(db)
-    return current_rules
+def update_rules(rules: BusinessRulesUpdate, response: Response,
+                 x_admin_token: str = Header(None, alias="X-Admin-Token")):
+    changes = rules.model_dump(exclude_none=True)
+    # Otherwise a throttled client could lift its own limits
+    if RULE_KEYS & changes.keys():
+        require_admin(x_admin_token)
+    snapshot = rules_cache.update(get_store(), **changes)
+    return rules_response(snapshot, response)
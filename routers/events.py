@@ -0,0 +1,31 @@
+from fastapi import APIRouter, Depends
+from fastapi.responses import StreamingResponse
+from dependencies import get_current_user
+from events import event_bus
+
+router = APIRouter(tags=["Events"])
+
+# A comment line this often keeps proxies from closing an idle stream
+KEEPALIVE_SECONDS = 15
+
+@router.get("/events")
+async def stream_events(user: dict = Depends(get_current_user)):
+    subscription = event_bus.subscribe(user["id"])
+
+    async def stream():
+        try:
+            yield "retry: 3000\n\n"
+            while True:
+                messages = await subscription.get(KEEPALIVE_SECONDS)
+                for message in messages:
+                    yield message
+                if subscription.dropped:
+                    # Fell too far behind; the client reconnects and reloads
+                    return
+                if not messages:
+                    yield ": keepalive\n\n"
+        finally:
+            event_bus.unsubscribe(subscription)
+
+    return StreamingResponse(stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
@@ -1,9 +1,20 @@
-from fastapi import APIRouter, Query, Depends
+from fastapi import APIRouter, Query, Depends, HTTPException, Header, Request, Response
+from fastapi.responses import StreamingResponse
 from typing import Optional
 from enum import Enum
-from db import read_db, write_db
+from datetime import date
+import csv
+import io
+import json
+import zlib
+from db import get_store
 from models import TransactionStatusUpdate
 from dependencies import get_current_user
+from locks import wallet_locks
+from indexes import tx_key
+from utils import decode_cursor, encode_cursor, not_modified, representation_etag
+from events import publish_transactions
+from reconcile import mark_amended
 
 router = APIRouter(prefix="/transactions", tags=["Transactions"])
 
@@ -17,87 +28,230 @@ class TransactionType(str, Enum):
     RECEIVED = "Received"
     SELF_TRANSFER = "Self transfer"
 
+class ExportFormat(str, Enum):
+    CSV = "csv"
+    NDJSON = "ndjson"
+
+EXPORT_FIELDS = ["id", "createdAt", "type", "amount", "fee", "status", "toUserId", "fromUserId", "reason"]
+
+# Rows are buffered up to this many bytes before a chunk is sent
+EXPORT_CHUNK_SIZE = 64 * 1024
+
+def type_filter(type: Optional[TransactionType]) -> Optional[str]:
+    if type == TransactionType.PAID:
+        return "debit"
+    if type in [TransactionType.RECEIVED, TransactionType.SELF_TRANSFER]:
+        return "credit"
+    return None
+
 @router.get("")
 def get_transactions(
+    request: Request,
+    response: Response,
     status: Optional[TransactionStatus] = None,
     type: Optional[TransactionType] = None,
     min_amount: Optional[float] = None,
     max_amount: Optional[float] = None,
     start_date: Optional[str] = None,
     end_date: Optional[str] = None,
-    user: dict = Depends(get_current_user)
+    limit: int = Query(50, ge=1, le=500),
+    cursor: Optional[str] = None,
+    user: dict = Depends(get_current_user),
+    if_none_match: str = Header(None, alias="If-None-Match")
 ):
-    db = read_db()
-    wallet = next((w for w in db["wallets"] if w["userId"] == user["id"]), None)
+    store = get_store()
+    # Every page and filter of a wallet's history changes with the wallet's version,
+    # but each has its own tag so one is never answered with another's 304
+    if user.get("walletId"):
+        etag = representation_etag(store.versions.etag("wallet", user["walletId"]), request)
+        cached = not_modified(if_none_match, etag, response)
+        if cached is not None:
+            return cached
+    wallet = store.get_wallet_for_user(user["id"])
     if not wallet:
-        return {"total": 0, "data": []}
-
-    transactions = [
-        t for t in db["transactions"] 
-        if not t.get("isDeleted") and t["walletId"] == wallet["id"]
-    ]
-
-    if status:
-        status_lower = status.value.lower()
-        transactions = [t for t in transactions if t["status"].lower() == status_lower]
-    
-    if type:
-        if type == TransactionType.PAID:
-            transactions = [t for t in transactions if t["type"] == "debit"]
-        elif type in [TransactionType.RECEIVED, TransactionType.SELF_TRANSFER]:
-            transactions = [t for t in transactions if t["type"] == "credit"]
-    
-    if min_amount is not None:
-        transactions = [t for t in transactions if t["amount"] >= min_amount]
-    if max_amount is not None:
-        transactions = [t for t in transactions if t["amount"] <= max_amount]
-
-    if start_date:
-        transactions = [t for t in transactions if t["createdAt"] >= start_date]
-        
-    if end_date:
-        transactions = [t for t in transactions if t["createdAt"] <= end_date]
-
-    transactions.sort(key=lambda x: x["createdAt"], reverse=True)
+        return {"data": [], "nextCursor": None}
+
+    # One extra row tells us whether another page exists
+    transactions = store.query_transactions(
+        wallet["id"],
+        status=status.value if status else None,
+        tx_type=type_filter(type),
+        min_amount=min_amount,
+        max_amount=max_amount,
+        start_date=start_date,
+        end_date=end_date,
+        before=decode_cursor(cursor) if cursor else None,
+        limit=limit + 1,
+    )
+
+    next_cursor = None
+    if len(transactions) > limit:
+        transactions = transactions[:limit]
+        next_cursor = encode_cursor(tx_key(transactions[-1]))
 
     return {
-        "total": len(transactions),
-        "data": transactions
+        "data": transactions,
+        "nextCursor": next_cursor
     }
 
+def export_lines(transactions, format: ExportFormat):
+    if format == ExportFormat.NDJSON:
+        for tx in transactions:
+            yield json.dumps(tx, separators=(",", ":")) + "\n"
+        return
+
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_FIELDS, extrasaction="ignore")
+    writer.writeheader()
+    # Sent on its own, so an export with no rows still has its header
+    yield buffer.getvalue()
+    for tx in transactions:
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerow(tx)
+        yield buffer.getvalue()
+
+def export_chunks(lines, compress: bool):
+    # gzip container (wbits=31) so clients decode it as Content-Encoding: gzip
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+    pending = []
+    size = 0
+    for line in lines:
+        pending.append(line)
+        size += len(line)
+        if size >= EXPORT_CHUNK_SIZE:
+            data = "".join(pending).encode()
+            pending, size = [], 0
+            if compressor:
+                data = compressor.compress(data)
+            if data:
+                yield data
+    data = "".join(pending).encode()
+    if compressor:
+        data = compressor.compress(data) + compressor.flush()
+    if data:
+        yield data
+
+def accepts_gzip(accept_encoding: Optional[str]) -> bool:
+    for part in (accept_encoding or "").split(","):
+        coding, _, params = part.partition(";")
+        if coding.strip().lower() not in ("gzip", "*"):
+            continue
+        params = params.replace(" ", "")
+        try:
+            return not params.startswith("q=") or float(params[2:]) > 0
+        except ValueError:
+            return False
+    return False
+
+@router.get("/export")
+def export_transactions(
+    format: ExportFormat = ExportFormat.CSV,
+    status: Optional[TransactionStatus] = None,
+    type: Optional[TransactionType] = None,
+    min_amount: Optional[float] = None,
+    max_amount: Optional[float] = None,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    accept_encoding: Optional[str] = Header(None, alias="Accept-Encoding"),
+    user: dict = Depends(get_current_user)
+):
+    store = get_store()
+    wallet = store.get_wallet_for_user(user["id"])
+    wallet_id = wallet["id"] if wallet else None
+
+    # Rows come from the store a chunk at a time, oldest first, while the
+    # response is being sent, so nothing holds the whole history
+    transactions = store.iter_transactions(
+        wallet_id,
+        status=status.value if status else None,
+        tx_type=type_filter(type),
+        min_amount=min_amount,
+        max_amount=max_amount,
+        start_date=start_date,
+        end_date=end_date,
+    ) if wallet_id else iter(())
+
+    compress = accepts_gzip(accept_encoding)
+    headers = {
+        "Content-Disposition": f'attachment; filename="transactions.{format.value}"',
+        "Vary": "Accept-Encoding",
+    }
+    if compress:
+        headers["Content-Encoding"] = "gzip"
+    media_type = "text/csv" if format == ExportFormat.CSV else "application/x-ndjson"
+    return StreamingResponse(export_chunks(export_lines(transactions, format), compress),
+                             media_type=media_type, headers=headers)
+
 @router.get("/recent")
-def recent_transactions(user: dict = Depends(get_current_user)):
-    db = read_db()
-    wallet = next((w for w in db["wallets"] if w["userId"] == user["id"]), None)
+def recent_transactions(request: Request, response: Response, user: dict = Depends(get_current_user),
+                        if_none_match: str = Header(None, alias="If-None-Match")):
+    store = get_store()
+    if user.get("walletId"):
+        etag = representation_etag(store.versions.etag("wallet", user["walletId"]), request)
+        cached = not_modified(if_none_match, etag, response)
+        if cached is not None:
+            return cached
+    wallet = store.get_wallet_for_user(user["id"])
     if not wallet:
         return []
-        
-    user_txs = [
-        t for t in db["transactions"] 
-        if not t.get("isDeleted") and t["walletId"] == wallet["id"]
-    ]
-    user_txs.sort(key=lambda x: x["createdAt"], reverse=True)
-    
-    return user_txs[:10]
+
+    return store.recent_transactions(wallet["id"])
+
+@router.get("/analytics")
+def transaction_analytics(
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    user: dict = Depends(get_current_user)
+):
+    for value in (start_date, end_date):
+        if value:
+            try:
+                date.fromisoformat(value[:10])
+            except ValueError:
+                raise HTTPException(400, "Dates must be YYYY-MM-DD")
+
+    store = get_store()
+    wallet = store.get_wallet_for_user(user["id"])
+    if not wallet:
+        raise HTTPException(404, "Wallet not found")
+
+    return {
+        "start_date": start_date,
+        "end_date": end_date,
+        **store.transaction_analytics(wallet["id"], start_date, end_date)
+    }
 
 @router.patch("/{tx_id}/status")
 def update_status(tx_id: str, payload: TransactionStatusUpdate):
-    db = read_db()
-    for tx in db["transactions"]:
-        if tx["id"] == tx_id:
-            tx["status"] = payload.status
-            if payload.reason:
-                tx["reason"] = payload.reason
-            write_db(db)
-            return tx
+    store = get_store()
+    tx = store.get_transaction(tx_id)
+    if not tx:
+        return {"error": "Transaction not found"}
+
+    changes = {"status": payload.status}
+    if payload.reason:
+        changes["reason"] = payload.reason
+
+    with wallet_locks.hold(tx["walletId"]), store.transaction():
+        tx = store.update_transaction(tx_id, **changes)
+        if tx:
+            mark_amended(store, tx["walletId"])
+    if tx:
+        publish_transactions(store, [tx])
+        return tx
     return {"error": "Transaction not found"}
 
 @router.delete("/{tx_id}")
 def delete_transaction(tx_id: str):
-    db = read_db()
-    for i, tx in enumerate(db["transactions"]):
-        if tx["id"] == tx_id:
-            db["transactions"].pop(i)
-            write_db(db)
-            return {"message": "Transaction deleted permanently"}
+    store = get_store()
+    tx = store.get_transaction(tx_id)
+    if not tx:
+        return {"error": "Transaction not found"}
+
+    # Hidden, not removed: the balance still reflects it, so the ledger must too
+    with wallet_locks.hold(tx["walletId"]):
+        tx = store.delete_transaction(tx_id)
+    if tx:
+        return {"message": "Transaction deleted"}
     return {"error": "Transaction not found"}
@@ -1,61 +1,78 @@
-from fastapi import APIRouter, Depends, UploadFile, File, HTTPException
-from db import read_db, write_db
-from dependencies import get_current_user
+from fastapi import APIRouter, BackgroundTasks, Depends, UploadFile, File, HTTPException, Header, Query, Response
+from typing import Optional
+from db import get_store
+from dependencies import get_current_user, invalidate_session
 from models import UserUpdateRequest
-import shutil
-import os
-import uuid
+from utils import decode_cursor, encode_cursor, not_modified
+import images
 
 router = APIRouter(prefix="/users", tags=["Users"])
 
+def public_profile(user):
+    # What any signed-in user may see of another; never credentials
+    return {"id": user["id"], "name": user["name"], "profileImage": user.get("profileImage")}
+
 @router.get("")
-def get_users():
-    return read_db()["users"]
+def get_users(user: dict = Depends(get_current_user)):
+    return [public_profile(match) for match in get_store().list_users()]
+
+@router.get("/search")
+def search_users(
+    q: str = Query("", max_length=100),
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = None,
+    user: dict = Depends(get_current_user)
+):
+    matches = get_store().search_users(q, limit + 1, after=decode_cursor(cursor) if cursor else None)
+    page = matches[:limit]
+    return {
+        "data": [public_profile(match) for _, match in page],
+        "nextCursor": encode_cursor(page[-1][0]) if len(matches) > limit else None
+    }
 
 @router.get("/me")
-def get_me(user: dict = Depends(get_current_user)):
+def get_me(response: Response, user: dict = Depends(get_current_user),
+           if_none_match: str = Header(None, alias="If-None-Match")):
+    store = get_store()
+    cached = not_modified(if_none_match, store.versions.etag("user", user["id"]), response)
+    if cached is not None:
+        return cached
+    # The session copy can lag a commit that has already moved the version
+    user = store.get_user(user["id"]) or user
     if "pin" not in user:
-        user["pin"] = None
+        user = {**user, "pin": None}
     return user
 
 @router.put("/me")
 def update_me(request: UserUpdateRequest, user: dict = Depends(get_current_user)):
-    db = read_db()
-    db_user_idx = next((i for i, u in enumerate(db["users"]) if u["id"] == user["id"]), None)
-    
-    if db_user_idx is not None:
-        db["users"][db_user_idx]["name"] = request.name
-        write_db(db)
-        return {"message": "User updated", "user": db["users"][db_user_idx]}
+    store = get_store()
+    with store.transaction():
+        db_user = store.get_user(user["id"])
+
+        if db_user is not None:
+            db_user["name"] = request.name
+            store.put_user(db_user)
+    if db_user is not None:
+        invalidate_session(user["id"])
+        return {"message": "User updated", "user": db_user}
     
     raise HTTPException(status_code=404, detail="User not found")
 
 @router.post("/me/image")
-def upload_profile_image(file: UploadFile = File(...), user: dict = Depends(get_current_user)):
-    try:
-        file_extension = os.path.splitext(file.filename)[1]
-        filename = f"{user['id']}_{uuid.uuid4()}{file_extension}"
-        file_path = f"uploads/profiles/{filename}"
-        
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-            
-        db = read_db()
-        db_user_idx = next((i for i, u in enumerate(db["users"]) if u["id"] == user["id"]), None)
-        
-        if db_user_idx is not None:
-            old_image = db["users"][db_user_idx].get("profileImage")
-            if old_image and os.path.exists(old_image):
-                try:
-                    os.remove(old_image)
-                except:
-                    pass
-            
-            db["users"][db_user_idx]["profileImage"] = file_path.replace("\\", "/")
-            write_db(db)
-            
-        return {"message": "Profile image updated", "profileImage": file_path.replace("\\", "/")}
-        
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to upload image: {str(e)}")
+def upload_profile_image(background_tasks: BackgroundTasks, file: UploadFile = File(...), user: dict = Depends(get_current_user)):
+    temp_path, digest = images.receive(file.file)
+    store = get_store()
+    with images.lock:
+        file_path = images.publish(temp_path, digest, images.extension(file.filename))
+        with store.transaction():
+            db_user = store.get_user(user["id"])
+            if db_user is None:
+                raise HTTPException(status_code=404, detail="User not found")
+            old_image = db_user.get("profileImage")
+            db_user["profileImage"] = file_path
+            store.put_user(db_user)
+    invalidate_session(user["id"])
 
+    if old_image and old_image != file_path:
+        background_tasks.add_task(images.release, store, old_image)
+    return {"message": "Profile image updated", "profileImage": file_path}
@@ -1,19 +1,27 @@
-from fastapi import APIRouter, HTTPException, Depends, Header
-from db import read_db, write_db
-from models import AddMoneyRequest, TransferRequest
-from utils import generate_id, now
+from fastapi import APIRouter, HTTPException, Depends, Header, Request, Response
+from db import get_store
+from models import AddMoneyRequest, TransferRequest, BatchTransferRequest
+from utils import generate_id, not_modified, now, representation_etag
 from dependencies import get_current_user
+from locks import wallet_locks
+from rules import rules_cache
+from idempotency import idempotent
+from events import publish_transactions
 
 router = APIRouter(prefix="/wallet", tags=["Wallet"])
 
-def get_user_wallet(user_id: str, db: dict):
-    wallet = next((w for w in db["wallets"] if w["userId"] == user_id), None)
+MAX_BATCH_TRANSFERS = 5000
+
+def get_user_wallet(user_id: str, store):
+    wallet = store.get_wallet_for_user(user_id)
     if not wallet:
         raise HTTPException(404, "Wallet not found")
     return wallet
 
 @router.get("")
-def get_wallet(user: dict = Depends(get_current_user), x_wallet_pin: str = Header(None, alias="X-Wallet-Pin")):
+def get_wallet(request: Request, response: Response, user: dict = Depends(get_current_user),
+               x_wallet_pin: str = Header(None, alias="X-Wallet-Pin"),
+               if_none_match: str = Header(None, alias="If-None-Match")):
     if not x_wallet_pin:
         raise HTTPException(400, "PIN required to access wallet")
     
@@ -23,12 +31,18 @@ def get_wallet(user: dict = Depends(get_current_user), x_wallet_pin: str = Heade
     if user["pin"] != x_wallet_pin:
          raise HTTPException(401, "Invalid PIN")
 
-    db = read_db()
-    return get_user_wallet(user["id"], db)
+    store = get_store()
+    if user.get("walletId"):
+        etag = representation_etag(store.versions.etag("wallet", user["walletId"]), request)
+        cached = not_modified(if_none_match, etag, response)
+        if cached is not None:
+            return cached
+    return get_user_wallet(user["id"], store)
 
 
 @router.post("/add-money")
-def add_money(payload: AddMoneyRequest, user: dict = Depends(get_current_user)):
+def add_money(payload: AddMoneyRequest, user: dict = Depends(get_current_user),
+              idempotency_key: str = Header(None, alias="Idempotency-Key")):
     if "pin" not in user or not user["pin"]:
          raise HTTPException(400, "PIN not set. Please set a PIN first.")
     
@@ -38,108 +52,110 @@ def add_money(payload: AddMoneyRequest, user: dict = Depends(get_current_user)):
     if payload.amount <= 0:
         raise HTTPException(400, "Invalid amount")
 
-    db = read_db()
-    wallet = get_user_wallet(user["id"], db)
-    wallet["balance"] += payload.amount
+    return idempotent(idempotency_key, user["id"], "add-money", payload, lambda: credit_wallet(user, payload))
+
 
-    db["transactions"].append({
-        "id": generate_id("tx"),
-        "walletId": wallet["id"],
-        "type": "credit",
-        "amount": payload.amount,
-        "fee": 0,
-        "status": "success",
-        "isDeleted": False,
-        "createdAt": now()
-    })
+def credit_wallet(user: dict, payload: AddMoneyRequest):
+    store = get_store()
+    wallet_id = get_user_wallet(user["id"], store)["id"]
+    with wallet_locks.hold(wallet_id), store.transaction():
+        wallet = store.get_wallet(wallet_id)
+        if not wallet:
+            raise HTTPException(404, "Wallet not found")
+        wallet["balance"] += payload.amount
+        balance = wallet["balance"]
+        store.put_wallet(wallet)
 
-    write_db(db)
-    return {"balance": wallet["balance"]}
+        tx = {
+            "id": generate_id("tx"),
+            "walletId": wallet["id"],
+            "type": "credit",
+            "amount": payload.amount,
+            "fee": 0,
+            "status": "success",
+            "isDeleted": False,
+            "createdAt": now()
+        }
+        store.append_transaction(tx)
+    publish_transactions(store, [tx])
+
+    return {"balance": balance}
 
 
 @router.post("/transfer")
-def transfer_money(payload: TransferRequest, user: dict = Depends(get_current_user)):
+def transfer_money(payload: TransferRequest, user: dict = Depends(get_current_user),
+                   idempotency_key: str = Header(None, alias="Idempotency-Key")):
     if "pin" not in user or not user["pin"]:
          raise HTTPException(400, "PIN not set. Please set a PIN first.")
     
     if user["pin"] != payload.pin:
          raise HTTPException(401, "Invalid PIN")
 
-    db = read_db()
-    wallet = get_user_wallet(user["id"], db)
-    rules = db["businessRules"]
+    return idempotent(idempotency_key, user["id"], "transfer", payload, lambda: send_money(user, payload))
 
-    if payload.amount > rules["maxTransferLimit"]:
-        db["transactions"].append({
-            "id": generate_id("tx"),
-            "walletId": wallet["id"],
-            "type": "debit",
-            "amount": payload.amount,
-            "fee": 0,
-            "toUserId": payload.toUserId,
-            "status": "failed",
-            "reason": "Transfer limit exceeded",
-            "isDeleted": False,
-            "createdAt": now()
-        })
-        write_db(db)
-        raise HTTPException(400, "Transfer limit exceeded")
 
-    fee = payload.amount * rules["feePercentage"] / 100
-    total = payload.amount + fee
+def send_money(user: dict, payload: TransferRequest):
+    store = get_store()
+    wallet = get_user_wallet(user["id"], store)
+    receiver_wallet = store.get_wallet_for_user(payload.toUserId)
+    receiver_wallet_id = receiver_wallet["id"] if receiver_wallet else None
 
-    if wallet["balance"] < total:
-        db["transactions"].append({
-            "id": generate_id("tx"),
-            "walletId": wallet["id"],
-            "type": "debit",
-            "amount": payload.amount,
-            "fee": fee,
-            "toUserId": payload.toUserId,
-            "status": "failed",
-            "reason": "Insufficient balance",
-            "isDeleted": False,
-            "createdAt": now()
-        })
-        write_db(db)
-        raise HTTPException(400, "Insufficient balance")
-
-    wallet["balance"] -= total
-
-    tx_id = generate_id("tx")
-    db["transactions"].append({
-        "id": tx_id,
-        "walletId": wallet["id"],
-        "type": "debit",
-        "amount": payload.amount,
-        "fee": fee,
-        "toUserId": payload.toUserId,
-        "status": "success",
-        "isDeleted": False,
-        "createdAt": now()
-    })
-
-    # Credit receiver
-    receiver_wallet = next((w for w in db["wallets"] if w["userId"] == payload.toUserId), None)
-    if receiver_wallet:
-        receiver_wallet["balance"] += payload.amount
-        
-        # Add credit transaction for receiver
-        db["transactions"].append({
-            "id": generate_id("tx"),
-            "walletId": receiver_wallet["id"],
-            "type": "credit",
-            "amount": payload.amount,
-            "fee": 0,
-            "fromUserId": user["id"],
-            "status": "success",
-            "isDeleted": False,
-            "createdAt": now()
-        })
+    # Both sides stay locked until the transfer is committed
+    rules = rules_cache.get(store).rules
+    created = []
+    with wallet_locks.hold(wallet["id"], receiver_wallet_id), store.transaction():
+        result = store.apply_transfer(
+            wallet["id"], receiver_wallet_id, user["id"], payload.toUserId, payload.amount, rules, created
+        )
+    publish_transactions(store, created)
+
+    # Failed attempts are recorded before the error is surfaced
+    if "error" in result:
+        raise HTTPException(400, result["error"])
+
+    return result
+
+
+@router.post("/transfer/batch")
+def transfer_batch(payload: BatchTransferRequest, user: dict = Depends(get_current_user)):
+    if "pin" not in user or not user["pin"]:
+         raise HTTPException(400, "PIN not set. Please set a PIN first.")
+
+    if user["pin"] != payload.pin:
+         raise HTTPException(401, "Invalid PIN")
 
-    write_db(db)
+    if not payload.transfers:
+        raise HTTPException(400, "No transfers given")
+
+    if len(payload.transfers) > MAX_BATCH_TRANSFERS:
+        raise HTTPException(400, f"At most {MAX_BATCH_TRANSFERS} transfers per batch")
+
+    store = get_store()
+    wallet = get_user_wallet(user["id"], store)
+    receiver_ids = {}
+    for leg in payload.transfers:
+        if leg.toUserId not in receiver_ids:
+            receiver_wallet = store.get_wallet_for_user(leg.toUserId)
+            receiver_ids[leg.toUserId] = receiver_wallet["id"] if receiver_wallet else None
+
+    # One lock set, one rules snapshot and one commit for every leg
+    rules = rules_cache.get(store).rules
+    created = []
+    with wallet_locks.hold(wallet["id"], *receiver_ids.values()), store.transaction():
+        results = []
+        for leg in payload.transfers:
+            result = store.apply_transfer(
+                wallet["id"], receiver_ids[leg.toUserId], user["id"], leg.toUserId, leg.amount, rules, created
+            )
+            results.append({"toUserId": leg.toUserId, "amount": leg.amount, **result})
+        balance = store.get_wallet(wallet["id"])["balance"]
+    publish_transactions(store, created)
+
+    succeeded = [r for r in results if "error" not in r]
     return {
-        "transactionId": tx_id,
-        "fee": fee,
-        "totalDeducted": total
+        "succeeded": len(succeeded),
+        "failed": len(results) - len(succeeded),
+        "totalDeducted": sum(r["totalDeducted"] for r in succeeded),
+        "balance": balance,
+        "results": results
     }
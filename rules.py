@@ -0,0 +1,72 @@
+import hashlib
+import json
+import threading
+from types import MappingProxyType
+from typing import Mapping, NamedTuple
+
+
+class RulesSnapshot(NamedTuple):
+    version: int
+    rules: Mapping
+    etag: str
+
+
+def make_snapshot(rules, version):
+    rules = dict(rules)
+    digest = hashlib.sha1(json.dumps(rules, sort_keys=True).encode()).hexdigest()[:16]
+    # The ETag is derived from the content so it stays valid across restarts
+    return RulesSnapshot(version, MappingProxyType(rules), f'"{digest}"')
+
+
+class RulesCache:
+    """The current businessRules as an immutable, versioned snapshot.
+
+    Readers take ``get(store)`` once and use that snapshot throughout, so a
+    concurrent ``update`` never shows them a half-applied change. Updates
+    are serialised, persisted through the store, and then published by
+    swapping a single reference. The version starts at 1 for each store
+    that is opened and goes up by one per update, including updates another
+    worker made, which show up as a new ``store.versions`` entry for the rules.
+    """
+
+    def __init__(self):
+        self._current = (None, None, None)
+        self._lock = threading.Lock()
+
+    def get(self, store):
+        snapshot = self.peek(store)
+        if snapshot is not None:
+            return snapshot
+        with self._lock:
+            return self._sync(store)
+
+    def peek(self, store):
+        """The snapshot ``get`` would return, if it can without reading the store; else None."""
+        owner, stamp, snapshot = self._current
+        if store is not None and owner is store and stamp == store.versions.get("rules", ""):
+            return snapshot
+        return None
+
+    def _sync(self, store):
+        owner, stamp, snapshot = self._current
+        version = store.versions.get("rules", "")
+        if owner is not store:
+            snapshot = make_snapshot(store.rules, 1)
+        elif stamp != version:
+            snapshot = make_snapshot(store.rules, snapshot.version + 1)
+        self._current = (store, version, snapshot)
+        return snapshot
+
+    def update(self, store, **changes):
+        with self._lock:
+            # Read inside the transaction, which starts from every worker's latest commit
+            with store.transaction():
+                snapshot = self._sync(store)
+                rules = {**snapshot.rules, **changes}
+                store.set_rules(rules)
+            snapshot = make_snapshot(rules, snapshot.version + 1)
+            self._current = (store, store.versions.get("rules", ""), snapshot)
+            return snapshot
+
+
+rules_cache = RulesCache()
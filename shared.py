@@ -0,0 +1,92 @@
+import fcntl
+import mmap
+import os
+import struct
+import threading
+import uuid
+
+# Several worker processes (uvicorn --workers N) sharing one JSON store
+MULTIPROCESS = os.environ.get("WALLET_MULTIPROCESS") == "1"
+
+# generation, journal epoch, store id
+_LAYOUT = struct.Struct("<QQ8s")
+_COUNTERS = struct.Struct("<QQ")
+
+
+class ProcessLock:
+    """Exclusive lock between processes (``flock``) and between threads (an RLock).
+
+    Re-entrant for the thread holding it. flock locks belong to an open
+    file, so each ProcessLock opens its own and the threads using it share
+    that one lock.
+    """
+
+    def __init__(self, path):
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        self._lock = threading.RLock()
+        self._depth = 0
+
+    def __enter__(self):
+        self._lock.acquire()
+        if self._depth == 0:
+            try:
+                fcntl.flock(self._fd, fcntl.LOCK_EX)
+            except BaseException:
+                self._lock.release()
+                raise
+        self._depth += 1
+        return self
+
+    def __exit__(self, *exc):
+        self._depth -= 1
+        if self._depth == 0:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        self._lock.release()
+
+    def close(self):
+        os.close(self._fd)
+
+
+class SharedState:
+    """Counters that every worker maps from one small file next to the store.
+
+    ``generation`` goes up with each commit made by any worker, so a worker
+    learns whether its resident copy is behind from a single memory read.
+    ``epoch`` goes up each time the journal is rotated. ``store_id`` is
+    chosen when the file is created; workers use it as their ETag epoch so
+    they all hand out the same validators. Both counters only change under
+    ``lock``.
+    """
+
+    def __init__(self, path):
+        path = str(path)
+        self.lock = ProcessLock(f"{path}.lock")
+        with self.lock:
+            fd = os.open(f"{path}.gen", os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                if os.fstat(fd).st_size < _LAYOUT.size:
+                    os.ftruncate(fd, 0)
+                    os.write(fd, _LAYOUT.pack(0, 0, uuid.uuid4().hex[:8].encode()))
+                    os.fsync(fd)
+                self._map = mmap.mmap(fd, _LAYOUT.size)
+            finally:
+                os.close(fd)
+        self.store_id = _LAYOUT.unpack_from(self._map)[2].decode()
+
+    @property
+    def generation(self):
+        return _COUNTERS.unpack_from(self._map)[0]
+
+    def read(self):
+        """``(generation, epoch)``."""
+        return _COUNTERS.unpack_from(self._map)
+
+    def advance(self, rotate=False):
+        """Moves to the next generation, and epoch if ``rotate``; call holding ``lock``."""
+        generation, epoch = self.read()
+        _COUNTERS.pack_into(self._map, 0, generation + 1, epoch + rotate)
+        return generation + 1
+
+    def close(self):
+        self._map.close()
+        self.lock.close()
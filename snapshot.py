@@ -0,0 +1,65 @@
+import json
+import mmap
+import struct
+
+# File layout: MAGIC, then records, then the JSON index, then the trailer.
+# A record is a little-endian u32 length followed by that many bytes of
+# compact JSON. The trailer holds the index offset and MAGIC again.
+MAGIC = b"WSNAP1\n\x00"
+_LENGTH = struct.Struct("<I")
+_TRAILER = struct.Struct("<Q8s")
+
+
+class SnapshotWriter:
+    """Writes a binary snapshot to an open file, one record at a time."""
+
+    def __init__(self, f):
+        self._f = f
+        f.write(MAGIC)
+
+    def add(self, payload):
+        """Appends ``payload`` (bytes) as a record; returns its offset."""
+        offset = self._f.tell()
+        self._f.write(_LENGTH.pack(len(payload)))
+        self._f.write(payload)
+        return offset
+
+    def copy(self, record):
+        """Appends a record taken whole from another snapshot with ``Snapshot.raw``."""
+        offset = self._f.tell()
+        self._f.write(record)
+        return offset
+
+    def finish(self, index):
+        offset = self._f.tell()
+        self._f.write(json.dumps(index, separators=(",", ":")).encode())
+        self._f.write(_TRAILER.pack(offset, MAGIC))
+
+
+class Snapshot:
+    """A binary snapshot mapped read-only into memory.
+
+    Opening one reads only the index; records are decoded when asked for,
+    so their pages are read from disk on first use. The mapping stays valid
+    after the file is replaced, because it holds on to the old file.
+    """
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        end = len(self._map) - _TRAILER.size
+        if end < len(MAGIC) or self._map[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} is not a wallet snapshot")
+        index_offset, magic = _TRAILER.unpack_from(self._map, end)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is truncated")
+        self.index = json.loads(self._map[index_offset:end])
+
+    def read(self, offset):
+        (size,) = _LENGTH.unpack_from(self._map, offset)
+        start = offset + _LENGTH.size
+        return json.loads(self._map[start:start + size])
+
+    def raw(self, offset):
+        (size,) = _LENGTH.unpack_from(self._map, offset)
+        return self._map[offset:offset + _LENGTH.size + size]
@@ -0,0 +1,436 @@
+import json
+import sqlite3
+import threading
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+
+from indexes import RECENT_SIZE, bucket_row, period_bounds, period_keys, rollup_contribution, search_terms, summarize
+from storage import Storage
+
+# Every table keeps the full record as JSON in ``data``; the other columns
+# are copies of the fields that lookups, filters and ordering need
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    id TEXT PRIMARY KEY,
+    email TEXT NOT NULL UNIQUE,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS user_terms (
+    term TEXT NOT NULL,
+    id TEXT NOT NULL,
+    PRIMARY KEY (term, id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS user_terms_by_id ON user_terms (id);
+CREATE TABLE IF NOT EXISTS wallets (
+    id TEXT PRIMARY KEY,
+    userId TEXT NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS wallets_by_user ON wallets (userId);
+CREATE TABLE IF NOT EXISTS transactions (
+    id TEXT PRIMARY KEY,
+    walletId TEXT NOT NULL,
+    createdAt TEXT NOT NULL,
+    status TEXT NOT NULL,
+    type TEXT NOT NULL,
+    amount REAL NOT NULL,
+    isDeleted INTEGER NOT NULL DEFAULT 0,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS transactions_by_wallet_time ON transactions (walletId, createdAt, id);
+CREATE TABLE IF NOT EXISTS rollups (
+    walletId TEXT NOT NULL,
+    period TEXT NOT NULL,
+    bucket TEXT NOT NULL,
+    debit REAL NOT NULL DEFAULT 0,
+    credit REAL NOT NULL DEFAULT 0,
+    fee REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (walletId, period, bucket)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS rollup_counts (
+    walletId TEXT NOT NULL,
+    period TEXT NOT NULL,
+    bucket TEXT NOT NULL,
+    status TEXT NOT NULL,
+    n INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (walletId, period, bucket, status)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+
+def _dump(record):
+    return json.dumps(record, separators=(",", ":"))
+
+
+def _tx_row(tx):
+    return (
+        tx["id"], tx["walletId"], tx["createdAt"], tx["status"], tx["type"],
+        tx["amount"], 1 if tx.get("isDeleted") else 0, _dump(tx),
+    )
+
+
+class SQLiteStore(Storage):
+    """Storage on a SQLite database in WAL mode, using only the stdlib driver.
+
+    Each thread gets its own connection. ``transaction()`` is a real
+    ``BEGIN IMMEDIATE`` ... ``COMMIT``, so a transfer's debit, credit and
+    transaction rows land together or not at all. Analytics come from
+    rollup tables updated in the same transaction as the rows they count.
+    """
+
+    def __init__(self, path):
+        super().__init__()
+        self.path = Path(path)
+        self._local = threading.local()
+        self._connections = []
+        self._conn().executescript(SCHEMA)
+        conn = self._conn()
+        # Databases from before user search have no terms yet
+        if conn.execute("SELECT NOT EXISTS (SELECT 1 FROM user_terms) AND EXISTS (SELECT 1 FROM users)").fetchone()[0]:
+            with self.transaction():
+                for user in self.list_users():
+                    self._put_terms(user)
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=FULL")
+            conn.execute("PRAGMA busy_timeout=5000")
+            self._local.conn = conn
+            with self.lock:
+                self._connections.append(conn)
+        return conn
+
+    def _after_fork(self):
+        super()._after_fork()
+        # Connections must not be shared with the parent; the child opens its own
+        self._local = threading.local()
+        self._connections = []
+
+    def close(self):
+        with self.lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections = []
+
+    def stats(self):
+        return {"backend": "sqlite"}
+
+    def _one(self, sql, args=()):
+        row = self._conn().execute(sql, args).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _all(self, sql, args=()):
+        return [json.loads(row[0]) for row in self._conn().execute(sql, args)]
+
+    # --- Reads ---
+
+    @property
+    def rules(self):
+        row = self._conn().execute("SELECT value FROM meta WHERE key = 'businessRules'").fetchone()
+        return json.loads(row[0]) if row else {}
+
+    def get_user(self, user_id):
+        return self._one("SELECT data FROM users WHERE id = ?", (user_id,))
+
+    def get_user_by_email(self, email):
+        return self._one("SELECT data FROM users WHERE email = ?", (email.lower().strip(),))
+
+    def list_users(self):
+        return self._all("SELECT data FROM users ORDER BY rowid")
+
+    def _prefix_scan(self, prefix, after, chunk=64):
+        conn = self._conn()
+        # Ids are never empty, so (prefix, "") sorts before every match
+        key = (prefix, "") if after is None else max(tuple(after), (prefix, ""))
+        while True:
+            rows = conn.execute(
+                "SELECT t.term, t.id, u.data FROM user_terms t JOIN users u ON u.id = t.id "
+                "WHERE (t.term, t.id) > (?, ?) ORDER BY t.term, t.id LIMIT ?",
+                key + (chunk,),
+            ).fetchall()
+            for term, user_id, data in rows:
+                if not term.startswith(prefix):
+                    return
+                yield term, json.loads(data)
+            if len(rows) < chunk:
+                return
+            key = (rows[-1][0], rows[-1][1])
+
+    def get_wallet(self, wallet_id):
+        return self._one("SELECT data FROM wallets WHERE id = ?", (wallet_id,))
+
+    def get_wallet_for_user(self, user_id):
+        return self._one("SELECT data FROM wallets WHERE userId = ? ORDER BY rowid DESC LIMIT 1", (user_id,))
+
+    def list_wallets(self):
+        return self._all("SELECT data FROM wallets ORDER BY rowid")
+
+    def get_transaction(self, tx_id):
+        return self._one("SELECT data FROM transactions WHERE id = ?", (tx_id,))
+
+    def get_wallet_transactions(self, wallet_id):
+        return self._all(
+            "SELECT data FROM transactions WHERE walletId = ? ORDER BY createdAt, id", (wallet_id,)
+        )
+
+    def recent_transactions(self, wallet_id):
+        return self.query_transactions(wallet_id, limit=RECENT_SIZE)
+
+    def query_transactions(self, wallet_id, status=None, tx_type=None, min_amount=None, max_amount=None,
+                           start_date=None, end_date=None, before=None, after=None, limit=50,
+                           oldest_first=False):
+        sql = ["SELECT data FROM transactions WHERE walletId = ? AND isDeleted = 0"]
+        args = [wallet_id]
+        if status:
+            sql.append("AND lower(status) = ?")
+            args.append(status.lower())
+        if tx_type:
+            sql.append("AND type = ?")
+            args.append(tx_type)
+        if min_amount is not None:
+            sql.append("AND amount >= ?")
+            args.append(min_amount)
+        if max_amount is not None:
+            sql.append("AND amount <= ?")
+            args.append(max_amount)
+        if start_date:
+            sql.append("AND createdAt >= ?")
+            args.append(start_date)
+        if end_date:
+            sql.append("AND createdAt <= ?")
+            args.append(end_date)
+        if before is not None:
+            sql.append("AND (createdAt, id) < (?, ?)")
+            args.extend(before)
+        if after is not None:
+            sql.append("AND (createdAt, id) > (?, ?)")
+            args.extend(after)
+        sql.append("ORDER BY createdAt, id LIMIT ?" if oldest_first else "ORDER BY createdAt DESC, id DESC LIMIT ?")
+        args.append(limit)
+        return self._all(" ".join(sql), args)
+
+    def ledger_totals(self, wallet_id, after=None):
+        conn = self._conn()
+        where, args = "walletId = ?", [wallet_id]
+        before = 0
+        if after is not None:
+            before = conn.execute(
+                f"SELECT COUNT(*) FROM transactions WHERE {where} AND (createdAt, id) <= (?, ?)", [*args, *after]
+            ).fetchone()[0]
+            where += " AND (createdAt, id) > (?, ?)"
+            args.extend(after)
+        count, credit, debit, fee = conn.execute(
+            "SELECT COUNT(*), "
+            "TOTAL(CASE WHEN lower(status) = 'success' AND type = 'credit' THEN amount END), "
+            "TOTAL(CASE WHEN lower(status) = 'success' AND type = 'debit' THEN amount END), "
+            "TOTAL(CASE WHEN lower(status) = 'success' THEN json_extract(data, '$.fee') END) "
+            f"FROM transactions WHERE {where}", args
+        ).fetchone()
+        last = conn.execute(
+            f"SELECT createdAt, id FROM transactions WHERE {where} ORDER BY createdAt DESC, id DESC LIMIT 1", args
+        ).fetchone()
+        return {
+            "count": count,
+            "before": before,
+            "credit": credit,
+            "debit": debit,
+            "fee": fee,
+            "last": list(last) if last else None,
+        }
+
+    def transaction_analytics(self, wallet_id, start_date=None, end_date=None):
+        conn = self._conn()
+        result = {}
+        for period, (low, high) in period_bounds(start_date, end_date).items():
+            where = ["walletId = ? AND period = ?"]
+            args = [wallet_id, period]
+            if low:
+                where.append("AND bucket >= ?")
+                args.append(low)
+            if high:
+                where.append("AND bucket <= ?")
+                args.append(high)
+            where = " ".join(where)
+
+            counts = {}
+            for bucket, status, n in conn.execute(
+                f"SELECT bucket, status, n FROM rollup_counts WHERE {where} AND n != 0", args
+            ):
+                counts.setdefault(bucket, {})[status] = n
+
+            result[period] = [
+                bucket_row(bucket, debit, credit, fee, counts[bucket])
+                for bucket, debit, credit, fee in conn.execute(
+                    f"SELECT bucket, debit, credit, fee FROM rollups WHERE {where} ORDER BY bucket", args
+                )
+                if bucket in counts
+            ]
+        return summarize(result)
+
+    # --- Writes ---
+
+    @contextmanager
+    def transaction(self):
+        conn = self._conn()
+        depth = getattr(self._local, "depth", 0)
+        self._local.depth = depth + 1
+        try:
+            with self._collect_changes() if depth == 0 else nullcontext():
+                if depth == 0:
+                    conn.execute("BEGIN IMMEDIATE")
+                try:
+                    yield self
+                except BaseException:
+                    if depth == 0:
+                        conn.execute("ROLLBACK")
+                    raise
+                if depth == 0:
+                    conn.execute("COMMIT")
+        finally:
+            self._local.depth = depth
+
+    def put_user(self, user):
+        with self.transaction():
+            self._conn().execute(
+                "INSERT INTO users (id, email, data) VALUES (?, ?, ?) "
+                "ON CONFLICT (id) DO UPDATE SET email = excluded.email, data = excluded.data",
+                (user["id"], user["email"].lower(), _dump(user)),
+            )
+            self._put_terms(user)
+            self._changed("user", user["id"])
+
+    def _put_terms(self, user):
+        conn = self._conn()
+        conn.execute("DELETE FROM user_terms WHERE id = ?", (user["id"],))
+        conn.executemany("INSERT INTO user_terms (term, id) VALUES (?, ?)",
+                         ((term, user["id"]) for term in search_terms(user)))
+
+    def put_wallet(self, wallet):
+        self._conn().execute(
+            "INSERT INTO wallets (id, userId, data) VALUES (?, ?, ?) "
+            "ON CONFLICT (id) DO UPDATE SET userId = excluded.userId, data = excluded.data",
+            (wallet["id"], wallet["userId"], _dump(wallet)),
+        )
+        self._changed("wallet", wallet["id"])
+
+    def append_transaction(self, tx):
+        with self.transaction():
+            try:
+                self._conn().execute("INSERT INTO transactions VALUES (?, ?, ?, ?, ?, ?, ?, ?)", _tx_row(tx))
+            except sqlite3.IntegrityError as exc:
+                raise ValueError(f"Transaction id {tx['id']} is already taken") from exc
+            self._roll(tx, 1)
+            self._changed("wallet", tx["walletId"])
+
+    def update_transaction(self, tx_id, **fields):
+        with self.transaction():
+            tx = self.get_transaction(tx_id)
+            if tx is None:
+                return None
+            self._roll(tx, -1)
+            tx.update(fields)
+            self._conn().execute("REPLACE INTO transactions VALUES (?, ?, ?, ?, ?, ?, ?, ?)", _tx_row(tx))
+            self._roll(tx, 1)
+            self._changed("wallet", tx["walletId"])
+            return tx
+
+    def delete_wallet(self, wallet_id):
+        with self.transaction():
+            wallet = self.get_wallet(wallet_id)
+            if wallet is not None:
+                conn = self._conn()
+                for table in ("transactions", "rollups", "rollup_counts"):
+                    conn.execute(f"DELETE FROM {table} WHERE walletId = ?", (wallet_id,))
+                conn.execute("DELETE FROM wallets WHERE id = ?", (wallet_id,))
+                self._changed("wallet", wallet_id)
+            return wallet
+
+    def delete_user(self, user_id):
+        with self.transaction():
+            user = self.get_user(user_id)
+            if user is not None:
+                self._conn().execute("DELETE FROM users WHERE id = ?", (user_id,))
+                self._conn().execute("DELETE FROM user_terms WHERE id = ?", (user_id,))
+                self._changed("user", user_id)
+            return user
+
+    def set_rules(self, rules):
+        self._conn().execute(
+            "INSERT INTO meta (key, value) VALUES ('businessRules', ?) "
+            "ON CONFLICT (key) DO UPDATE SET value = excluded.value",
+            (_dump(rules),),
+        )
+        self._changed("rules", "")
+
+    def _roll(self, tx, sign):
+        contribution = rollup_contribution(tx)
+        if contribution is None:
+            return
+        conn = self._conn()
+        for period, bucket in period_keys(tx["createdAt"]).items():
+            key = (tx["walletId"], period, bucket)
+            conn.execute(
+                "INSERT INTO rollups (walletId, period, bucket, debit, credit, fee) VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT DO UPDATE SET debit = debit + excluded.debit, credit = credit + excluded.credit, "
+                "fee = fee + excluded.fee",
+                key + (sign * contribution["debit"], sign * contribution["credit"], sign * contribution["fee"]),
+            )
+            conn.execute(
+                "INSERT INTO rollup_counts (walletId, period, bucket, status, n) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT DO UPDATE SET n = n + excluded.n",
+                key + (contribution["status"], sign),
+            )
+
+    # --- Migration ---
+
+    def import_data(self, data):
+        """Replaces the database contents with a db.json-shaped document."""
+        with self.transaction():
+            conn = self._conn()
+            for table in ("users", "user_terms", "wallets", "transactions", "rollups", "rollup_counts", "meta"):
+                conn.execute(f"DELETE FROM {table}")
+            conn.executemany(
+                "INSERT OR REPLACE INTO users (id, email, data) VALUES (?, ?, ?)",
+                ((u["id"], u["email"].lower(), _dump(u)) for u in data.get("users", [])),
+            )
+            conn.executemany(
+                "INSERT OR IGNORE INTO user_terms (term, id) VALUES (?, ?)",
+                ((term, u["id"]) for u in data.get("users", []) for term in search_terms(u)),
+            )
+            conn.executemany(
+                "INSERT OR REPLACE INTO wallets (id, userId, data) VALUES (?, ?, ?)",
+                ((w["id"], w["userId"], _dump(w)) for w in data.get("wallets", [])),
+            )
+            conn.executemany(
+                "INSERT OR REPLACE INTO transactions VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (_tx_row(tx) for tx in data.get("transactions", [])),
+            )
+
+            # Aggregate in memory first; one upsert per bucket instead of per row
+            buckets = {}
+            for tx in data.get("transactions", []):
+                contribution = rollup_contribution(tx)
+                if contribution is None:
+                    continue
+                for period, bucket in period_keys(tx["createdAt"]).items():
+                    totals = buckets.setdefault((tx["walletId"], period, bucket), {"debit": 0, "credit": 0, "fee": 0, "counts": {}})
+                    for field in ("debit", "credit", "fee"):
+                        totals[field] += contribution[field]
+                    counts = totals["counts"]
+                    counts[contribution["status"]] = counts.get(contribution["status"], 0) + 1
+            conn.executemany(
+                "INSERT INTO rollups VALUES (?, ?, ?, ?, ?, ?)",
+                (key + (t["debit"], t["credit"], t["fee"]) for key, t in buckets.items()),
+            )
+            conn.executemany(
+                "INSERT INTO rollup_counts VALUES (?, ?, ?, ?, ?)",
+                (key + (status, n) for key, t in buckets.items() for status, n in t["counts"].items()),
+            )
+            self.set_rules(data.get("businessRules", {}))
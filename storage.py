@@ -0,0 +1,300 @@
+import threading
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+
+from indexes import canonical_term, search_terms, sum_ledger, tx_key
+from utils import generate_id, now
+from versions import Versions
+
+
+class Storage(ABC):
+    """Everything the routers need from persistence.
+
+    Records are plain dicts shaped like the entries of db.json. Besides the
+    methods below every backend exposes ``rules`` (the businessRules dict)
+    and ``lock``, a re-entrant lock for short check-then-insert sections.
+
+    Writes that belong together go inside ``transaction()``. Callers that
+    read-modify-write a wallet hold its lock from ``locks.wallet_locks`` and
+    re-read the wallet inside the transaction before changing it.
+
+    ``versions`` counts changes per wallet (including its transactions),
+    per user and to the business rules. Backends report each change with ``_changed`` and wrap the
+    outermost transaction in ``_collect_changes``, so counters move only
+    after the commit.
+
+    ``shared`` is the ``shared.SharedState`` of stores that several worker
+    processes open at once; ``refresh()`` brings such a store up to date
+    with the other workers' commits.
+    """
+
+    def __init__(self, shared=None):
+        self.lock = threading.RLock()
+        self.shared = shared
+        self.versions = Versions(shared.store_id if shared is not None else None)
+        self._changes = threading.local()
+
+    # --- Reads ---
+
+    @abstractmethod
+    def get_user(self, user_id): ...
+
+    @abstractmethod
+    def get_user_by_email(self, email): ...
+
+    @abstractmethod
+    def list_users(self): ...
+
+    def search_users(self, prefix, limit=20, after=None):
+        """Users whose name, a word of their name, or email starts with ``prefix``.
+
+        Returns up to ``limit`` ``(key, user)`` pairs ordered by key, the
+        (term, id) the user matched under; pass the last key as ``after``
+        for the next page.
+        """
+        prefix = " ".join(prefix.lower().split())
+        results = []
+        for term, user in self._prefix_scan(prefix, after):
+            if canonical_term(search_terms(user), prefix) == term:
+                results.append(((term, user["id"]), user))
+                if len(results) == limit:
+                    break
+        return results
+
+    @abstractmethod
+    def _prefix_scan(self, prefix, after):
+        """(term, user) pairs whose search term starts with ``prefix``, by (term, id)."""
+
+    @abstractmethod
+    def get_wallet(self, wallet_id): ...
+
+    @abstractmethod
+    def get_wallet_for_user(self, user_id): ...
+
+    @abstractmethod
+    def list_wallets(self): ...
+
+    @abstractmethod
+    def get_transaction(self, tx_id): ...
+
+    @abstractmethod
+    def get_wallet_transactions(self, wallet_id):
+        """All of a wallet's transactions, oldest first."""
+
+    @abstractmethod
+    def recent_transactions(self, wallet_id):
+        """The wallet's newest non-deleted transactions, newest first."""
+
+    @abstractmethod
+    def query_transactions(self, wallet_id, status=None, tx_type=None, min_amount=None, max_amount=None,
+                           start_date=None, end_date=None, before=None, after=None, limit=50,
+                           oldest_first=False):
+        """Newest-first (or oldest-first) page of a wallet's non-deleted transactions.
+
+        ``before`` and ``after`` are exclusive (createdAt, id) keys taken
+        from a cursor.
+        """
+
+    def iter_transactions(self, wallet_id, chunk_size=500, **filters):
+        """Every matching transaction, oldest first, fetched a chunk at a time.
+
+        Takes the filters of ``query_transactions``. Only one chunk is held
+        at once, and each chunk resumes after the last key of the previous
+        one, so writes in between do not skip or repeat rows.
+        """
+        after = None
+        while True:
+            page = self.query_transactions(wallet_id, after=after, limit=chunk_size, oldest_first=True, **filters)
+            yield from page
+            if len(page) < chunk_size:
+                return
+            after = tx_key(page[-1])
+
+    def ledger_totals(self, wallet_id, after=None):
+        """What a wallet's successful transactions newer than ``after`` add up to.
+
+        ``after`` is an exclusive (createdAt, id) key; None takes them all.
+        Returns ``credit``, ``debit`` and ``fee`` totals, the ``count`` of
+        transactions newer than ``after`` (whatever their status), how many
+        are ``before`` it, and ``last``, the newest key or None.
+        """
+        transactions = self.get_wallet_transactions(wallet_id)
+        if after is None:
+            return sum_ledger(transactions)
+        after = tuple(after)
+        newer = [tx for tx in transactions if tx_key(tx) > after]
+        return sum_ledger(newer, before=len(transactions) - len(newer))
+
+    @abstractmethod
+    def transaction_analytics(self, wallet_id, start_date=None, end_date=None):
+        """Daily, weekly and monthly totals for a wallet, see ``indexes.Rollup``."""
+
+    # --- Writes ---
+
+    @abstractmethod
+    def transaction(self):
+        """Context manager grouping writes into one atomic, durable commit."""
+
+    @abstractmethod
+    def put_user(self, user): ...
+
+    @abstractmethod
+    def put_wallet(self, wallet): ...
+
+    @abstractmethod
+    def append_transaction(self, tx):
+        """Adds a new transaction; ValueError if its id is already taken."""
+
+    @abstractmethod
+    def update_transaction(self, tx_id, **fields): ...
+
+    def delete_transaction(self, tx_id):
+        """Hides a transaction from listings and analytics by setting ``isDeleted``.
+
+        The record stays: the money it moved stays moved, so it still counts
+        in ``ledger_totals``. Returns it, or None if there was none to hide.
+        """
+        with self.transaction():
+            tx = self.get_transaction(tx_id)
+            if tx is None or tx.get("isDeleted"):
+                return None
+            return self.update_transaction(tx_id, isDeleted=True)
+
+    @abstractmethod
+    def delete_wallet(self, wallet_id):
+        """Removes a wallet together with its transactions."""
+
+    @abstractmethod
+    def delete_user(self, user_id): ...
+
+    @abstractmethod
+    def set_rules(self, rules): ...
+
+    def close(self):
+        pass
+
+    def warming(self):
+        """How many wallets still have history to load before the store is fully warm."""
+        return 0
+
+    def refresh(self):
+        """Picks up changes other processes have committed; cheap when there are none."""
+
+    def _after_fork(self):
+        """Readies a forked child, which has only the thread that forked, to read the store."""
+        self.lock = threading.RLock()
+
+    def _stamp(self):
+        """The version changed keys move to, or None to count."""
+        return None
+
+    def _changed(self, kind, key):
+        pending = getattr(self._changes, "keys", None)
+        if pending is None:
+            self.versions.bump(kind, key, self._stamp())
+        else:
+            pending.add((kind, key))
+
+    @contextmanager
+    def _collect_changes(self):
+        self._changes.keys = set()
+        try:
+            yield
+        finally:
+            # Bumped after a rollback too; a spare bump only costs a refetch
+            keys, self._changes.keys = self._changes.keys, None
+            stamp = self._stamp()
+            for kind, key in keys:
+                self.versions.bump(kind, key, stamp)
+
+    def stats(self):
+        """Backend counters for /health/stats."""
+        return {}
+
+    def apply_transfer(self, wallet_id, receiver_wallet_id, from_user_id, to_user_id, amount, rules, created=None):
+        """Moves one transfer's money and records its transactions.
+
+        Must run inside ``transaction()`` with both wallets locked. Failed
+        attempts are recorded too; they come back as ``{"error": reason}``.
+        Every transaction recorded is also appended to ``created`` if given.
+        """
+        def record(tx):
+            self.append_transaction(tx)
+            if created is not None:
+                created.append(tx)
+
+        wallet = self.get_wallet(wallet_id)
+
+        if amount > rules["maxTransferLimit"]:
+            record({
+                "id": generate_id("tx"),
+                "walletId": wallet["id"],
+                "type": "debit",
+                "amount": amount,
+                "fee": 0,
+                "toUserId": to_user_id,
+                "status": "failed",
+                "reason": "Transfer limit exceeded",
+                "isDeleted": False,
+                "createdAt": now()
+            })
+            return {"error": "Transfer limit exceeded"}
+
+        fee = amount * rules["feePercentage"] / 100
+        total = amount + fee
+
+        if wallet["balance"] < total:
+            record({
+                "id": generate_id("tx"),
+                "walletId": wallet["id"],
+                "type": "debit",
+                "amount": amount,
+                "fee": fee,
+                "toUserId": to_user_id,
+                "status": "failed",
+                "reason": "Insufficient balance",
+                "isDeleted": False,
+                "createdAt": now()
+            })
+            return {"error": "Insufficient balance"}
+
+        wallet["balance"] -= total
+        self.put_wallet(wallet)
+
+        tx_id = generate_id("tx")
+        record({
+            "id": tx_id,
+            "walletId": wallet["id"],
+            "type": "debit",
+            "amount": amount,
+            "fee": fee,
+            "toUserId": to_user_id,
+            "status": "success",
+            "isDeleted": False,
+            "createdAt": now()
+        })
+
+        # Credit receiver; read after the debit so a self-transfer sees it
+        receiver_wallet = self.get_wallet(receiver_wallet_id) if receiver_wallet_id else None
+        if receiver_wallet:
+            receiver_wallet["balance"] += amount
+            self.put_wallet(receiver_wallet)
+
+            # Add credit transaction for receiver
+            record({
+                "id": generate_id("tx"),
+                "walletId": receiver_wallet["id"],
+                "type": "credit",
+                "amount": amount,
+                "fee": 0,
+                "fromUserId": from_user_id,
+                "status": "success",
+                "isDeleted": False,
+                "createdAt": now()
+            })
+
+        return {
+            "transactionId": tx_id,
+            "fee": fee,
+            "totalDeducted": total
+        }
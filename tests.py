@@ -4,6 +4,9 @@ import subprocess
 import os
 import json
 import shutil
+import random
+import threading
+import time
 from pathlib import Path
 
 # --- Dependency Check ---
@@ -25,6 +28,8 @@ except ImportError:
 import db
 
 TEST_DB_PATH = Path("test_db.json")
+TEST_JOURNAL_PATHS = [TEST_DB_PATH.with_suffix(".journal"), TEST_DB_PATH.with_suffix(".journal.old")]
+TEST_SQLITE_PATH = Path("test_db.sqlite")
 INITIAL_DB_STATE = {
     "users": [],
     "wallets": [],
@@ -33,8 +38,12 @@ INITIAL_DB_STATE = {
 
 # Redirect DB operations to test file
 db.DB_PATH = TEST_DB_PATH
+db.SQLITE_PATH = TEST_SQLITE_PATH
 
 from main import app
+from dependencies import sessions
+from idempotency import idempotency_cache
+from admission import write_admission, writes_rejected
 
 # --- Backend Tests ---
 class TestBackendAPI(unittest.TestCase):
@@ -42,6 +51,10 @@ class TestBackendAPI(unittest.TestCase):
         # Create a fresh test DB before each test
         with open(TEST_DB_PATH, "w") as f:
             json.dump(INITIAL_DB_STATE, f)
+        db.reset_store()
+        sessions.clear()
+        idempotency_cache.clear()
+        write_admission.buckets.clear()
         self.client = TestClient(app)
         
         # Test Data
@@ -51,8 +64,25 @@ class TestBackendAPI(unittest.TestCase):
 
     def tearDown(self):
         # Clean up test DB after each test
-        if TEST_DB_PATH.exists():
-            TEST_DB_PATH.unlink()
+        db.reset_store()
+        db.STORAGE_BACKEND = "json"
+        for path in [TEST_DB_PATH, TEST_DB_PATH.with_suffix(".snap"), *TEST_JOURNAL_PATHS, TEST_SQLITE_PATH]:
+            if path.exists():
+                path.unlink()
+        for suffix in ("-wal", "-shm"):
+            Path(str(TEST_SQLITE_PATH) + suffix).unlink(missing_ok=True)
+
+    def _seed_users(self, ids, balance=1000, pin="1111"):
+        """Starts the test DB over with a user and a wallet (w_<id>) per id."""
+        state = {
+            "users": [{"id": uid, "name": uid, "email": f"{uid}@example.com", "password": "x", "walletId": f"w_{uid}", "pin": pin} for uid in ids],
+            "wallets": [{"id": f"w_{uid}", "userId": uid, "balance": balance, "currency": "INR"} for uid in ids],
+            "transactions": [],
+            "businessRules": {"feePercentage": 2, "maxTransferLimit": 500}
+        }
+        with open(TEST_DB_PATH, "w") as f:
+            json.dump(state, f)
+        db.reset_store()
 
     def test_health_check(self):
         response = self.client.get("/health")
@@ -109,6 +139,1205 @@ class TestBackendAPI(unittest.TestCase):
         response = self.client.get("/wallet", headers=headers_with_pin)
         self.assertEqual(response.json()["balance"], add_amount)
 
+    def test_email_lookup_is_case_insensitive(self):
+        reg_payload = {
+            "name": self.user_name,
+            "email": self.user_email,
+            "password": self.user_pass
+        }
+        response = self.client.post("/auth/register", json=reg_payload)
+        self.assertEqual(response.status_code, 200)
+
+        # Same address with different casing is the same account
+        response = self.client.post("/auth/register", json={**reg_payload, "email": self.user_email.upper()})
+        self.assertEqual(response.status_code, 400)
+
+        response = self.client.post("/auth/login", json={"email": self.user_email.upper(), "password": self.user_pass})
+        self.assertEqual(response.status_code, 200)
+
+        # Registration is persisted, not only held in memory
+        db.reset_store()
+        response = self.client.post("/auth/login", json={"email": self.user_email, "password": self.user_pass})
+        self.assertEqual(response.status_code, 200)
+
+    def test_journal_replay_and_compaction(self):
+        response = self.client.post("/auth/register", json={
+            "name": self.user_name,
+            "email": self.user_email,
+            "password": self.user_pass
+        })
+        user_id = response.json()["userId"]
+
+        # The snapshot is untouched; the registration lives in the journal
+        with open(TEST_DB_PATH) as f:
+            self.assertEqual(json.load(f)["users"], [])
+        self.assertTrue(TEST_JOURNAL_PATHS[0].exists())
+
+        db.reset_store()
+        self.assertIsNotNone(db.get_store().get_user(user_id))
+
+        # Compaction folds the journal into the snapshot
+        store = db.get_store()
+        store.compact(force=True)
+        store.close()
+        with open(TEST_DB_PATH) as f:
+            self.assertEqual(json.load(f)["users"][0]["id"], user_id)
+        self.assertFalse(TEST_JOURNAL_PATHS[1].exists())
+
+        # A torn final line from a crash is ignored on recovery
+        db.reset_store()
+        with open(TEST_JOURNAL_PATHS[0], "a") as f:
+            f.write('[["put","users",{"id":')
+        self.assertIsNotNone(db.get_store().get_user(user_id))
+        response = self.client.post("/auth/register", json={
+            "name": self.user_name,
+            "email": "second@example.com",
+            "password": self.user_pass
+        })
+        db.reset_store()
+        self.assertIsNotNone(db.get_store().get_user(response.json()["userId"]))
+
+        # While a snapshot is still being written, commits past the threshold do not stop other writers
+        from unittest import mock
+        store = db.get_store()
+        writing = threading.Event()
+        self.addCleanup(setattr, db, "COMPACT_EVERY", db.COMPACT_EVERY)
+        db.COMPACT_EVERY = 2
+        with mock.patch.object(store, "_write_snapshot", side_effect=lambda *args: writing.wait()), \
+                mock.patch.object(store, "_paused", wraps=store._paused) as paused:
+            try:
+                for i in range(6):
+                    store.set_rules({"feePercentage": i})
+            finally:
+                writing.set()
+                store._compaction.join()
+        self.assertEqual(paused.call_count, 1)
+
+    def test_failed_commit_rolls_back(self):
+        from unittest import mock
+        from fastapi import HTTPException
+        from models import TransferRequest
+        from routers.wallet import transfer_money
+
+        self._seed_users(["u_a", "u_b"])
+        store = db.get_store()
+        store.compact(force=True)
+        store._compaction.join()
+        payload = TransferRequest(toUserId="u_b", amount=100, pin="1111")
+
+        # The journal cannot be made durable: nothing of the transfer may remain
+        with mock.patch("os.fsync", side_effect=OSError("disk full")):
+            with self.assertRaises(OSError):
+                transfer_money(payload, user=store.get_user("u_a"), idempotency_key=None)
+        self.assertEqual([store.get_wallet(w)["balance"] for w in ("w_u_a", "w_u_b")], [1000, 1000])
+        self.assertEqual(store.get_wallet_transactions("w_u_a"), [])
+
+        # A transaction id that is already taken aborts the transfer the same way
+        transfer_money(payload, user=store.get_user("u_a"), idempotency_key=None)
+        taken = store.get_wallet_transactions("w_u_b")[0]["id"]
+        with mock.patch("routers.wallet.generate_id", return_value=taken), mock.patch("storage.generate_id", return_value=taken):
+            with self.assertRaises((HTTPException, ValueError, KeyError)):
+                transfer_money(payload, user=store.get_user("u_a"), idempotency_key=None)
+        self.assertEqual([store.get_wallet(w)["balance"] for w in ("w_u_a", "w_u_b")], [898, 1100])
+
+        # Compaction waits out an open transaction, so one that aborts never reaches the snapshot
+        inside, release = threading.Event(), threading.Event()
+
+        def abort():
+            try:
+                with store.transaction():
+                    store.put_wallet({**store.get_wallet("w_u_a"), "balance": 0})
+                    inside.set()
+                    release.wait()
+                    raise RuntimeError("aborted")
+            except RuntimeError:
+                pass
+
+        aborting = threading.Thread(target=abort)
+        aborting.start()
+        inside.wait()
+        compacting = threading.Thread(target=store.compact, args=(True,))
+        compacting.start()
+        compacting.join(0.2)
+        self.assertTrue(compacting.is_alive())
+        release.set()
+        aborting.join()
+        compacting.join()
+        store._compaction.join()
+        with open(TEST_DB_PATH) as f:
+            self.assertEqual([w["balance"] for w in json.load(f)["wallets"]], [898, 1100])
+
+        # Neither failure reached the journal either
+        store.close()
+        db.reset_store()
+        store = db.get_store()
+        self.assertEqual([store.get_wallet(w)["balance"] for w in ("w_u_a", "w_u_b")], [898, 1100])
+        self.assertEqual(len(store.get_wallet_transactions("w_u_a")), 1)
+
+    def test_concurrent_transfers_conserve_balance(self):
+        from fastapi import HTTPException
+        from models import TransferRequest
+        from routers.wallet import transfer_money
+
+        user_ids = [f"u_{i}" for i in range(6)]
+        self._seed_users(user_ids)
+        store = db.get_store()
+        initial_total = 1000 * len(user_ids)
+
+        def worker(seed):
+            rng = random.Random(seed)
+            for _ in range(150):
+                sender, receiver = rng.sample(user_ids, 2)
+                payload = TransferRequest(toUserId=receiver, amount=rng.randint(1, 400), pin="1111")
+                try:
+                    transfer_money(payload, user=store.get_user(sender), idempotency_key=None)
+                except HTTPException:
+                    pass
+
+        switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+        try:
+            threads = [threading.Thread(target=worker, args=(seed,)) for seed in range(8)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+        finally:
+            sys.setswitchinterval(switch_interval)
+
+        def assert_conserved(store):
+            fees = sum(t["fee"] for t in store.transactions.values() if t["type"] == "debit" and t["status"] == "success")
+            balances = [w["balance"] for w in store.wallets.values()]
+            self.assertTrue(all(b >= 0 for b in balances))
+            self.assertAlmostEqual(sum(balances) + fees, initial_total, places=6)
+
+        assert_conserved(store)
+        # Replaying the journal reproduces the same balances
+        db.reset_store()
+        assert_conserved(db.get_store())
+
+    def test_multiprocess_store(self):
+        from shared import SharedState
+
+        user_ids = [f"u_{i}" for i in range(4)]
+        self._seed_users(user_ids)
+        base = TEST_DB_PATH.with_suffix("")
+        extra_paths = [TEST_DB_PATH.with_suffix(".journal.prev"), Path(f"{base}.gen"), Path(f"{base}.lock")]
+        saved = db.COMPACT_EVERY, db.FOLLOW_INTERVAL_MS
+        # Separate SharedState objects hold separate flocks, just like two processes;
+        # the followers are slowed down so catching up happens where the test says
+        db.COMPACT_EVERY, db.FOLLOW_INTERVAL_MS = 25, 60_000
+        stores = [db.JsonStore(TEST_DB_PATH, SharedState(base)) for _ in range(2)]
+        try:
+            a, b = stores
+            rules = dict(a.rules)
+
+            def worker(store, seed):
+                rng = random.Random(seed)
+                for _ in range(40):
+                    sender, receiver = rng.sample(user_ids, 2)
+                    with store.transaction():
+                        store.apply_transfer(f"w_{sender}", f"w_{receiver}", sender, receiver, rng.randint(1, 100), rules)
+
+            threads = [threading.Thread(target=worker, args=(store, seed)) for seed, store in enumerate(stores * 2)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+
+            def assert_conserved(store):
+                store.refresh()
+                fees = sum(t["fee"] for t in store.transactions.values() if t["type"] == "debit" and t["status"] == "success")
+                self.assertAlmostEqual(sum(w["balance"] for w in store.wallets.values()) + fees, 4000, places=6)
+                self.assertEqual(len(store.transactions), 160 + sum(t["type"] == "debit" and t["status"] == "success" for t in store.transactions.values()))
+
+            for store in stores:
+                assert_conserved(store)
+            self.assertEqual(a.to_dict(), b.to_dict())
+            self.assertEqual(a.versions.etag("wallet", "w_u_0"), b.versions.etag("wallet", "w_u_0"))
+            self.assertTrue(extra_paths[0].exists())
+
+            # Followed commits reach listeners and bump the same versions
+            heard = []
+            b.listeners.append(heard.extend)
+            etag = b.versions.etag("wallet", "w_u_1")
+            with a.transaction():
+                a.apply_transfer("w_u_1", "w_u_2", "u_1", "u_2", 10, rules)
+            b.refresh()
+            self.assertEqual([tx["walletId"] for tx in heard], ["w_u_1", "w_u_2"])
+            self.assertNotEqual(b.versions.etag("wallet", "w_u_1"), etag)
+            self.assertEqual(b.versions.etag("wallet", "w_u_1"), a.versions.etag("wallet", "w_u_1"))
+            with b.transaction():
+                b.set_rules({**rules, "feePercentage": 3})
+            a.refresh()
+            self.assertEqual(a.rules["feePercentage"], 3)
+
+            # A worker that died mid-append leaves a torn record; the next writer cuts it off
+            with open(TEST_DB_PATH.with_suffix(".journal"), "a") as f:
+                f.write('[["gen",')
+            with b.transaction():
+                b.put_wallet({**b.get_wallet("w_u_3"), "balance": 5})
+            a.refresh()
+            self.assertEqual(a.get_wallet("w_u_3")["balance"], 5)
+
+            # Falling more than one compaction behind means a full reload
+            for i in range(60):
+                with a.transaction():
+                    a.put_wallet({**a.get_wallet("w_u_0"), "balance": i})
+            b.refresh()
+            self.assertEqual(b.get_wallet("w_u_0")["balance"], 59)
+            self.assertEqual(a.to_dict(), b.to_dict())
+
+            # A worker starting now sees the same state
+            stores.append(db.JsonStore(TEST_DB_PATH, SharedState(base)))
+            self.assertEqual(stores[-1].to_dict(), a.to_dict())
+        finally:
+            for store in stores:
+                store.close()
+            db.COMPACT_EVERY, db.FOLLOW_INTERVAL_MS = saved
+            for path in extra_paths:
+                path.unlink(missing_ok=True)
+
+    def test_generated_ids(self):
+        import re
+        from utils import generate_id
+
+        ids = [generate_id("tx") for _ in range(5000)]
+        self.assertEqual(len(set(ids)), len(ids))
+        # Made in order, so they sort in order, even within one millisecond
+        self.assertEqual(ids, sorted(ids))
+        self.assertTrue(all(re.fullmatch(r"tx_[0-9A-HJKMNP-TV-Z]{26}", i) for i in ids))
+
+        response = self.client.post("/auth/register", json={
+            "name": self.user_name, "email": self.user_email, "password": self.user_pass
+        })
+        self.assertRegex(response.json()["userId"], r"^u_[0-9A-Z]{26}$")
+
+        # A taken id is refused rather than swapped for the stored transaction
+        tx = {"id": "tx_0000abcd", "walletId": "w_1", "type": "credit", "amount": 1, "status": "success", "isDeleted": False, "createdAt": "2026-01-01T00:00:00Z"}
+        for backend in ("json", "sqlite"):
+            with self.subTest(backend=backend):
+                db.reset_store()
+                db.STORAGE_BACKEND = backend
+                store = db.get_store()
+                with store.transaction():
+                    store.append_transaction(dict(tx))
+                with self.assertRaises(ValueError):
+                    with store.transaction():
+                        store.append_transaction(dict(tx, amount=2))
+                self.assertEqual(store.get_transaction("tx_0000abcd")["amount"], 1)
+
+    def test_transactions_cursor_pagination(self):
+        rng = random.Random(7)
+        transactions = [
+            {
+                "id": f"tx_{i:04d}",
+                "walletId": "w_1",
+                "type": rng.choice(["debit", "credit"]),
+                "amount": rng.randint(1, 100),
+                "fee": 0,
+                "status": rng.choice(["success", "failed"]),
+                "isDeleted": i % 17 == 0,
+                # Several rows share a timestamp so ties are broken by id
+                "createdAt": f"2026-01-{1 + i // 20:02d}T10:{i % 5:02d}:00Z"
+            }
+            for i in range(300)
+        ]
+        rng.shuffle(transactions)
+        state = {
+            "users": [{"id": "u_1", "name": "A", "email": "a@example.com", "password": "x", "walletId": "w_1"}],
+            "wallets": [{"id": "w_1", "userId": "u_1", "balance": 0, "currency": "INR"}],
+            "transactions": transactions
+        }
+        with open(TEST_DB_PATH, "w") as f:
+            json.dump(state, f)
+        db.reset_store()
+        headers = {"Authorization": "Bearer mock-token-u_1"}
+
+        def fetch_all(params):
+            rows, cursor = [], None
+            while True:
+                page_params = {**params, "limit": 25}
+                if cursor:
+                    page_params["cursor"] = cursor
+                body = self.client.get("/transactions", params=page_params, headers=headers).json()
+                self.assertLessEqual(len(body["data"]), 25)
+                rows.extend(body["data"])
+                cursor = body["nextCursor"]
+                if not cursor:
+                    return [t["id"] for t in rows]
+
+        def expected(predicate):
+            matching = [t for t in transactions if not t["isDeleted"] and predicate(t)]
+            matching.sort(key=lambda t: (t["createdAt"], t["id"]), reverse=True)
+            return [t["id"] for t in matching]
+
+        self.assertEqual(fetch_all({}), expected(lambda t: True))
+        self.assertEqual(
+            fetch_all({"status": "success", "type": "Paid", "min_amount": 20}),
+            expected(lambda t: t["status"] == "success" and t["type"] == "debit" and t["amount"] >= 20)
+        )
+        self.assertEqual(
+            fetch_all({"start_date": "2026-01-03", "end_date": "2026-01-07T10:02:00Z"}),
+            expected(lambda t: "2026-01-03" <= t["createdAt"] <= "2026-01-07T10:02:00Z")
+        )
+
+        response = self.client.get("/transactions", params={"cursor": "not-a-cursor"}, headers=headers)
+        self.assertEqual(response.status_code, 400)
+
+    def test_recent_transactions_buffer(self):
+        state = {
+            "users": [{"id": "u_1", "name": "A", "email": "a@example.com", "password": "x", "walletId": "w_1", "pin": "1111"}],
+            "wallets": [{"id": "w_1", "userId": "u_1", "balance": 0, "currency": "INR"}],
+            "transactions": [
+                {"id": f"tx_{i:02d}", "walletId": "w_1", "type": "credit", "amount": i, "fee": 0,
+                 "status": "success", "isDeleted": i == 14, "createdAt": f"2026-01-01T10:00:{i:02d}Z"}
+                for i in range(15)
+            ]
+        }
+        with open(TEST_DB_PATH, "w") as f:
+            json.dump(state, f)
+        db.reset_store()
+        headers = {"Authorization": "Bearer mock-token-u_1"}
+
+        def recent_ids():
+            return [t["id"] for t in self.client.get("/transactions/recent", headers=headers).json()]
+
+        self.assertEqual(recent_ids(), [f"tx_{i:02d}" for i in range(13, 3, -1)])
+
+        response = self.client.post("/wallet/add-money", json={"amount": 5, "pin": "1111"}, headers=headers)
+        self.assertEqual(response.status_code, 200)
+        ids = recent_ids()
+        self.assertEqual(len(ids), 10)
+        self.assertEqual(ids[1:], [f"tx_{i:02d}" for i in range(13, 4, -1)])
+
+        # Status changes show up and deletes pull the next-oldest row back in
+        self.client.patch("/transactions/tx_13/status", json={"status": "failed"})
+        recent = self.client.get("/transactions/recent", headers=headers).json()
+        self.assertEqual(recent[1]["status"], "failed")
+        self.client.delete("/transactions/tx_13")
+        self.assertEqual(recent_ids()[1:], [f"tx_{i:02d}" for i in range(12, 3, -1)])
+
+    def test_batch_transfer(self):
+        state = {
+            "users": [{"id": f"u_{i}", "name": str(i), "email": f"{i}@example.com", "password": "x", "walletId": f"w_{i}", "pin": "1111"} for i in range(3)],
+            "wallets": [{"id": f"w_{i}", "userId": f"u_{i}", "balance": 1000 if i == 0 else 0, "currency": "INR"} for i in range(3)],
+            "transactions": [],
+            "businessRules": {"feePercentage": 2, "maxTransferLimit": 500}
+        }
+        with open(TEST_DB_PATH, "w") as f:
+            json.dump(state, f)
+        db.reset_store()
+        headers = {"Authorization": "Bearer mock-token-u_0"}
+
+        legs = [
+            {"toUserId": "u_1", "amount": 300},
+            {"toUserId": "u_2", "amount": 600},  # over the limit
+            {"toUserId": "u_2", "amount": 400},
+            {"toUserId": "u_1", "amount": 400},  # runs out of balance
+        ]
+        response = self.client.post("/wallet/transfer/batch", json={"transfers": legs, "pin": "0000"}, headers=headers)
+        self.assertEqual(response.status_code, 401)
+
+        response = self.client.post("/wallet/transfer/batch", json={"transfers": legs, "pin": "1111"}, headers=headers)
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertEqual((body["succeeded"], body["failed"]), (2, 2))
+        self.assertEqual([r.get("error") for r in body["results"]], [None, "Transfer limit exceeded", None, "Insufficient balance"])
+        self.assertAlmostEqual(body["balance"], 1000 - 700 * 1.02)
+
+        store = db.get_store()
+        self.assertEqual(store.get_wallet("w_1")["balance"], 300)
+        self.assertEqual(store.get_wallet("w_2")["balance"], 400)
+        failed = [t for t in store.transactions.values() if t["status"] == "failed"]
+        self.assertEqual(sorted(t["reason"] for t in failed), ["Insufficient balance", "Transfer limit exceeded"])
+
+        # The whole batch is a single journal record
+        with open(TEST_JOURNAL_PATHS[0]) as f:
+            self.assertEqual(len(f.readlines()), 1)
+
+    def test_transaction_analytics_rollups(self):
+        rng = random.Random(3)
+        transactions = [
+            {
+                "id": f"tx_{i:03d}",
+                "walletId": "w_1",
+                "type": rng.choice(["debit", "credit"]),
+                "amount": rng.randint(1, 100),
+                "fee": rng.choice([0, 1]),
+                "status": rng.choice(["success", "failed", "pending"]),
+                "isDeleted": False,
+                "createdAt": f"2026-{rng.randint(1, 3):02d}-{rng.randint(1, 28):02d}T10:00:00Z"
+            }
+            for i in range(200)
+        ]
+        state = {
+            "users": [{"id": "u_1", "name": "A", "email": "a@example.com", "password": "x", "walletId": "w_1", "pin": "1111"}],
+            "wallets": [{"id": "w_1", "userId": "u_1", "balance": 0, "currency": "INR"}],
+            "transactions": transactions
+        }
+        with open(TEST_DB_PATH, "w") as f:
+            json.dump(state, f)
+        db.reset_store()
+        headers = {"Authorization": "Bearer mock-token-u_1"}
+
+        # Build the buckets, then change history underneath them
+        self.client.get("/transactions/analytics", headers=headers)
+        self.client.patch("/transactions/tx_000/status", json={"status": "failed"})
+        self.client.patch("/transactions/tx_001/status", json={"status": "success"})
+        self.client.delete("/transactions/tx_002")
+        self.client.post("/wallet/add-money", json={"amount": 50, "pin": "1111"}, headers=headers)
+        live = [t for t in db.get_store().get_wallet_transactions("w_1") if not t["isDeleted"]]
+
+        params = {"start_date": "2026-02-01", "end_date": "2026-02-28"}
+        body = self.client.get("/transactions/analytics", params=params, headers=headers).json()
+        in_range = [t for t in live if "2026-02-01" <= t["createdAt"][:10] <= "2026-02-28"]
+        ok = [t for t in in_range if t["status"] == "success"]
+        self.assertAlmostEqual(body["totals"]["debit"], sum(t["amount"] for t in ok if t["type"] == "debit"))
+        self.assertAlmostEqual(body["totals"]["credit"], sum(t["amount"] for t in ok if t["type"] == "credit"))
+        self.assertAlmostEqual(body["totals"]["fee"], sum(t["fee"] for t in ok))
+        self.assertEqual(sum(body["totals"]["counts"].values()), len(in_range))
+        self.assertEqual([row["period"] for row in body["monthly"]], ["2026-02"])
+        self.assertTrue(all(row["period"] <= "2026-02-28" for row in body["weekly"]))
+
+        body = self.client.get("/transactions/analytics", headers=headers).json()
+        self.assertEqual(sum(body["totals"]["counts"].values()), len(live))
+
+    def test_reconciliation(self):
+        import dependencies
+        import reconcile
+        from migrate import migrate
+
+        try:
+            import numpy  # noqa: F401
+            backends = ("json", "columnar", "sqlite")
+        except ImportError:
+            backends = ("json", "sqlite")
+        checkpoint = TEST_DB_PATH.with_suffix(".reconcile.json")
+        self.addCleanup(checkpoint.unlink, missing_ok=True)
+        self.addCleanup(setattr, reconcile, "CHECKPOINT_PATH", reconcile.CHECKPOINT_PATH)
+        reconcile.CHECKPOINT_PATH = checkpoint
+        self.addCleanup(setattr, dependencies, "ADMIN_TOKEN", dependencies.ADMIN_TOKEN)
+        dependencies.ADMIN_TOKEN = "admin-secret"
+        admin = {"X-Admin-Token": "admin-secret"}
+        headers = {"Authorization": "Bearer mock-token-u_0"}
+
+        for backend in backends:
+            with self.subTest(backend=backend):
+                state = {
+                    "users": [{"id": f"u_{i}", "name": str(i), "email": f"user{i}@example.com", "password": "x", "walletId": f"w_{i}", "pin": "1111"} for i in range(3)],
+                    "wallets": [{"id": f"w_{i}", "userId": f"u_{i}", "balance": 500 if i == 0 else 0, "currency": "INR"} for i in range(3)],
+                    "transactions": [
+                        {"id": f"tx_{i:02d}", "walletId": "w_0", "type": "credit", "amount": 100, "fee": 0,
+                         "status": "success" if i < 5 else "failed", "isDeleted": i == 4, "createdAt": f"2026-01-{1 + i:02d}T10:00:00Z"}
+                        for i in range(8)
+                    ],
+                    "businessRules": {"feePercentage": 2, "maxTransferLimit": 500}
+                }
+                with open(TEST_DB_PATH, "w") as f:
+                    json.dump(state, f)
+                for path in TEST_JOURNAL_PATHS + [TEST_SQLITE_PATH, checkpoint]:
+                    path.unlink(missing_ok=True)
+                if backend == "sqlite":
+                    migrate(TEST_DB_PATH, TEST_SQLITE_PATH)
+                db.STORAGE_BACKEND = backend
+                db.reset_store()
+
+                # Only admins may run it, and they get back only what is wrong
+                self.assertEqual(self.client.post("/admin/reconcile").status_code, 403)
+                self.assertEqual(self.client.post("/admin/reconcile", headers={"X-Admin-Token": "guess"}).status_code, 403)
+                self.assertEqual(self.client.post("/admin/reconcile", headers=headers).status_code, 403)
+                response = self.client.post("/admin/reconcile", params={"workers": 1000}, headers=admin)
+                self.assertEqual(response.json(), {"mismatches": []})
+
+                # Deleted transactions still count; failed ones never do
+                store = db.get_store()
+                report = reconcile.reconcile(store, workers=2, full=True)
+                self.assertEqual(report["wallets"], 3)
+                self.assertEqual(report["transactionsRead"], 8)
+                self.assertTrue(report["full"])
+
+                # Later runs read only what was added since
+                response = self.client.post("/wallet/transfer", json={"toUserId": "u_1", "amount": 100, "pin": "1111"}, headers=headers)
+                tx_id = response.json()["transactionId"]
+                report = reconcile.reconcile(store)
+                self.assertEqual(report["transactionsRead"], 2)
+                self.assertFalse(report["full"])
+                self.assertEqual(report["mismatches"], [])
+
+                # Deleting the transfer hides it but the money stays moved, so the ledger still agrees
+                self.assertEqual(self.client.delete(f"/transactions/{tx_id}").json(), {"message": "Transaction deleted"})
+                self.assertNotIn(tx_id, [t["id"] for t in self.client.get("/transactions", headers=headers).json()["data"]])
+                self.assertEqual(self.client.post("/admin/reconcile", headers=admin).json(), {"mismatches": []})
+
+                # A status flip after the money moved is caught even behind the watermark
+                self.client.patch(f"/transactions/{tx_id}/status", json={"status": "failed"})
+                report = reconcile.reconcile(store, workers=2)
+                self.assertEqual([m["walletId"] for m in report["mismatches"]], ["w_0"])
+                self.assertAlmostEqual(report["mismatches"][0]["difference"], -102)
+                self.assertEqual(report["transactionsRead"], 9)
+
+                # So is a transaction slipped in before the watermark
+                with store.transaction():
+                    store.append_transaction({"id": "tx_old", "walletId": "w_2", "type": "credit", "amount": 5, "fee": 0,
+                                              "status": "success", "isDeleted": False, "createdAt": "2025-12-01T10:00:00Z"})
+                report = self.client.post("/admin/reconcile", headers=admin).json()
+                self.assertEqual(sorted(m["walletId"] for m in report["mismatches"]), ["w_0", "w_2"])
+
+                report = reconcile.reconcile(store, workers=1, full=True)
+                self.assertEqual(report["transactionsRead"], 11)
+                self.assertEqual(len(report["mismatches"]), 2)
+                saved = json.loads(checkpoint.read_text())["wallets"]
+                self.assertEqual(saved["w_1"]["count"], 1)
+
+                with reconcile._running:
+                    response = self.client.post("/admin/reconcile", headers=admin)
+                self.assertEqual(response.status_code, 409)
+
+    def test_sqlite_backend(self):
+        from migrate import migrate
+
+        state = {
+            "users": [{"id": f"u_{i}", "name": str(i), "email": f"user{i}@example.com", "password": "x", "walletId": f"w_{i}", "pin": "1111"} for i in range(3)],
+            "wallets": [{"id": f"w_{i}", "userId": f"u_{i}", "balance": 1000, "currency": "INR"} for i in range(3)],
+            "transactions": [
+                {"id": f"tx_{i:02d}", "walletId": "w_0", "type": "credit", "amount": 10, "fee": 0,
+                 "status": "success", "isDeleted": False, "createdAt": f"2026-01-{1 + i:02d}T10:00:00Z"}
+                for i in range(12)
+            ],
+            "businessRules": {"feePercentage": 2, "maxTransferLimit": 500}
+        }
+        with open(TEST_DB_PATH, "w") as f:
+            json.dump(state, f)
+        counts = migrate(TEST_DB_PATH, TEST_SQLITE_PATH)
+        self.assertEqual(counts["transactions"], 12)
+
+        db.STORAGE_BACKEND = "sqlite"
+        db.reset_store()
+        headers = {"Authorization": "Bearer mock-token-u_0"}
+
+        response = self.client.post("/auth/login", json={"email": "USER0@example.com", "password": "x"})
+        self.assertEqual(response.status_code, 200)
+
+        response = self.client.post("/wallet/transfer", json={"toUserId": "u_1", "amount": 100, "pin": "1111"}, headers=headers)
+        self.assertEqual(response.status_code, 200)
+        response = self.client.post("/wallet/transfer", json={"toUserId": "u_1", "amount": 600, "pin": "1111"}, headers=headers)
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post("/wallet/transfer/batch", json={"transfers": [{"toUserId": "u_2", "amount": 50}], "pin": "1111"}, headers=headers)
+        self.assertEqual(response.json()["succeeded"], 1)
+
+        store = db.get_store()
+        self.assertAlmostEqual(store.get_wallet("w_0")["balance"], 1000 - 150 * 1.02)
+        self.assertEqual(store.get_wallet("w_1")["balance"], 1100)
+
+        body = self.client.get("/transactions", params={"limit": 10}, headers=headers).json()
+        self.assertEqual(len(body["data"]), 10)
+        self.assertEqual(body["data"][0]["amount"], 50)
+        body = self.client.get("/transactions", params={"limit": 10, "cursor": body["nextCursor"]}, headers=headers).json()
+        self.assertEqual(len(body["data"]), 5)
+        self.assertIsNone(body["nextCursor"])
+
+        recent = self.client.get("/transactions/recent", headers=headers).json()
+        self.assertEqual(len(recent), 10)
+        self.client.patch(f"/transactions/{recent[0]['id']}/status", json={"status": "failed"})
+        totals = self.client.get("/transactions/analytics", headers=headers).json()["totals"]
+        self.assertEqual(totals["counts"], {"success": 13, "failed": 2})
+        self.assertAlmostEqual(totals["debit"], 100)
+        self.assertAlmostEqual(totals["credit"], 120)
+
+        response = self.client.delete("/auth/delete", headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(store.get_wallet("w_0"))
+        self.assertEqual(store.transaction_analytics("w_0")["totals"]["counts"], {})
+
+    def test_columnar_backend(self):
+        try:
+            import numpy  # noqa: F401
+        except ImportError:
+            self.skipTest("numpy is not installed")
+
+        state = {
+            "users": [{"id": f"u_{i}", "name": str(i), "email": f"user{i}@example.com", "password": "x", "walletId": f"w_{i}", "pin": "1111"} for i in range(2)],
+            "wallets": [{"id": f"w_{i}", "userId": f"u_{i}", "balance": 1000, "currency": "INR"} for i in range(2)],
+            "transactions": [
+                {"id": f"tx_{i:02d}", "walletId": "w_0", "type": "credit" if i % 2 else "debit", "amount": 10 + i,
+                 "fee": 0, "status": "success", "isDeleted": i == 5, "createdAt": f"2026-01-{1 + i:02d}T10:00:00Z"}
+                for i in range(12)
+            ],
+            "businessRules": {"feePercentage": 2, "maxTransferLimit": 500}
+        }
+        with open(TEST_DB_PATH, "w") as f:
+            json.dump(state, f)
+        db.STORAGE_BACKEND = "columnar"
+        db.reset_store()
+        headers = {"Authorization": "Bearer mock-token-u_0"}
+
+        response = self.client.post("/wallet/transfer", json={"toUserId": "u_1", "amount": 100, "pin": "1111"}, headers=headers)
+        self.assertEqual(response.status_code, 200)
+        tx_id = response.json()["transactionId"]
+
+        body = self.client.get("/transactions", params={"limit": 5}, headers=headers).json()
+        self.assertEqual(body["data"][0]["id"], tx_id)
+        self.assertEqual(body["data"][0]["fee"], 2)
+        seen = [tx["id"] for tx in body["data"]]
+        while body["nextCursor"]:
+            body = self.client.get("/transactions", params={"limit": 5, "cursor": body["nextCursor"]}, headers=headers).json()
+            seen += [tx["id"] for tx in body["data"]]
+        self.assertEqual(len(seen), 12)
+        self.assertNotIn("tx_05", seen)
+
+        body = self.client.get("/transactions", params={"type": "Received", "start_date": "2026-01-03", "end_date": "2026-01-09", "min_amount": 14}, headers=headers).json()
+        self.assertEqual([tx["id"] for tx in body["data"]], ["tx_07"])
+
+        self.client.patch("/transactions/tx_07/status", json={"status": "failed"})
+        self.assertEqual(db.get_store().get_transaction("tx_07")["status"], "failed")
+        totals = self.client.get("/transactions/analytics", headers=headers).json()["totals"]
+        self.assertEqual(totals["counts"], {"success": 11, "failed": 1})
+
+        db.reset_store()
+        reloaded = db.get_store()
+        self.assertEqual(reloaded.get_transaction(tx_id)["amount"], 100)
+        self.assertEqual(reloaded.get_transaction("tx_07")["status"], "failed")
+
+    def test_binary_snapshot(self):
+        try:
+            import numpy  # noqa: F401
+            backends = ("json", "columnar")
+        except ImportError:
+            backends = ("json",)
+
+        state = {
+            "users": [{"id": f"u_{i}", "name": str(i), "email": f"user{i}@example.com", "password": "x", "walletId": f"w_{i}", "pin": "1111"} for i in range(3)],
+            "wallets": [{"id": f"w_{i}", "userId": f"u_{i}", "balance": 1000, "currency": "INR"} for i in range(3)],
+            "transactions": [
+                {"id": f"tx_{i:02d}", "walletId": f"w_{i % 3}", "type": "credit", "amount": 10 + i,
+                 "fee": 0, "status": "success", "isDeleted": False, "createdAt": f"2026-01-{1 + i:02d}T10:00:00Z"}
+                for i in range(12)
+            ],
+            "businessRules": {"feePercentage": 2, "maxTransferLimit": 500}
+        }
+        headers = {"Authorization": "Bearer mock-token-u_0"}
+        warm = db.JsonStore._warm
+        db.SNAPSHOT_FORMAT = "binary"
+        try:
+            for backend in backends:
+                with self.subTest(backend=backend):
+                    for path in [TEST_DB_PATH.with_suffix(".snap"), *TEST_JOURNAL_PATHS]:
+                        path.unlink(missing_ok=True)
+                    with open(TEST_DB_PATH, "w") as f:
+                        json.dump(state, f)
+                    db.STORAGE_BACKEND = backend
+                    db.reset_store()
+                    # The first start converts db.json
+                    db.get_store()
+                    db.reset_store()
+                    self.assertTrue(TEST_DB_PATH.with_suffix(".snap").exists())
+
+                    # Held back so the test can watch wallets being paged in
+                    db.JsonStore._warm = lambda store: None
+                    store = db.get_store()
+                    self.assertEqual(store.warming(), 3)
+                    self.assertEqual(self.client.get("/health/ready").status_code, 503)
+                    body = self.client.get("/transactions", headers=headers).json()
+                    self.assertEqual([tx["id"] for tx in body["data"]], ["tx_09", "tx_06", "tx_03", "tx_00"])
+                    self.assertEqual(store.warming(), 2)
+
+                    # Writes and journal replay only touch the wallets involved
+                    response = self.client.post("/wallet/transfer", json={"toUserId": "u_1", "amount": 100, "pin": "1111"}, headers=headers)
+                    self.assertEqual(response.status_code, 200)
+                    self.assertEqual(store.warming(), 1)
+                    db.reset_store()
+                    store = db.get_store()
+                    self.assertEqual(store.warming(), 1)
+                    self.assertEqual(len(store.get_wallet_transactions("w_1")), 5)
+
+                    # A lookup by id can be in any wallet
+                    self.assertEqual(self.client.patch("/transactions/tx_02/status", json={"status": "failed"}).status_code, 200)
+                    self.assertEqual(store.warming(), 0)
+                    self.assertEqual(self.client.get("/health/ready").json(), {"status": "ready"})
+
+                    db.JsonStore._warm = warm
+                    store.compact(force=True)
+                    db.reset_store()
+                    store = db.get_store()
+                    self.assertEqual(store.get_transaction("tx_02")["status"], "failed")
+                    self.assertEqual(len(store.to_dict()["transactions"]), 14)
+                    for _ in range(100):
+                        if not store.warming():
+                            break
+                        time.sleep(0.01)
+                    self.assertEqual(store.warming(), 0)
+        finally:
+            db.JsonStore._warm = warm
+            db.SNAPSHOT_FORMAT = "json"
+
+        # Back on the JSON format the binary snapshot is converted and removed
+        db.reset_store()
+        db.STORAGE_BACKEND = "json"
+        self.assertEqual(len(db.get_store().to_dict()["transactions"]), 14)
+        db.reset_store()
+        self.assertFalse(TEST_DB_PATH.with_suffix(".snap").exists())
+        with open(TEST_DB_PATH) as f:
+            self.assertEqual(len(json.load(f)["transactions"]), 14)
+
+    def test_user_search(self):
+        for backend in ("json", "sqlite"):
+            with self.subTest(backend=backend):
+                db.reset_store()
+                db.STORAGE_BACKEND = backend
+                with open(TEST_DB_PATH, "w") as f:
+                    json.dump(INITIAL_DB_STATE, f)
+                TEST_SQLITE_PATH.unlink(missing_ok=True)
+                names = ["Alice Brown", "Bob Alder", "alan Smith", "Carol King", "Alfred Alvarez"]
+                ids = {}
+                for i, name in enumerate(names):
+                    email = f"{name.split()[0].lower()}{i}@example.com"
+                    ids[name] = self.client.post("/auth/register", json={"name": name, "email": email, "password": "password123"}).json()["userId"]
+                headers = {"Authorization": f"Bearer mock-token-{ids['Carol King']}"}
+
+                self.assertEqual(self.client.get("/users/search", params={"q": "al"}).status_code, 401)
+                body = self.client.get("/users/search", params={"q": "AL"}, headers=headers).json()
+                self.assertEqual([u["name"] for u in body["data"]], ["alan Smith", "Bob Alder", "Alfred Alvarez", "Alice Brown"])
+                self.assertEqual(set(body["data"][0]), {"id", "name", "profileImage"})
+                # The full listing shows the same fields, never passwords or PINs
+                self.assertEqual(self.client.get("/users").status_code, 401)
+                listing = self.client.get("/users", headers=headers).json()
+                self.assertEqual(len(listing), len(names))
+                self.assertTrue(all(set(u) == {"id", "name", "profileImage"} for u in listing))
+
+                # Alfred matches by name, surname and email but is listed once across pages
+                seen = []
+                cursor = None
+                while True:
+                    params = {"q": "al", "limit": 1, **({"cursor": cursor} if cursor else {})}
+                    body = self.client.get("/users/search", params=params, headers=headers).json()
+                    seen += [u["id"] for u in body["data"]]
+                    cursor = body["nextCursor"]
+                    if not cursor:
+                        break
+                self.assertEqual(len(seen), 4)
+                self.assertEqual(len(set(seen)), 4)
+
+                self.client.put("/users/me", json={"name": "Alma King"}, headers=headers)
+                body = self.client.get("/users/search", params={"q": "alm"}, headers=headers).json()
+                self.assertEqual([u["id"] for u in body["data"]], [ids["Carol King"]])
+                body = self.client.get("/users/search", params={"q": "carol k"}, headers=headers).json()
+                self.assertEqual(body["data"], [])
+                body = self.client.get("/users/search", params={"q": "alice0@"}, headers=headers).json()
+                self.assertEqual([u["name"] for u in body["data"]], ["Alice Brown"])
+
+                self.client.delete("/auth/delete", headers={"Authorization": f"Bearer mock-token-{ids['Alice Brown']}"})
+                body = self.client.get("/users/search", params={"q": "alice"}, headers=headers).json()
+                self.assertEqual(body["data"], [])
+                self.assertEqual(self.client.get("/users/search", params={"cursor": "!!"}, headers=headers).status_code, 400)
+
+    def test_event_stream(self):
+        import asyncio
+        from events import EventBus, event_bus
+        from routers.events import stream_events
+
+        self._seed_users(["u_a", "u_b"])
+
+        def events_of(chunks):
+            return [(c.split("\n")[0][len("event: "):], json.loads(c.split("\n")[1][len("data: "):])) for c in chunks]
+
+        async def scenario():
+            response = await stream_events(user={"id": "u_b"})
+            body = response.body_iterator
+            self.assertTrue((await anext(body)).startswith("retry:"))
+            sender = event_bus.subscribe("u_a")
+
+            await asyncio.to_thread(self.client.post, "/wallet/transfer", json={"toUserId": "u_b", "amount": 100, "pin": "1111"},
+                                    headers={"Authorization": "Bearer mock-token-u_a"})
+            received = events_of([await anext(body), await anext(body)])
+            self.assertEqual(received[0][0], "transaction")
+            self.assertEqual((received[0][1]["type"], received[0][1]["fromUserId"]), ("credit", "u_a"))
+            self.assertEqual(received[1], ("balance", {"walletId": "w_u_b", "balance": 1100}))
+            sent = events_of(await sender.get(1))
+            self.assertEqual([e for e, _ in sent], ["transaction", "balance"])
+            self.assertEqual(sent[1][1]["balance"], 1000 - 102)
+
+            await asyncio.to_thread(self.client.patch, f"/transactions/{received[0][1]['id']}/status", json={"status": "failed"})
+            self.assertEqual(events_of([await anext(body)])[0][1]["status"], "failed")
+            await body.aclose()
+            event_bus.unsubscribe(sender)
+            self.assertEqual(event_bus.stats()["subscribers"], 0)
+
+            # A subscriber that stops reading is dropped instead of queueing forever
+            bus = EventBus(max_queue=3)
+            slow = bus.subscribe("u_a")
+            for i in range(10):
+                bus.publish("u_a", "balance", {"balance": i})
+            self.assertTrue(slow.dropped)
+            self.assertEqual(len(await slow.get(0)), 3)
+            self.assertEqual(bus.stats()["subscribers"], 0)
+
+        asyncio.run(scenario())
+
+    def test_conditional_gets(self):
+        self._seed_users(["u_a", "u_b"])
+        headers = {"Authorization": "Bearer mock-token-u_a", "X-Wallet-Pin": "1111"}
+        urls = ["/wallet", "/transactions", "/transactions/recent", "/users/me"]
+
+        etags = {}
+        for url in urls:
+            response = self.client.get(url, headers=headers)
+            self.assertEqual(response.status_code, 200)
+            etags[url] = response.headers["ETag"]
+            response = self.client.get(url, headers={**headers, "If-None-Match": etags[url]})
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response.content, b"")
+        # Validators are per wallet and per user, and the PIN is still checked
+        other = self.client.get("/wallet", headers={"Authorization": "Bearer mock-token-u_b", "X-Wallet-Pin": "1111", "If-None-Match": etags["/wallet"]})
+        self.assertEqual(other.status_code, 200)
+        # and per route and query: another listing of the same wallet is never a 304
+        for url in ["/transactions?status=failed", "/transactions?limit=5", "/transactions"]:
+            response = self.client.get(url, headers={**headers, "If-None-Match": etags["/transactions/recent"]})
+            self.assertEqual(response.status_code, 200)
+        response = self.client.get("/transactions?limit=5&status=failed", headers=headers)
+        response = self.client.get("/transactions?status=failed&limit=5", headers={**headers, "If-None-Match": response.headers["ETag"]})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(self.client.get("/wallet", headers={**headers, "X-Wallet-Pin": "0000", "If-None-Match": etags["/wallet"]}).status_code, 401)
+
+        # A transfer changes both wallets' resources, not the profile
+        self.client.post("/wallet/transfer", json={"toUserId": "u_b", "amount": 100, "pin": "1111"}, headers=headers)
+        for url in urls[:3]:
+            response = self.client.get(url, headers={**headers, "If-None-Match": etags[url]})
+            self.assertEqual(response.status_code, 200)
+            self.assertNotEqual(response.headers["ETag"], etags[url])
+        self.assertEqual(self.client.get("/wallet", headers={**headers, "If-None-Match": etags["/wallet"]}).status_code, 200)
+        self.assertEqual(self.client.get("/users/me", headers={**headers, "If-None-Match": etags["/users/me"]}).status_code, 304)
+        self.client.put("/users/me", json={"name": "Renamed"}, headers=headers)
+        response = self.client.get("/users/me", headers={**headers, "If-None-Match": etags["/users/me"]})
+        self.assertEqual(response.json()["name"], "Renamed")
+
+        # Validators from before a restart never match after it
+        etag = self.client.get("/wallet", headers=headers).headers["ETag"]
+        db.reset_store()
+        self.assertEqual(self.client.get("/wallet", headers={**headers, "If-None-Match": etag}).status_code, 200)
+
+    def test_session_cache(self):
+        self.client.post("/auth/register", json={"name": self.user_name, "email": self.user_email, "password": self.user_pass})
+        token = self.client.post("/auth/login", json={"email": self.user_email, "password": self.user_pass}).json()["token"]
+        headers = {"Authorization": f"Bearer {token}"}
+
+        before = sessions.stats()
+        self.client.get("/users/me", headers=headers)
+        self.client.get("/users/me", headers=headers)
+        after = self.client.get("/health/stats").json()["sessions"]
+        self.assertEqual(after["misses"] - before["misses"], 1)
+        self.assertEqual(after["hits"] - before["hits"], 1)
+
+        # Profile changes are visible right away, not after the TTL
+        self.client.put("/users/me", json={"name": "Renamed"}, headers=headers)
+        self.assertEqual(self.client.get("/users/me", headers=headers).json()["name"], "Renamed")
+
+        self.client.delete("/auth/delete", headers=headers)
+        self.assertEqual(self.client.get("/users/me", headers=headers).status_code, 401)
+
+    def test_group_commit_writer(self):
+        store = db.get_store()
+        store._writer.window = 0.05
+        start = threading.Barrier(16)
+
+        def worker(i):
+            start.wait()
+            with store.transaction():
+                store.put_user({"id": f"u_{i}", "name": "n", "email": f"{i}@example.com", "password": "x"})
+
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(16)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        # Concurrent commits shared flushes, and every one of them is durable
+        stats = self.client.get("/health/stats").json()["storage"]["writer"]
+        self.assertEqual(stats["records"], 16)
+        self.assertLess(stats["flushes"], 16)
+        self.assertEqual(sum(stats["batchSizes"].values()), stats["flushes"])
+        db.reset_store()
+        self.assertEqual(len(db.get_store().list_users()), 16)
+
+    def test_metrics_endpoint(self):
+        self.client.post("/auth/register", json={"name": self.user_name, "email": self.user_email, "password": self.user_pass})
+        self.client.delete("/transactions/tx_missing")
+        store = db.get_store()
+        store.compact(force=True)
+        store._compaction.join()
+
+        body = self.client.get("/metrics").text
+        self.assertIn('wallet_http_requests_total{method="POST",route="/auth/register",status="200"}', body)
+        # Path parameters are reported by template, not by value
+        self.assertIn('wallet_http_requests_total{method="DELETE",route="/transactions/{tx_id}",status="200"} 1', body)
+        self.assertIn('wallet_http_request_duration_seconds_bucket{method="POST",route="/auth/register",le="+Inf"}', body)
+        self.assertIn("wallet_http_requests_in_flight 1", body)
+        self.assertRegex(body, r'wallet_storage_bytes_total\{op="journal_flush"\} [1-9]')
+        self.assertRegex(body, r'wallet_storage_bytes_total\{op="read_db"\} [1-9]')
+        self.assertRegex(body, r'wallet_storage_duration_seconds_count\{op="snapshot"\} [1-9]')
+
+    def test_slow_request_profiler(self):
+        import tempfile
+        from profiler import SlowRequestProfiler
+
+        def busy(seconds):
+            deadline = time.perf_counter() + seconds
+            while time.perf_counter() < deadline:
+                pass
+
+        with tempfile.TemporaryDirectory() as directory:
+            profiler = SlowRequestProfiler(threshold=0.01, interval=0.001, directory=directory)
+            profile = profiler.begin("GET /slow")
+            worker = threading.Thread(target=busy, args=(0.1,))
+            worker.start()
+            worker.join()
+            path = profiler.end(profile, 0.1)
+            self.assertIn("tests.py:busy", Path(path).read_text())
+
+            # Fast requests leave nothing behind
+            self.assertIsNone(profiler.end(profiler.begin("GET /fast"), 0.001))
+
+    def test_transactions_export(self):
+        import csv
+        import io
+        from routers.transactions import EXPORT_FIELDS
+
+        transactions = [
+            {
+                "id": f"tx_{i:04d}",
+                "walletId": "w_1",
+                "type": "debit" if i % 3 else "credit",
+                "amount": i,
+                "fee": 0,
+                "status": "success",
+                "isDeleted": i % 50 == 0,
+                "createdAt": f"2026-02-{1 + i % 28:02d}T10:00:{i % 60:02d}Z"
+            }
+            for i in range(1200)
+        ]
+        state = {
+            "users": [{"id": "u_1", "name": "A", "email": "a@example.com", "password": "x", "walletId": "w_1"}],
+            "wallets": [{"id": "w_1", "userId": "u_1", "balance": 0, "currency": "INR"}],
+            "transactions": transactions
+        }
+        with open(TEST_DB_PATH, "w") as f:
+            json.dump(state, f)
+        db.reset_store()
+        headers = {"Authorization": "Bearer mock-token-u_1"}
+        live = sorted((t for t in transactions if not t["isDeleted"]), key=lambda t: (t["createdAt"], t["id"]))
+
+        response = self.client.get("/transactions/export", params={"format": "csv"}, headers=headers)
+        self.assertEqual(response.headers["content-encoding"], "gzip")
+        rows = list(csv.DictReader(io.StringIO(response.text)))
+        self.assertEqual([r["id"] for r in rows], [t["id"] for t in live])
+
+        response = self.client.get(
+            "/transactions/export",
+            params={"format": "ndjson", "type": "Received", "start_date": "2026-02-10"},
+            headers={**headers, "Accept-Encoding": "identity"}
+        )
+        self.assertNotIn("content-encoding", response.headers)
+        rows = [json.loads(line) for line in response.text.splitlines()]
+        self.assertEqual(rows, [t for t in live if t["type"] == "credit" and t["createdAt"] >= "2026-02-10"])
+
+        # A filter nothing matches still gets the header line
+        response = self.client.get("/transactions/export", params={"format": "csv", "start_date": "2027-01-01"}, headers=headers)
+        self.assertEqual(response.text.splitlines(), [",".join(EXPORT_FIELDS)])
+
+    def test_business_rules_cache(self):
+        with open(TEST_DB_PATH, "w") as f:
+            json.dump({**INITIAL_DB_STATE, "businessRules": {"feePercentage": 2, "maxTransferLimit": 500}}, f)
+        db.reset_store()
+
+        response = self.client.get("/config/business-rules")
+        self.assertEqual(response.json(), {"feePercentage": 2, "maxTransferLimit": 500, "version": 1})
+        etag = response.headers["ETag"]
+        response = self.client.get("/config/business-rules", headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 304)
+
+        response = self.client.put("/config/business-rules", json={"maxTransferLimit": 100})
+        self.assertEqual(response.json()["version"], 2)
+        self.assertNotEqual(response.headers["ETag"], etag)
+        response = self.client.get("/config/business-rules", headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["maxTransferLimit"], 100)
+
+        # Transfers see the new limit, and it survives a restart
+        self.client.post("/auth/register", json={"name": self.user_name, "email": self.user_email, "password": self.user_pass})
+        token = self.client.post("/auth/login", json={"email": self.user_email, "password": self.user_pass}).json()["token"]
+        headers = {"Authorization": f"Bearer {token}"}
+        self.client.post("/auth/set-pin", json={"pin": "1234"}, headers=headers)
+        self.client.post("/wallet/add-money", json={"amount": 1000, "pin": "1234"}, headers=headers)
+        response = self.client.post("/wallet/transfer", json={"toUserId": "u_other", "amount": 200, "pin": "1234"}, headers=headers)
+        self.assertEqual(response.json()["detail"], "Transfer limit exceeded")
+        db.reset_store()
+        self.assertEqual(self.client.get("/config/business-rules").json()["maxTransferLimit"], 100)
+
+    def test_write_admission(self):
+        from unittest import mock
+        import dependencies
+        self.addCleanup(setattr, dependencies, "ADMIN_TOKEN", dependencies.ADMIN_TOKEN)
+        dependencies.ADMIN_TOKEN = "admin-secret"
+        state = {
+            "users": [{"id": f"u_{i}", "name": str(i), "email": f"user{i}@example.com", "password": "x", "walletId": f"w_{i}", "pin": "1111"} for i in range(2)],
+            "wallets": [{"id": f"w_{i}", "userId": f"u_{i}", "balance": 1000, "currency": "INR"} for i in range(2)],
+            "transactions": [],
+            "businessRules": {"feePercentage": 2, "maxTransferLimit": 500, "writeRateLimit": 0.5, "writeBurstLimit": 2}
+        }
+        with open(TEST_DB_PATH, "w") as f:
+            json.dump(state, f)
+        db.reset_store()
+        first = {"Authorization": "Bearer mock-token-u_0"}
+        second = {"Authorization": "Bearer mock-token-u_1"}
+        rate_limited = writes_rejected.value(reason="rate_limited")
+
+        # A burst's worth goes through, then the caller waits for the bucket to refill
+        for _ in range(2):
+            response = self.client.post("/wallet/add-money", json={"amount": 10, "pin": "1111"}, headers=first)
+            self.assertEqual(response.status_code, 200)
+        response = self.client.post("/wallet/transfer", json={"toUserId": "u_1", "amount": 10, "pin": "1111"}, headers=first)
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response.headers["Retry-After"], "2")
+        self.assertEqual(db.get_store().get_wallet("w_0")["balance"], 1020)
+        # Other users have their own bucket, and reads are never limited
+        response = self.client.post("/wallet/add-money", json={"amount": 10, "pin": "1111"}, headers=second)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.get("/transactions", headers=first).status_code, 200)
+
+        # Limits change without a restart, but only for admins
+        limits = {"writeRateLimit": 0, "maxInFlightWrites": 1}
+        response = self.client.put("/config/business-rules", json=limits, headers=first)
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(db.get_store().rules["writeRateLimit"], 0.5)
+        response = self.client.put("/config/business-rules", json=limits, headers={"X-Admin-Token": "admin-secret"})
+        self.assertEqual(response.json()["maxTransferLimit"], 500)
+        response = self.client.post("/wallet/transfer", json={"toUserId": "u_1", "amount": 10, "pin": "1111"}, headers=first)
+        self.assertEqual(response.status_code, 200)
+
+        # Past the in-flight cap writes are shed at once, from the cached rules without opening the store
+        self.assertIsNone(write_admission.admit("u_9", {}))
+        try:
+            with mock.patch("main.get_store", side_effect=AssertionError("store read on the event loop")):
+                response = self.client.post("/wallet/add-money", json={"amount": 10, "pin": "1111"}, headers=second)
+        finally:
+            write_admission.release()
+        self.assertEqual(response.status_code, 503)
+        self.assertIn("Retry-After", response.headers)
+        response = self.client.post("/wallet/add-money", json={"amount": 10, "pin": "1111"}, headers=second)
+        self.assertEqual(response.status_code, 200)
+
+        self.assertEqual(writes_rejected.value(reason="rate_limited"), rate_limited + 1)
+        self.assertIn('wallet_writes_rejected_total{reason="overloaded"}', self.client.get("/metrics").text)
+        self.assertEqual(self.client.get("/health/stats").json()["writes"]["inFlight"], 0)
+
+    def test_idempotency_keys(self):
+        from models import TransferRequest
+        from routers.wallet import transfer_money
+
+        self._seed_users(["u_a", "u_b"])
+        store = db.get_store()
+        headers = {"Authorization": "Bearer mock-token-u_a", "Idempotency-Key": "add-1"}
+
+        first = self.client.post("/wallet/add-money", json={"amount": 100, "pin": "1111"}, headers=headers)
+        retry = self.client.post("/wallet/add-money", json={"amount": 100, "pin": "1111"}, headers=headers)
+        self.assertEqual(retry.json(), first.json())
+        self.assertEqual(retry.headers["Idempotent-Replayed"], "true")
+        self.assertEqual(store.get_wallet("w_u_a")["balance"], 1100)
+        response = self.client.post("/wallet/add-money", json={"amount": 999, "pin": "1111"}, headers=headers)
+        self.assertEqual(response.status_code, 422)
+
+        # Concurrent duplicates run once and all see the same answer
+        payload = TransferRequest(toUserId="u_b", amount=100, pin="1111")
+        responses = []
+        def send():
+            responses.append(transfer_money(payload, user=store.get_user("u_a"), idempotency_key="transfer-1"))
+        threads = [threading.Thread(target=send) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(len({r.body for r in responses}), 1)
+        self.assertEqual(store.get_wallet("w_u_b")["balance"], 1100)
+        self.assertEqual(len(store.get_wallet_transactions("w_u_a")), 2)
+
+        # Failures are remembered too, so a retry does not record a second attempt
+        headers["Idempotency-Key"] = "transfer-2"
+        for _ in range(2):
+            response = self.client.post("/wallet/transfer", json={"toUserId": "u_b", "amount": 600, "pin": "1111"}, headers=headers)
+            self.assertEqual(response.status_code, 400)
+        self.assertEqual(len(store.get_wallet_transactions("w_u_a")), 3)
+
+    def test_profile_image_uploads(self):
+        import images
+
+        self._seed_users(["u_a", "u_b"], pin=None)
+        store = db.get_store()
+        first, second = os.urandom(1000), os.urandom(1000)
+        created = []
+        def upload(uid, content, name="me.PNG"):
+            response = self.client.post("/users/me/image", files={"file": (name, content, "image/png")},
+                                        headers={"Authorization": f"Bearer mock-token-{uid}"})
+            if response.status_code == 200:
+                created.append(Path(response.json()["profileImage"]))
+            return response
+
+        try:
+            path_a = upload("u_a", first).json()["profileImage"]
+            self.assertRegex(path_a, r"^uploads/profiles/[0-9a-f]{64}\.png$")
+            # Identical content is stored once
+            self.assertEqual(upload("u_b", first).json()["profileImage"], path_a)
+
+            response = self.client.get(f"/{path_a}")
+            self.assertEqual(response.content, first)
+            self.assertEqual(response.headers["ETag"], f'"{Path(path_a).stem}"')
+            self.assertIn("immutable", response.headers["Cache-Control"])
+            response = self.client.get(f"/{path_a}", headers={"If-None-Match": response.headers["ETag"]})
+            self.assertEqual(response.status_code, 304)
+
+            # The old image goes once nobody refers to it
+            path_b = upload("u_a", second).json()["profileImage"]
+            self.assertTrue(Path(path_a).exists())
+            upload("u_b", second)
+            self.assertFalse(Path(path_a).exists())
+            self.assertEqual(store.get_user("u_b")["profileImage"], path_b)
+
+            saved = images.MAX_IMAGE_BYTES
+            images.MAX_IMAGE_BYTES = 500
+            try:
+                self.assertEqual(upload("u_a", os.urandom(501)).status_code, 413)
+            finally:
+                images.MAX_IMAGE_BYTES = saved
+            response = self.client.post("/users/me/image", content=b"x" * 100,
+                                        headers={"Authorization": "Bearer mock-token-u_a", "Content-Length": str(saved + 10**6)})
+            self.assertEqual(response.status_code, 413)
+            # Without a Content-Length the body is counted as it arrives
+            def chunks():
+                for _ in range(saved // images.CHUNK_SIZE + 2):
+                    yield b"x" * images.CHUNK_SIZE
+            response = self.client.post("/users/me/image", content=chunks(),
+                                        headers={"Authorization": "Bearer mock-token-u_a",
+                                                 "Content-Type": "multipart/form-data; boundary=b"})
+            self.assertEqual(response.status_code, 413)
+            self.assertEqual(response.json()["detail"], images.too_large().detail)
+            self.assertEqual([p for p in images.PROFILE_DIR.iterdir() if p.suffix == ".part"], [])
+        finally:
+            for path in created:
+                path.unlink(missing_ok=True)
+
+    def test_benchmark_smoke(self):
+        import tempfile
+        import benchmark
+
+        with tempfile.TemporaryDirectory() as data_dir:
+            result = benchmark.run(users=20, transactions=300, requests=20, concurrency=4, data_dir=data_dir)
+        self.assertEqual(set(result["endpoints"]), set(benchmark.ENDPOINTS))
+        for metrics in result["endpoints"].values():
+            self.assertEqual(metrics["errors"], 0)
+            self.assertLessEqual(metrics["p50Ms"], metrics["p99Ms"])
+        # The benchmark works on its own copy and leaves the test database alone
+        self.assertEqual(db.DB_PATH, TEST_DB_PATH)
+        self.assertEqual(db.get_store().list_users(), [])
+
 # --- Frontend Tests ---
 def run_frontend_build_test():
     print("\n" + "="*40)
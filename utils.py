@@ -1,8 +1,77 @@
-import uuid
+import base64
+import hashlib
+import json
+import os
+import threading
+import time
 from datetime import datetime
+from urllib.parse import urlencode
+
+from fastapi import HTTPException, Response
+
+_CROCKFORD = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+_RANDOM_BITS = 80
+_id_lock = threading.Lock()
+_last_id = (0, 0)
 
 def generate_id(prefix: str):
-    return f"{prefix}_{uuid.uuid4().hex[:8]}"
+    """``prefix`` plus a ULID: a 48-bit millisecond timestamp, then 80 random bits.
+
+    Written as 26 Crockford base32 characters, so ids sort by the time they
+    were made. Within one millisecond the random part counts up instead of
+    being drawn again, so a process never repeats an id or hands them out
+    out of order. Ids from before (eight hex digits) stay valid.
+    """
+    global _last_id
+    with _id_lock:
+        ms = time.time_ns() // 1_000_000
+        last_ms, last_random = _last_id
+        if ms <= last_ms and last_random + 1 < 1 << _RANDOM_BITS:
+            ms, random_part = last_ms, last_random + 1
+        else:
+            ms = max(ms, last_ms + 1)
+            random_part = int.from_bytes(os.urandom(_RANDOM_BITS // 8), "big")
+        _last_id = (ms, random_part)
+    value = ms << _RANDOM_BITS | random_part
+    return f"{prefix}_" + "".join(_CROCKFORD[(value >> shift) & 31] for shift in range(125, -1, -5))
 
 def now():
     return datetime.utcnow().isoformat() + "Z"
+
+def etag_matches(if_none_match, etag):
+    """Whether an If-None-Match header value covers ``etag`` (weak comparison)."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    candidates = (tag.strip() for tag in if_none_match.split(","))
+    return any(tag.removeprefix("W/") == etag.removeprefix("W/") for tag in candidates)
+
+def representation_etag(etag, request):
+    """``etag`` narrowed to the route and query of ``request``, for resources
+    that share one version but answer each URL differently."""
+    query = urlencode(sorted(request.query_params.multi_items()))
+    digest = hashlib.sha1(f"{request.url.path}?{query}".encode()).hexdigest()[:12]
+    return f'{etag[:-1]}-{digest}"'
+
+def not_modified(if_none_match, etag, response, cache_control="private, no-cache"):
+    """A 304 if the client already holds ``etag``; otherwise None, with the
+    validator set on ``response`` for the full answer."""
+    headers = {"ETag": etag, "Cache-Control": cache_control}
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return None
+
+def encode_cursor(key):
+    """Opaque token for a (sort value, id) position in a listing."""
+    raw = json.dumps(list(key), separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        value, item_id = json.loads(raw)
+        return (str(value), str(item_id))
+    except (ValueError, TypeError):
+        raise HTTPException(400, "Invalid cursor")
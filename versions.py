@@ -0,0 +1,35 @@
+import threading
+import uuid
+
+
+class Versions:
+    """Change counters for wallets and users, from which their GETs derive ETags.
+
+    Stores bump a key once the change to it is visible to readers, so a
+    handler that reads the version before the data never labels old data
+    with a new version. Counters start from zero in each process; the ETag
+    carries a per-store epoch so validators from before a restart never
+    match after it, and the key so one user's validator never matches
+    another's.
+
+    Workers sharing a store pass the shared store id as ``epoch`` and bump
+    to the generation of the commit (``to``) instead of counting, so every
+    worker labels the same data with the same version. ``floor`` raises
+    every version at once, after a worker reloads the whole store.
+    """
+
+    def __init__(self, epoch=None):
+        self.epoch = epoch or uuid.uuid4().hex[:8]
+        self.floor = 0
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def get(self, kind, key):
+        return max(self._counters.get((kind, key), 0), self.floor)
+
+    def bump(self, kind, key, to=None):
+        with self._lock:
+            self._counters[(kind, key)] = self.get(kind, key) + 1 if to is None else to
+
+    def etag(self, kind, key):
+        return f'"{kind}-{key}-{self.epoch}-{self.get(kind, key)}"'
@@ -0,0 +1,107 @@
+import threading
+import time
+
+
+class GroupCommitWriter:
+    """Single background thread that makes journal records durable in batches.
+
+    ``submit`` queues one record and blocks until the batch containing it
+    has been handed to ``flush`` (which writes and fsyncs the whole list at
+    once). After the first record of a batch arrives the writer waits up to
+    ``window`` seconds, or until ``max_batch`` records are queued, so that
+    concurrent commits share a single fsync.
+
+    ``flush`` errors are raised in every caller whose record was in the
+    failed batch. Batch sizes are counted in power-of-two buckets for
+    ``stats()``.
+    """
+
+    def __init__(self, flush, window=0.001, max_batch=256, name="db-writer"):
+        self.flush = flush
+        self.window = window
+        self.max_batch = max_batch
+        self.flushes = 0
+        self.records = 0
+        self.flush_seconds = 0.0
+        self.histogram = {}
+        self._pending = []
+        self._cond = threading.Condition()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def submit(self, record):
+        waiter = _Waiter(record)
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("writer is closed")
+            self._pending.append(waiter)
+            self._cond.notify_all()
+        waiter.done.wait()
+        if waiter.error is not None:
+            raise waiter.error
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._closed:
+                    self._cond.wait()
+                if not self._pending:
+                    return
+                deadline = time.monotonic() + self.window
+                while len(self._pending) < self.max_batch and not self._closed:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                batch = self._pending[:self.max_batch]
+                del self._pending[:self.max_batch]
+
+            started = time.perf_counter()
+            error = None
+            try:
+                self.flush([waiter.record for waiter in batch])
+            except Exception as exc:
+                error = exc
+            self._observe(len(batch), time.perf_counter() - started)
+            for waiter in batch:
+                waiter.error = error
+                waiter.done.set()
+
+    def _observe(self, size, seconds):
+        bucket = 1
+        while bucket < size:
+            bucket *= 2
+        with self._cond:
+            self.flushes += 1
+            self.records += size
+            self.flush_seconds += seconds
+            self.histogram[bucket] = self.histogram.get(bucket, 0) + 1
+
+    def stats(self):
+        with self._cond:
+            return {
+                "windowMs": self.window * 1000,
+                "maxBatch": self.max_batch,
+                "pending": len(self._pending),
+                "flushes": self.flushes,
+                "records": self.records,
+                "flushSeconds": round(self.flush_seconds, 6),
+                # Batch counts keyed by the smallest power of two >= batch size
+                "batchSizes": {str(size): n for size, n in sorted(self.histogram.items())},
+            }
+
+
+class _Waiter:
+    __slots__ = ("record", "done", "error")
+
+    def __init__(self, record):
+        self.record = record
+        self.done = threading.Event()
+        self.error = None